@@ -0,0 +1,156 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+from os.path import dirname, isfile, join
+import signal
+import time
+
+
+from cache import Cache
+from config import Config
+from energyestimator import EnergyEstimator
+from harmonicsscheduler import HarmonicsScheduler
+from instrumentation import Instrumentation
+from model import Model
+from portfolio import on_alarm, PlannerHistory, Portfolio, SolveTimeout
+from solutionstore import problem_hash, SolutionStore
+from system import System
+from traceoptimizer import TraceOptimizer
+from util import NanoException, Util
+from voxelmatrix import VoxelMatrix
+
+
+def read_resolution(filename):
+    with open(filename, 'rb') as ifile:
+        return ifile.read(Config.RESOLUTION_WIDTH_BYTES)[0]
+
+
+# Returns a problem's target and source models, given either of its files. Full round problems have a source
+# (<name>_src.mdl), a target (<name>_tgt.mdl), or both; without a target, the target is empty. Lightning
+# problems have no source, which is returned as None.
+def load_problem(filename, cache=None):
+    load = cache.load_model if cache else Model
+    name = Util.problem_name(filename)
+    src_filename = join(dirname(filename), f'{name}_src.mdl')
+    tgt_filename = join(dirname(filename), f'{name}_tgt.mdl')
+    source = load(src_filename) if isfile(src_filename) else None
+    if isfile(tgt_filename) or source is None:
+        return load(tgt_filename if isfile(tgt_filename) else filename), source
+    return Model(tgt_filename, matrix=VoxelMatrix(source.resolution)), source
+
+
+# Returns the model files of a problem, given either of them
+def problem_files(filename):
+    name = Util.problem_name(filename)
+    filenames = {filename} | {join(dirname(filename), f'{name}_{kind}.mdl') for kind in ['src', 'tgt']}
+    return sorted(f for f in filenames if isfile(f))
+
+
+# Loads, solves and simulates one problem, and submits its trace to the SolutionStore in odir if it's valid,
+# which keeps it as <odir>/<model>.nbt if it's the best so far. Decoded models are read through the cache in
+# cache_dir, if given. If Config.PORTFOLIO_WORKERS is set, the registered planners race with that many worker
+# processes (see Portfolio), each with three quarters of the timeout, and their wins are recorded in
+# <odir>/history. If Config.PROFILE_DIR is set, the simulation is instrumented, and its report and profile are
+# written there as <model>.json and <model>.pstats. Runs in a worker process. Returns a summary of the result,
+# with a lower bound on the energy, the reason for any failure in 'error', and whether the trace improved on
+# the best in 'improved'.
+def solve_model(filename, odir, timeout=None, cache_dir=None):
+    start = time.perf_counter()
+    name = Util.problem_name(filename)
+    summary = {'model': name, 'resolution': None, 'energy': None, 'lower_bound': None, 'planner': None,
+               'valid': False, 'improved': False, 'error': None, 'seconds': None}
+    if timeout:
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        cache = Cache(cache_dir) if cache_dir else None
+        m, source = load_problem(filename, cache)
+        model_hash = problem_hash(problem_files(filename), cache and cache.file_hash)
+        summary['resolution'] = m.resolution
+        summary['lower_bound'] = EnergyEstimator(m, source).lower_bound()
+        s = System(m, source)
+        if Config.PORTFOLIO_WORKERS:
+            portfolio = Portfolio(m, source, workers=Config.PORTFOLIO_WORKERS, timeout=timeout and timeout * 0.75,
+                                  history=PlannerHistory(join(odir, 'history')))
+            trace, _, summary['planner'] = portfolio.solve()
+            if trace is None:
+                raise NanoException('No planner found a valid trace')
+        else:
+            trace, _ = TraceOptimizer(m, source).optimize(s.find_solution())
+            trace, _ = HarmonicsScheduler(m, source).schedule(trace)
+            summary['planner'] = 'default'
+        if Config.PROFILE_DIR:
+            instrumentation = Instrumentation()
+            energy, valid = instrumentation.run(s, trace, join(Config.PROFILE_DIR, f'{name}.pstats'))
+            with open(join(Config.PROFILE_DIR, f'{name}.json'), 'w') as ofile:
+                json.dump(instrumentation.report(), ofile, indent=2)
+        else:
+            energy, valid = s.run(trace)
+        summary['energy'] = energy
+        summary['valid'] = valid
+        summary['error'] = s.error
+        if valid:
+            summary['improved'] = SolutionStore(odir).submit(name, trace, energy, summary['planner'], model_hash,
+                                                             summary['lower_bound'])
+    except (NanoException, OSError, SolveTimeout) as e:
+        summary['error'] = str(e) or type(e).__name__
+    except Exception as e:  # E.g. a MemoryError, or a bug in a planner: fail this model, not the batch
+        summary['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+# Solves the models in parallel, one process per worker (by default, one per core). The largest models
+# are started first, so that they don't leave the pool waiting on them at the end. Writes a JSON summary
+# of each model's energy and wall time, and returns the list of model summaries.
+#
+# With a resolve_ratio, only models whose best trace in odir's SolutionStore uses more than resolve_ratio times
+# the lower bound on their energy, or that have none, are solved; the others are listed in the summary as
+# skipped.
+def solve_all(filenames, odir=None, workers=None, timeout=None, summary_filename=None, cache_dir=None,
+              resolve_ratio=None):
+    odir = odir or Util.MY_TRACE_DIR()
+    workers = workers or Config.BATCH_WORKERS or os.cpu_count()
+    timeout = timeout or Config.BATCH_TIMEOUT_SECONDS
+    summary_filename = summary_filename or join(odir, 'summary.json')
+    filenames = sorted(filenames, key=read_resolution, reverse=True)
+    skipped = []
+    if resolve_ratio:
+        store = SolutionStore(odir)
+        file_hash = Cache(cache_dir).file_hash if cache_dir else None
+        for filename in list(filenames):
+            name = Util.problem_name(filename)
+            if not store.needs_solving(name, problem_hash(problem_files(filename), file_hash), resolve_ratio):
+                filenames.remove(filename)
+                skipped.append(name)
+
+    start = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(solve_model, f, odir, timeout, cache_dir): f for f in filenames}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                error = f'Worker died: {e}' if isinstance(e, BrokenProcessPool) else f'{type(e).__name__}: {e}'
+                summary = {'model': Util.problem_name(futures[future]), 'resolution': None, 'energy': None,
+                           'lower_bound': None, 'planner': None, 'valid': False, 'improved': False,
+                           'error': error, 'seconds': None}
+            summaries.append(summary)
+            if Config.VERBOSE:
+                status = summary['energy'] if summary['valid'] else summary['error']
+                print(f'{summary["model"]}: {status} ({summary["seconds"]}s)')
+
+    summaries.sort(key=lambda s: s['model'])
+    result = {'workers': workers,
+              'seconds': round(time.perf_counter() - start, 3),
+              'total_energy': sum(s['energy'] for s in summaries if s['valid']),
+              'models': summaries,
+              'skipped': sorted(skipped)}
+    with open(summary_filename, 'w') as ofile:
+        json.dump(result, ofile, indent=2)
+    return summaries
@@ -0,0 +1,215 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+from os.path import isdir, isfile, join
+import platform
+import resource
+import sys
+import time
+
+
+import numpy as np
+
+
+from batch import read_resolution
+from columnartrace import Trace
+from config import Config
+from groundedness import Groundedness
+from model import Model
+from slabplanner import SlabPlanner
+from system import System
+from tracecodec import TraceCodec
+from util import Util
+
+
+# Spans the resolutions of the Lightning models, 20 through 220
+BENCHMARK_RESOLUTIONS = [20, 60, 100, 160, 220]
+BENCHES = ['model_decode', 'plan', 'trace_encode', 'trace_decode', 'simulate', 'groundedness']
+REGRESSION_THRESHOLD = 0.1  # Relative change in throughput or peak RSS reported as a regression
+REPEAT = 3
+
+
+# Returns a grounded model of resolution R: columns rising from y = 0 to a smooth random height map
+def synthetic_model(R, seed=0):
+    rng = np.random.default_rng(seed)
+    coarse = rng.random((R // 8 + 2, R // 8 + 2))
+    heights = np.kron(coarse, np.ones((8, 8)))[:R - 2, :R - 2]
+    heights = (heights * (R - 2) * 0.75).astype(np.int64)
+    full = np.zeros((R, R, R), dtype=np.bool_)
+    full[1:R - 1, :R - 1, 1:R - 1] = (np.arange(R - 1)[None, :, None] < heights[:, None, :])
+    return Model.encode_matrix(full)
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+# Returns the best of repeat timings of fn(), and its result
+def _best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+# Runs the benches on one model, in its own process, so that its peak RSS is its own. source is either
+# ('synthetic', R) or ('problem', model filename, trace filename or None). Returns a list of results.
+def run_case(source, benches, repeat=REPEAT):
+    if source[0] == 'synthetic':
+        R = source[1]
+        name = f'synthetic-{R}'
+        data = synthetic_model(R)
+        trace_filename = None
+    else:
+        _, filename, trace_filename = source
+        name = Util.problem_name(filename)
+        with open(filename, 'rb') as ifile:
+            data = ifile.read()
+    results = []
+
+    def record(bench, size, unit, seconds, **extra):
+        result = {'bench': bench, 'model': name, 'resolution': data[0], 'size': int(size), 'unit': unit,
+                  'seconds': round(seconds, 6), 'throughput': round(size / seconds, 1) if seconds else None,
+                  'peak_rss_mb': _peak_rss_mb()}
+        result.update(extra)
+        results.append(result)
+
+    R = data[0]
+    seconds, model = _best_time(lambda: Model(f'{name}.mdl', data), repeat)
+    if 'model_decode' in benches:
+        record('model_decode', R**3, 'voxels/s', seconds)
+    full_count = model.matrix.count_full()
+    if 'groundedness' in benches:
+        seconds, _ = _best_time(Groundedness(model.matrix).rebuild, repeat)
+        record('groundedness', full_count, 'voxels/s', seconds)
+
+    if trace_filename:
+        trace = Trace.read(trace_filename)
+    else:
+        seconds, trace = _best_time(SlabPlanner(model).plan, 1)
+        if 'plan' in benches:
+            record('plan', full_count, 'voxels/s', seconds)
+    seconds, encoded = _best_time(lambda: TraceCodec.encode(trace), repeat)
+    if 'trace_encode' in benches:
+        record('trace_encode', trace.cmd_count, 'cmds/s', seconds)
+    if 'trace_decode' in benches:
+        seconds, _ = _best_time(lambda: TraceCodec.decode_arrays(encoded), repeat)
+        record('trace_decode', trace.cmd_count, 'cmds/s', seconds)
+    if 'simulate' in benches:
+        seconds, (energy, valid) = _best_time(lambda: System(model).run(trace), 1)
+        record('simulate', trace.cmd_count, 'cmds/s', seconds, energy=energy, valid=valid)
+    return results
+
+
+# Returns the problem models to benchmark, as sources for run_case: for each resolution bucket, the
+# problem file with the closest resolution, with its default trace, if there is one
+def problem_sources(problem_dir, resolutions, trace_dir=None):
+    filenames = sorted(join(problem_dir, f) for f in os.listdir(problem_dir) if f.endswith('.mdl'))
+    by_resolution = {}
+    for filename in filenames:
+        by_resolution.setdefault(read_resolution(filename), filename)
+    chosen = []
+    for R in resolutions:
+        if by_resolution:
+            closest = min(by_resolution, key=lambda r: abs(r - R))
+            if by_resolution[closest] not in chosen:
+                chosen.append(by_resolution[closest])
+    sources = []
+    for filename in chosen:
+        trace_filename = None
+        if trace_dir:
+            candidate = join(trace_dir, f'{Util.problem_name(filename)}.nbt')
+            trace_filename = candidate if isfile(candidate) else None
+        sources.append(('problem', filename, trace_filename))
+    return sources
+
+
+# Runs the benchmarks, one model at a time, and returns a report for writing as JSON
+def run_benchmarks(resolutions=None, problem_dir=None, trace_dir=None, benches=None, repeat=REPEAT):
+    resolutions = resolutions or BENCHMARK_RESOLUTIONS
+    benches = benches or BENCHES
+    sources = [('synthetic', R) for R in resolutions]
+    if problem_dir and isdir(problem_dir):
+        sources += problem_sources(problem_dir, resolutions, trace_dir)
+    results = []
+    for source in sources:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            case_results = pool.submit(run_case, source, benches, repeat).result()
+        results.extend(case_results)
+        if Config.VERBOSE:
+            print(f'{case_results[0]["model"]}: {len(case_results)} benches', file=sys.stderr)
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'repeat': repeat, 'results': results}
+
+
+# Compares two reports, writing a line for each result in both. Returns the list of regressions: results
+# whose throughput fell, or whose peak RSS grew, by more than the threshold.
+def compare(old, new, ofile, threshold=REGRESSION_THRESHOLD):
+    old_results = {(r['bench'], r['model']): r for r in old['results']}
+    regressions = []
+    ofile.write(f'{"bench":14} {"model":16} {"old":>14} {"new":>14} {"ratio":>7} {"rss ratio":>9}\n')
+    for r in new['results']:
+        key = (r['bench'], r['model'])
+        o = old_results.get(key)
+        if o is None or not o['throughput'] or not r['throughput']:
+            continue
+        ratio = r['throughput'] / o['throughput']
+        rss_ratio = r['peak_rss_mb'] / o['peak_rss_mb'] if o['peak_rss_mb'] else 1.0
+        flags = []
+        if ratio < 1 - threshold:
+            flags.append('SLOWER')
+        if rss_ratio > 1 + threshold:
+            flags.append('MORE MEMORY')
+        if flags:
+            regressions.append((key, flags))
+        ofile.write(f'{key[0]:14} {key[1]:16} {o["throughput"]:14.0f} {r["throughput"]:14.0f} {ratio:7.2f} '
+                    f'{rss_ratio:9.2f} {" ".join(flags)}\n')
+    ofile.write(f'{len(regressions)} regression(s)\n')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark', description='Time decoding, planning and simulation')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='Run the benchmarks, and write the results as JSON')
+    p.add_argument('-o', '--output', help='JSON file to write (default: standard output)')
+    p.add_argument('--resolutions', type=int, nargs='+', help=f'Default: {BENCHMARK_RESOLUTIONS}')
+    p.add_argument('--benches', nargs='+', choices=BENCHES, help='Default: all')
+    p.add_argument('--problems', help='Directory of problem models (default: the project\'s, if set)')
+    p.add_argument('--traces', help='Directory of their default traces (default: the project\'s, if set)')
+    p.add_argument('--repeat', type=int, default=REPEAT, help='Timings to take the best of')
+    p = commands.add_parser('compare', help='Compare two runs, and flag regressions')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.old) as ifile:
+            old = json.load(ifile)
+        with open(args.new) as ifile:
+            new = json.load(ifile)
+        return 1 if compare(old, new, sys.stdout, args.threshold) else 0
+
+    problem_dir = args.problems
+    trace_dir = args.traces
+    if 'PROJECT_DIR' in os.environ:
+        problem_dir = problem_dir or Util.MODEL_DIR()
+        trace_dir = trace_dir or Util.ICFP_TRACE_DIR()
+    report = run_benchmarks(args.resolutions, problem_dir, trace_dir, args.benches, args.repeat)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as ofile:
+            ofile.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import numpy as np
+
+
+from cmdop import CmdOp
+from columnartrace import Trace
+from util import NanoException, Util, Vec
+
+
+MAX_LLD = 15
+MAX_SLD = 5
+
+
+# One bot's commands, in columnar form, for the consecutive time steps starting at step `start` (the step
+# after the bot's creation). Positions are (x, y, z) tuples, tracked as commands are added. Planners build
+# one BotPlan per bot, and merge() interleaves them into a trace.
+class BotPlan:
+    def __init__(self, bid, pos, start=0, seeds=None):
+        self.bid = bid
+        self.pos = tuple(pos)
+        self.start = start
+        self.seeds = list(seeds or [])
+        self.ops = []
+        self.nds = []
+        self.args = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    # The step after this bot's last command so far
+    @property
+    def end(self):
+        return self.start + len(self.ops)
+
+    def add(self, op, nd=0, args=(0, 0, 0, 0)):
+        self.ops.append(op)
+        self.nds.append(nd)
+        self.args.append(args)
+
+    def fill(self, dx, dy, dz):
+        self.add(CmdOp.Fill, Util.encode_ncd(Vec(dx, dy, dz)))
+
+    # Creates a bot at pos + (dx, dy, dz), with the next m + 1 seeds, and returns its plan. The child's
+    # first command is in the step after the fission.
+    def fission(self, dx, dy, dz, m):
+        if m + 1 > len(self.seeds):
+            raise NanoException(f'Bot {self.bid} has too few seeds for fission')
+        self.add(CmdOp.Fission, Util.encode_ncd(Vec(dx, dy, dz)), (m, 0, 0, 0))
+        x, y, z = self.pos
+        child = BotPlan(self.seeds[0], (x + dx, y + dy, z + dz), self.end, self.seeds[1:m + 1])
+        self.seeds = self.seeds[m + 1:]
+        return child
+
+    def flip(self):
+        self.add(CmdOp.Flip)
+
+    # The primary absorbs the secondary at pos + (dx, dy, dz). Both commands are added in the same step,
+    # after padding whichever bot is behind with Waits.
+    def fuse(self, secondary):
+        step = max(self.end, secondary.end)
+        self.wait_until(step)
+        secondary.wait_until(step)
+        x, y, z = self.pos
+        sx, sy, sz = secondary.pos
+        self.add(CmdOp.FusionP, Util.encode_ncd(Vec(sx - x, sy - y, sz - z)))
+        secondary.add(CmdOp.FusionS, Util.encode_ncd(Vec(x - sx, y - sy, z - sz)))
+        self.seeds = sorted(self.seeds + [secondary.bid] + secondary.seeds)
+
+    def gfill(self, nd, fd):
+        self.add(CmdOp.GFill, Util.encode_ncd(nd), (fd.x + 30, fd.y + 30, fd.z + 30, 0))
+
+    def gvoid(self, nd, fd):
+        self.add(CmdOp.GVoid, Util.encode_ncd(nd), (fd.x + 30, fd.y + 30, fd.z + 30, 0))
+
+    def halt(self):
+        self.add(CmdOp.Halt)
+
+    # Moves to (x, y, z) one axis at a time, in the given order of axes. Each leg is split into SMoves of
+    # up to 15, and consecutive short legs along different axes are combined into LMoves. The caller is
+    # responsible for the path being clear.
+    def move_to(self, x, y, z, order='xyz'):
+        target = (x, y, z)
+        pos = list(self.pos)
+        waypoints = []
+        for axis in order:
+            k = 'xyz'.index(axis)
+            pos[k] = target[k]
+            waypoints.append(tuple(pos))
+        self.move_path(waypoints)
+
+    # Moves through a list of (x, y, z) waypoints, each differing from the last along at most one axis
+    def move_path(self, waypoints):
+        legs = []
+        pos = self.pos
+        for waypoint in waypoints:
+            for k, axis in enumerate('xyz'):
+                d = waypoint[k] - pos[k]
+                while d:
+                    step = max(-MAX_LLD, min(MAX_LLD, d))
+                    legs.append((axis, step))
+                    d -= step
+            pos = tuple(waypoint)
+        self.move_legs(legs)
+
+    # Moves along a list of (axis, distance) legs, with axes 'x', 'y' or 'z' and distances of up to 15
+    def move_legs(self, legs):
+        k = 0
+        while k < len(legs):
+            axis1, d1 = legs[k]
+            if k + 1 < len(legs):
+                axis2, d2 = legs[k + 1]
+                if axis1 != axis2 and abs(d1) <= MAX_SLD and abs(d2) <= MAX_SLD:
+                    self.lmove(axis1, d1, axis2, d2)
+                    k += 2
+                    continue
+            self.smove(axis1, d1)
+            k += 1
+
+    def lmove(self, axis1, d1, axis2, d2):
+        a1 = 'xyz'.index(axis1)
+        a2 = 'xyz'.index(axis2)
+        self.add(CmdOp.LMove, 0, (a1 + 1, d1 + MAX_SLD, a2 + 1, d2 + MAX_SLD))
+        pos = list(self.pos)
+        pos[a1] += d1
+        pos[a2] += d2
+        self.pos = tuple(pos)
+
+    def smove(self, axis, d):
+        a = 'xyz'.index(axis)
+        self.add(CmdOp.SMove, 0, (a + 1, d + MAX_LLD, 0, 0))
+        pos = list(self.pos)
+        pos[a] += d
+        self.pos = tuple(pos)
+
+    def void(self, dx, dy, dz):
+        self.add(CmdOp.Void, Util.encode_ncd(Vec(dx, dy, dz)))
+
+    def wait(self, n=1):
+        self.ops.extend([CmdOp.Wait] * n)
+        self.nds.extend([0] * n)
+        self.args.extend([(0, 0, 0, 0)] * n)
+
+    def wait_until(self, step):
+        if step > self.end:
+            self.wait(step - self.end)
+
+
+# Interleaves bot plans into a Trace. Each time step holds the command of every bot that's active in it, in
+# order of bid.
+def merge(plans):
+    plans = [p for p in plans if len(p)]
+    if not plans:
+        return Trace.empty()
+    steps = np.concatenate([np.arange(p.start, p.end) for p in plans])
+    bids = np.concatenate([np.full(len(p), p.bid) for p in plans])
+    order = np.lexsort((bids, steps))
+    ops = np.concatenate([np.array(p.ops, dtype=np.uint8) for p in plans])[order]
+    nds = np.concatenate([np.array(p.nds, dtype=np.uint8) for p in plans])[order]
+    args = np.concatenate([np.array(p.args, dtype=np.uint8).reshape(-1, 4) for p in plans])[order]
+    return Trace(ops, nds, args)
+
+
+# Pads bot plans with Waits so that their next commands are in the same step
+def sync(plans):
+    step = max(p.end for p in plans)
+    for p in plans:
+        p.wait_until(step)
@@ -0,0 +1,234 @@
+from collections import deque
+from itertools import permutations
+
+
+import numpy as np
+
+
+from botplan import BotPlan, merge, sync
+from slabplanner import SlabPlanner
+from util import NanoException, Vec
+
+
+MAX_BOX_SIDE = 30
+TEAM_SIZE = 4
+INITIAL_SEEDS = list(range(2, 41))
+
+
+# Greedily decomposes a boolean voxel array into axis-aligned boxes of up to max_side voxels per side.
+# Scanning layers bottom up, each box starts at the first voxel not yet covered, and grows as far as it
+# can along z, then x, then y. Returns a list of inclusive (x0, y0, z0, x1, y1, z1) boxes, sorted by y0.
+def decompose_boxes(full, max_side=MAX_BOX_SIDE):
+    R = full.shape[0]
+    remaining = np.array(full, dtype=np.bool_)
+    boxes = []
+    for y in range(R):
+        layer = remaining[:, y, :]
+        for idx in np.flatnonzero(layer).tolist():
+            x, z = divmod(idx, R)
+            if not layer[x, z]:
+                continue
+            row = layer[x, z:z + max_side]
+            zl = len(row) if row.all() else int(np.argmin(row))
+            xl = 1
+            while xl < max_side and x + xl < R and layer[x + xl, z:z + zl].all():
+                xl += 1
+            yl = 1
+            while yl < max_side and y + yl < R and remaining[x:x + xl, y + yl, z:z + zl].all():
+                yl += 1
+            remaining[x:x + xl, y:y + yl, z:z + zl] = False
+            boxes.append((x, y, z, x + xl - 1, y + yl - 1, z + zl - 1))
+    return boxes
+
+
+# Builds a model with a team of four bots and group fills.
+#
+# The model is decomposed into boxes, and each box is filled one layer at a time, as rectangles. The team
+# works bottom up, hovering one voxel above the layer being filled, where nothing has been filled yet. For
+# each rectangle, bots move to the points above its corners (2 or 4 of them, or 1 for a single voxel),
+# and fill it with one synchronized GFill (or a Fill). The trace is built in High harmonics. Models too small
+# for the team to line up in are left to SlabPlanner.
+class BoxPlanner:
+    def __init__(self, model):
+        self.model = model
+
+    # Candidate paths from (px, pz) to (qx, qz) in a plane of constant y: straight along each axis in
+    # either order, then detours through nearby rows and columns. Each path is a list of (x, z) waypoints.
+    def _candidate_paths(self, p, q):
+        R = self.model.resolution
+        (px, pz), (qx, qz) = p, q
+        yield [(qx, pz), (qx, qz)]
+        yield [(px, qz), (qx, qz)]
+        for offset in (1, -1, 2, -2, 3, -3):
+            for z in (pz + offset, qz + offset):
+                if 0 <= z < R:
+                    yield [(px, z), (qx, z), (qx, qz)]
+            for x in (px + offset, qx + offset):
+                if 0 <= x < R:
+                    yield [(x, pz), (x, qz), (qx, qz)]
+
+    @staticmethod
+    def _path_cells(p, path):
+        cells = {p}
+        x, z = p
+        for wx, wz in path:
+            while (x, z) != (wx, wz):
+                x += (wx > x) - (wx < x)
+                z += (wz > z) - (wz < z)
+                cells.add((x, z))
+        return cells
+
+    # A shortest path from p to q that avoids the blocked cells, found by breadth-first search, as the
+    # waypoints where it turns, or None
+    def _search_path(self, p, q, blocked):
+        R = self.model.resolution
+        previous = {p: None}
+        queue = deque([p])
+        while queue and q not in previous:
+            x, z = queue.popleft()
+            for c in ((x + 1, z), (x - 1, z), (x, z + 1), (x, z - 1)):
+                if 0 <= c[0] < R and 0 <= c[1] < R and c not in blocked and c not in previous:
+                    previous[c] = (x, z)
+                    queue.append(c)
+        if q not in previous:
+            return None
+        cells = [q]
+        while cells[-1] != p:
+            cells.append(previous[cells[-1]])
+        cells.reverse()
+        return [c for k, c in enumerate(cells[1:], 1) if k == len(cells) - 1
+                or (cells[k + 1][0] - c[0], cells[k + 1][1] - c[1]) != (c[0] - cells[k - 1][0], c[1] - cells[k - 1][1])]
+
+    # Returns the first candidate path from p to q that avoids the blocked cells, or else a searched one, with
+    # its cells
+    def _find_path(self, p, q, blocked):
+        for path in self._candidate_paths(p, q):
+            cells = BoxPlanner._path_cells(p, path)
+            if not cells & blocked:
+                return path, cells
+        path = self._search_path(p, q, blocked)
+        if path is None:
+            return None, None
+        return path, BoxPlanner._path_cells(p, path)
+
+    # Moves bots (in the plane where they hover) so that one is over each of the destinations, given as
+    # (x, z) points. Bots already over a destination stay there. The others are matched to the remaining
+    # destinations, and move at the same time if their paths are disjoint, or else one at a time.
+    def move_team(self, bots, destinations):
+        y = bots[0].pos[1]
+        current = [(b.pos[0], b.pos[2]) for b in bots]
+        free = [d for d in destinations if d not in current]
+        movers = [k for k, p in enumerate(current) if p not in destinations]
+        if not free:
+            return
+        best = None
+        for chosen in permutations(movers, len(free)):
+            cost = sum(abs(current[k][0] - d[0]) + abs(current[k][1] - d[1]) for k, d in zip(chosen, free))
+            if best is None or cost < best[0]:
+                best = (cost, chosen)
+        moves = list(zip(best[1], free))
+
+        blocked = set(current) | set(free)
+        paths = []
+        for k, d in moves:
+            path, cells = self._find_path(current[k], d, blocked - {current[k], d})
+            if path is None:
+                break
+            blocked |= cells
+            paths.append((k, path))
+        if len(paths) == len(moves):
+            for k, path in paths:
+                bots[k].move_path([(x, y, z) for x, z in path])
+            sync(bots)
+            return
+
+        # One at a time, each time the first that can move
+        while moves:
+            for k, d in moves:
+                others = {(b.pos[0], b.pos[2]) for j, b in enumerate(bots) if j != k}
+                path, _ = self._find_path((bots[k].pos[0], bots[k].pos[2]), d, others)
+                if path is not None:
+                    break
+            else:
+                raise NanoException(f'BoxPlanner: No path for bot {bots[k].bid} to {d}')
+            sync(bots)
+            bots[k].move_path([(x, y, z) for x, z in path])
+            moves.remove((k, d))
+        sync(bots)
+
+    # Moves a bot alone, in the plane where it hovers, while the others wait
+    def _move_alone(self, bots, bot, destination):
+        others = {(b.pos[0], b.pos[2]) for b in bots if b is not bot}
+        path, _ = self._find_path((bot.pos[0], bot.pos[2]), destination, others)
+        if path is None:
+            raise NanoException(f'BoxPlanner: No path for bot {bot.bid} to {destination}')
+        sync(bots)
+        y = bot.pos[1]
+        bot.move_path([(x, y, z) for x, z in path])
+
+    # Moves the bots, one at a time, so that the k-th is over (k, 0), and they can fuse in the reverse order
+    # of their Fissions, which makes the trace reversible (see DisassemblyPlanner). A bot in the way is
+    # first moved aside, off the line.
+    def line_up(self, bots):
+        R = self.model.resolution
+        for k, bot in enumerate(bots):
+            destination = (k, 0)
+            occupied = {(b.pos[0], b.pos[2]): b for b in bots}
+            if occupied.get(destination) is bot:
+                continue
+            other = occupied.get(destination)
+            if other is not None:
+                spare = min(((x, z) for x in range(R) for z in range(1, R) if (x, z) not in occupied),
+                            key=lambda c: abs(c[0] - other.pos[0]) + abs(c[1] - other.pos[2]))
+                self._move_alone(bots, other, spare)
+            self._move_alone(bots, bot, destination)
+        sync(bots)
+
+    def plan(self):
+        R = self.model.resolution
+        full = self.model.matrix.to_array()
+        if R < TEAM_SIZE + 1:
+            return SlabPlanner(self.model).plan()  # Too small for the team to line up
+        root = BotPlan(1, (0, 0, 0), seeds=INITIAL_SEEDS)
+        if not full.any():
+            root.halt()
+            return merge([root])
+
+        layers = {}
+        for x0, y0, z0, x1, y1, z1 in decompose_boxes(full):
+            for y in range(y0, y1 + 1):
+                layers.setdefault(y, []).append((x0, x1, z0, z1))
+
+        root.flip()
+        root.move_to(0, 1, 0)
+        bots = [root]
+        for k in range(1, TEAM_SIZE):
+            bots.append(bots[-1].fission(1, 0, 0, TEAM_SIZE - 1 - k))
+        sync(bots)
+
+        for y in sorted(layers):
+            for bot in bots:
+                bot.move_to(bot.pos[0], y + 1, bot.pos[2], order='y')
+            sync(bots)
+            for x0, x1, z0, z1 in sorted(layers[y]):
+                corners = [(x, z) for x in sorted({x0, x1}) for z in sorted({z0, z1})]
+                self.move_team(bots, corners)
+                for bot in bots:
+                    x, _, z = bot.pos
+                    if (x, z) not in corners:
+                        continue
+                    if len(corners) == 1:
+                        bot.fill(0, -1, 0)
+                    else:
+                        bot.gfill(Vec(0, -1, 0), Vec(x0 + x1 - 2 * x, 0, z0 + z1 - 2 * z))
+                sync(bots)
+
+        # Line the bots up along z = 0, and fuse them into the one at x = 0
+        self.line_up(bots)
+        for k in range(TEAM_SIZE - 1, 0, -1):
+            bots[k - 1].fuse(bots[k])
+        last = bots[0]
+        last.move_to(0, 0, 0, order='y')
+        last.flip()
+        last.halt()
+        return merge(bots)
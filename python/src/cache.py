@@ -0,0 +1,134 @@
+import hashlib
+import os
+from os.path import abspath, getsize, isdir, join
+import shutil
+import tempfile
+
+
+import numpy as np
+
+
+from columnartrace import Trace
+from config import Config
+from model import Model
+from tracecodec import TraceCodec
+from util import Util
+from voxelmatrix import VoxelMatrix
+
+
+HASH_CHUNK_BYTES = 1 << 20
+
+
+# On-disk cache of decoded models (packed voxel matrices) and traces (columnar arrays), stored as .npy files
+# and loaded as read-only memory maps, so that worker processes share one copy through the page cache.
+#
+# Entries are keyed by a hash of the source file's contents, so an entry can't go stale: a changed file
+# gets a new key, and its old entry ages out. To avoid re-hashing unchanged files, each source path's hash
+# is remembered along with its size and modification time. Loading an entry marks it as recently used,
+# and storing one evicts the least recently used entries until the cache fits in max_bytes.
+#
+# Entries and stamps are written to temporary names and then renamed, so concurrent processes never see
+# partial entries.
+class Cache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or Util.CACHE_DIR()
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        self.entries_dir = join(self.directory, 'entries')
+        self.stamps_dir = join(self.directory, 'stamps')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.stamps_dir, exist_ok=True)
+
+    def _entry_size(self, entry_dir):
+        try:
+            return sum(getsize(join(entry_dir, f)) for f in os.listdir(entry_dir))
+        except OSError:
+            return 0
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            entry_dir = join(self.entries_dir, name)
+            try:
+                entries.append((os.stat(entry_dir).st_mtime_ns, entry_dir))
+            except OSError:
+                pass
+        sizes = {entry_dir: self._entry_size(entry_dir) for _, entry_dir in entries}
+        total = sum(sizes.values())
+        for _, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= sizes[entry_dir]
+
+    # Returns the memory-mapped arrays of an entry, or None if it isn't cached.
+    def _load(self, key, names):
+        entry_dir = join(self.entries_dir, key)
+        if not isdir(entry_dir):
+            return None
+        try:
+            arrays = [np.load(join(entry_dir, f'{name}.npy'), mmap_mode='r') for name in names]
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def _store(self, key, names, arrays):
+        entry_dir = join(self.entries_dir, key)
+        tmp_dir = tempfile.mkdtemp(dir=self.entries_dir, prefix='.tmp-')
+        try:
+            for name, a in zip(names, arrays):
+                np.save(join(tmp_dir, f'{name}.npy'), a)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:  # Most likely another process stored it first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._evict()
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.stamps_dir, exist_ok=True)
+
+    # Returns the SHA-256 digest of a file's contents, reusing the last one computed for the same path if
+    # the file's size and modification time haven't changed.
+    def file_hash(self, filename):
+        st = os.stat(filename)
+        stamp = f'{st.st_size} {st.st_mtime_ns}'
+        stamp_filename = join(self.stamps_dir, hashlib.sha256(abspath(filename).encode()).hexdigest())
+        try:
+            with open(stamp_filename) as ifile:
+                old_stamp, digest = ifile.read().rsplit(' ', 1)
+            if old_stamp == stamp:
+                return digest
+        except (OSError, ValueError):
+            pass
+
+        h = hashlib.sha256()
+        with open(filename, 'rb') as ifile:
+            for chunk in iter(lambda: ifile.read(HASH_CHUNK_BYTES), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        fd, tmp_filename = tempfile.mkstemp(dir=self.stamps_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as ofile:
+            ofile.write(f'{stamp} {digest}')
+        os.replace(tmp_filename, stamp_filename)
+        return digest
+
+    def load_model(self, filename):
+        key = 'mdl-' + self.file_hash(filename)
+        arrays = self._load(key, ['matrix'])
+        if arrays is None:
+            model = Model(filename)
+            self._store(key, ['matrix'], [model.matrix._bits])
+            return model
+        bits = arrays[0]
+        return Model(filename, matrix=VoxelMatrix(bits.shape[0], bits.reshape(-1)))
+
+    # Returns a trace as a Trace
+    def load_trace(self, filename):
+        key = 'nbt-' + self.file_hash(filename)
+        names = ['ops', 'nds', 'args']
+        arrays = self._load(key, names)
+        if arrays is None:
+            arrays = TraceCodec.read_arrays(filename)
+            self._store(key, names, arrays)
+        return Trace(*arrays)
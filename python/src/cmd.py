@@ -1,7 +1,6 @@
 from abc import ABC, abstractmethod
 
 
-from fillstate import FillState
 from util import Util, Vec
 
 
@@ -10,8 +9,14 @@ class Cmd(ABC):
     def __str__(self):
         pass
 
-    @abstractmethod
     def bytes_repr(self):
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
+    # Appends the command's encoding to a bytearray
+    @abstractmethod
+    def encode_into(self, buf):
         pass
 
     @abstractmethod
@@ -27,19 +32,11 @@ class CmdFill(Cmd):
     def __str__(self):
         return f'Fill {self.nd}'
 
-    def bytes_repr(self):
-        return bytes([Util.encode_nd(self.nd) & 3])
+    def encode_into(self, buf):
+        buf.append((Util.encode_ncd(self.nd) << 3) | 0b011)
 
     def execute(self):
-        bot = self.system.current_bot()
-        pos_fill = self.system.current_bot().pos + self.nd
-        Util.nano_assert_is_valid(pos_fill)
-
-        if self.system.matrix[pos_fill] == FillState.Void:
-            self.system.matrix[pos_fill] = FillState.Full
-            self.system.energy_used += Config.COST_FILL_VOID
-        else:  # FillState.Full
-            self.system.energy_used += Config.COST_FILL_FULL
+        self.system.exec_fill(self.system.current_bot(), Util.encode_ncd(self.nd), None)
 
 
 class CmdFission(Cmd):
@@ -51,26 +48,12 @@ class CmdFission(Cmd):
     def __str__(self):
         return f'Fission {self.nd} | {self.m}'
 
-    def bytes_repr(self):
-        b1 = (Util.encode_nd(self.nd) << 5) & 5
-        b2 = m
-        return bytes([b1, b2])
+    def encode_into(self, buf):
+        buf.append((Util.encode_ncd(self.nd) << 3) | 0b101)
+        buf.append(self.m)
 
     def execute(self):
-        bot = self.system.current_bot()
-        Util.nano_assert(len(bot.seeds) > 0)
-
-        n = len(bid.seeds)
-        seeds = self.system.current_bot().seeds.copy()
-        # TODO
-        bot_new.bid = seeds[0]
-        bot_new.seeds = seeds[2: m + 1]
-        bot_new.pos = bot.pos + nd
-
-        bot.seeds = seeds[m + 1: n]
-
-        self.system.bots = self.system.bots + [bot_new]
-        self.system.energy_used += 24
+        self.system.exec_fission(self.system.current_bot(), Util.encode_ncd(self.nd), [self.m])
 
 
 class CmdFlip(Cmd):
@@ -80,12 +63,11 @@ class CmdFlip(Cmd):
     def __str__(self):
         return 'Flip'
 
-    def bytes_repr(self):
-        return bytes([0b1111_1101])
+    def encode_into(self, buf):
+        buf.append(0b1111_1101)
 
     def execute(self):
-        bot = self.system.current_bot()
-        self.harmonics = self.harmonics.next()
+        self.system.exec_flip(self.system.current_bot(), None, None)
 
 
 class CmdFusionP(Cmd):
@@ -96,16 +78,11 @@ class CmdFusionP(Cmd):
     def __str__(self):
         return f'FusionP {self.nd}'
 
-    def bytes_repr(self):
-        return bytes([(self.nd << 3) & 7])
+    def encode_into(self, buf):
+        buf.append((Util.encode_ncd(self.nd) << 3) | 0b111)
 
-    def execute(self):  # TODO
-        bot = self.system.current_bot()
-        bot_s = [b for b in self.system.bots if bot.pos + self.nd == b.pos]
-        # TODO: Assert that bot_s's Cmd is CmdFusionS, and that its CmdFusionS's matches.
-        bot.seeds = bot.seeds + [bot_s.bid] + bot_s.seeds
-        self.system.bots = [b for b in self.system.bots if b != bot_s]
-        self.system.energy_used -= Config.COST_FUSION
+    def execute(self):
+        self.system.exec_fusionp(self.system.current_bot(), Util.encode_ncd(self.nd), None)
 
 
 class CmdFusionS(Cmd):
@@ -116,12 +93,11 @@ class CmdFusionS(Cmd):
     def __str__(self):
         return f'FusionS {self.nd}'
 
-    def bytes_repr(self):
-        return bytes([(self.nd << 3) & 6])
+    def encode_into(self, buf):
+        buf.append((Util.encode_ncd(self.nd) << 3) | 0b110)
 
     def execute(self):
-        # bot = self.system.current_bot()
-        pass  # See CmdFusionP.execute()
+        self.system.exec_fusions(self.system.current_bot(), Util.encode_ncd(self.nd), None)
 
 
 class CmdGFill(Cmd):
@@ -133,16 +109,13 @@ class CmdGFill(Cmd):
     def __str__(self):
         return f'GFill {self.nd} {self.fd}'
 
-    def bytes_repr(self):
-        b1 = (self.nd << 5) & 0b001
-        b2 = Util.encode_fd(self.fd.x)
-        b3 = Util.encode_fd(self.fd.y)
-        b4 = Util.encode_fd(self.fd.z)
-        return bytes([b1, b2, b3, b4])
+    def encode_into(self, buf):
+        fd = Util.encode_fd(self.fd)
+        buf += bytes([(Util.encode_ncd(self.nd) << 3) | 0b001, fd.x, fd.y, fd.z])
 
     def execute(self):
-        bot = self.system.current_bot()
-        pass  # TODO
+        fd = Util.encode_fd(self.fd)
+        self.system.exec_gfill(self.system.current_bot(), Util.encode_ncd(self.nd), [fd.x, fd.y, fd.z])
 
 
 class CmdGVoid(Cmd):
@@ -154,12 +127,13 @@ class CmdGVoid(Cmd):
     def __str__(self):
         return f'GVoid {self.nd} {self.fd}'
 
-    def bytes_repr(self):
-        return bytes([self.nd << 5])
+    def encode_into(self, buf):
+        fd = Util.encode_fd(self.fd)
+        buf += bytes([(Util.encode_ncd(self.nd) << 3) | 0b000, fd.x, fd.y, fd.z])
 
     def execute(self):
-        bot = self.system.current_bot()
-        pass  # TODO
+        fd = Util.encode_fd(self.fd)
+        self.system.exec_gvoid(self.system.current_bot(), Util.encode_ncd(self.nd), [fd.x, fd.y, fd.z])
 
 
 class CmdHalt(Cmd):
@@ -169,12 +143,11 @@ class CmdHalt(Cmd):
     def __str__(self):
         return 'Halt'
 
-    def bytes_repr(self):
-        return bytes([0b1111_1111])
+    def encode_into(self, buf):
+        buf.append(0b1111_1111)
 
     def execute(self):
-        # bot = self.system.current_bot()
-        pass
+        self.system.exec_halt(self.system.current_bot(), None, None)
 
 
 # There are 90 long linear coordinate differences
@@ -185,24 +158,18 @@ class CmdLMove(Cmd):
         self.sld2 = sld2
 
     def __str__(self):
-        return 'LMove {self.sld1} {self.sld2}'
+        return f'LMove {self.sld1} {self.sld2}'
 
-    def bytes_repr(self):
+    def encode_into(self, buf):
         a1, i1 = Util.encode_sld(self.sld1)
         a2, i2 = Util.encode_sld(self.sld2)
-        b1 = (a2 << 6) & (a1 << 4) & 6
-        b2 = (i2 << 4) & (i1 << 4)
-        return bytes([b1, b2])
+        buf.append((a2 << 6) | (a1 << 4) | 0b1100)
+        buf.append((i2 << 4) | i1)
 
     def execute(self):
-        bot = self.system.current_bot()
-        pos0 = self.pos
-        pos1 = self.pos + sldp1
-        pos2 = pos1 + sld2
-        Util.nano_assert_region(pos0, pos1, lambda p: p.is_empty())
-        Util.nano_assert_region(pos1, pos2, lambda p: p.is_empty())
-        bot.pos = pos2
-        self.system.energy_used += 2 * (sld1.mlen() + 2 + sld2.mlen())
+        a1, i1 = Util.encode_sld(self.sld1)
+        a2, i2 = Util.encode_sld(self.sld2)
+        self.system.exec_lmove(self.system.current_bot(), None, [a1, i1, a2, i2])
 
 
 # There are 30 short linear coordinate differences
@@ -214,16 +181,13 @@ class CmdSMove(Cmd):
     def __str__(self):
         return f'SMove {self.lld}'
 
-    def bytes_repr(self):
+    def encode_into(self, buf):
         a, i = Util.encode_lld(self.lld)
-        b1 = (a << 4) & 7
-        b2 = i
-        return bytes([b1, b2])
+        buf.append((a << 4) | 0b0100)
+        buf.append(i)
 
     def execute(self):
-        bot = self.system.current_bot()
-        bot.pos = bot.pos + self.lld
-        self.system.energy_used += 2 * self.lld.mlen()
+        self.system.exec_smove(self.system.current_bot(), None, list(Util.encode_lld(self.lld)))
 
 
 class CmdVoid(Cmd):
@@ -234,20 +198,11 @@ class CmdVoid(Cmd):
     def __str__(self):
         return f'Void {self.nd}'
 
-    def bytes_repr(self):
-        b = (Util.encode_ncd(self.nd) << 3) & 0b010
-        return bytes([b])
+    def encode_into(self, buf):
+        buf.append((Util.encode_ncd(self.nd) << 3) | 0b010)
 
     def execute(self):
-        s = self.system
-        bot = s.current_bot()
-        pos_new = bot.pos + self.nd
-        m = s.matrix
-        if m[pos_new] == FillState.Full:
-           m[pos_new] = FillState.Void
-           s.energy -= 12
-        else: # m[pos] == Void
-            s.energy += 3
+        self.system.exec_void(self.system.current_bot(), Util.encode_ncd(self.nd), None)
 
 
 # No system state change
@@ -258,10 +213,8 @@ class CmdWait(Cmd):
     def __str__(self):
         return 'Wait'
 
-    def bytes_repr(self):
-        return bytes([0b1111_1110])
+    def encode_into(self, buf):
+        buf.append(0b1111_1110)
 
     def execute(self):
-        bot = self.system.current_bot()
-        pass  # TODO
-
+        self.system.exec_wait(self.system.current_bot(), None, None)
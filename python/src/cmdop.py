@@ -0,0 +1,17 @@
+from enum import IntEnum
+
+
+# Compact command codes used by the columnar (array) form of a trace.
+class CmdOp(IntEnum):
+    Halt = 0
+    Wait = 1
+    Flip = 2
+    SMove = 3
+    LMove = 4
+    FusionP = 5
+    FusionS = 6
+    Fission = 7
+    Fill = 8
+    Void = 9
+    GFill = 10
+    GVoid = 11
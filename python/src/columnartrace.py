@@ -0,0 +1,221 @@
+import numpy as np
+
+
+from cmdop import CmdOp
+from deltas import ND_DELTAS
+from tracecodec import TraceCodec
+from util import NanoException
+
+
+INITIAL_SEEDS = list(range(2, 41))
+
+
+# Returns the index of each time step's first command in a trace, with the trace's length appended. The
+# number of active bots starts at 1, and changes after each step by its Fissions and FusionSs.
+def step_starts(ops):
+    ops = ops.tolist() if isinstance(ops, np.ndarray) else list(ops)
+    starts = []
+    k = 0
+    n = 1
+    while k < len(ops) and n > 0:
+        starts.append(k)
+        step = ops[k:k + n]
+        k += n
+        n += step.count(CmdOp.Fission) - step.count(CmdOp.FusionS)
+        if CmdOp.Halt in step:
+            break
+    starts.append(min(k, len(ops)))
+    return np.array(starts, dtype=np.int64)
+
+
+# Returns the displacement of each command's bot, as an (N, 3) array: nonzero only for SMoves and LMoves
+def displacements(ops, args):
+    result = np.zeros((len(ops), 3), dtype=np.int64)
+    rows = np.arange(len(ops))
+    is_smove = ops == CmdOp.SMove
+    axes = args[:, 0].astype(np.int64) - 1
+    result[rows[is_smove], axes[is_smove]] += args[is_smove, 1].astype(np.int64) - 15
+    is_lmove = ops == CmdOp.LMove
+    result[rows[is_lmove], axes[is_lmove]] += args[is_lmove, 1].astype(np.int64) - 5
+    axes2 = args[:, 2].astype(np.int64) - 1
+    result[rows[is_lmove], axes2[is_lmove]] += args[is_lmove, 3].astype(np.int64) - 5
+    return result
+
+
+# Returns the voxel at near coordinate difference nd from pos, or pos itself if nd is invalid, as it's left for
+# the simulator to reject
+def _near(pos, nd):
+    dx, dy, dz = ND_DELTAS[nd] or (0, 0, 0)
+    return (pos[0] + dx, pos[1] + dy, pos[2] + dz)
+
+
+TRACK_CHUNK_CMDS = 1 << 16  # Commands tracked at a time, as Python objects, before they're stored in arrays
+
+
+# Follows the bots through a trace, without checking it, as its commands are fed to it, in any number of
+# chunks. Commands after the last bot halts or fuses are attributed to bid 0, at position (-1, -1, -1). The
+# one thing rejected, with a NanoException, is a Fission by a bot without seeds, which leaves no bid to follow.
+class BotTracker:
+    def __init__(self):
+        self.bots = [[1, (0, 0, 0), list(INITIAL_SEEDS)]]  # [bid, pos, seeds] of each active bot, by bid
+        self.step = 0
+        self._index = 0  # Of the next bot to command in this step
+        self._spawned = []
+        self._finished = set()
+
+    # Returns, for each command, the bid of its bot, its step, and its bot's position before it, as a uint8
+    # array, an int32 array and an (N, 3) int16 array: 7 bytes per command
+    def track(self, ops, nds, args):
+        bids = np.zeros(len(ops), dtype=np.uint8)
+        steps = np.zeros(len(ops), dtype=np.int32)
+        positions = np.full((len(ops), 3), -1, dtype=np.int16)
+        for first in range(0, len(ops), TRACK_CHUNK_CMDS):
+            chunk = slice(first, first + TRACK_CHUNK_CMDS)
+            bids[chunk], steps[chunk], positions[chunk] = self._track(ops[chunk], nds[chunk], args[chunk])
+        return bids, steps, positions
+
+    def _track(self, ops, nds, args):
+        moves = displacements(ops, args).tolist()
+        ops = ops.tolist()
+        nds = nds.tolist()
+        args = args.tolist()
+        bids = []
+        steps = []
+        positions = []
+        bots = self.bots
+        for k, op in enumerate(ops):
+            if not bots:
+                bids.append(0)
+                steps.append(self.step)
+                positions.append((-1, -1, -1))
+                continue
+            bot = bots[self._index]
+            bid, pos, seeds = bot
+            nd = nds[k]
+            bids.append(bid)
+            steps.append(self.step)
+            positions.append(pos)
+            if op in (CmdOp.SMove, CmdOp.LMove):
+                dx, dy, dz = moves[k]
+                bot[1] = (pos[0] + dx, pos[1] + dy, pos[2] + dz)
+            elif op == CmdOp.Fission:
+                if not seeds:
+                    raise NanoException(f'Fission without seeds by bot {bid} at step {self.step}')
+                m = args[k][0]
+                self._spawned.append([seeds[0], _near(pos, nd), seeds[1:m + 1]])
+                bot[2] = seeds[m + 1:]
+            elif op == CmdOp.FusionP:
+                other = _near(pos, nd)
+                for b in bots:
+                    if b[1] == other:
+                        bot[2] = sorted(seeds + [b[0]] + b[2])
+            elif op in (CmdOp.FusionS, CmdOp.Halt):
+                self._finished.add(bid)
+            self._index += 1
+            if self._index == len(bots):
+                bots = sorted([b for b in bots if b[0] not in self._finished] + self._spawned)
+                self.bots = bots
+                self.step += 1
+                self._index = 0
+                self._spawned = []
+                self._finished = set()
+        return bids, steps, np.array(positions, dtype=np.int16).reshape(-1, 3)
+
+
+# A trace in columnar form: the (ops, nds, args) arrays described in TraceCodec, as a tuple, so that it
+# unpacks like one and is accepted wherever one is. A command takes 6 bytes, rather than the hundreds of
+# a Cmd object, which are only created when asked for, by cmds().
+#
+# Slicing by time step, or taking one bot's commands, needs the trace's step boundaries or bots, which are
+# found without validating the trace. The step boundaries are cached; the bots, at 7 bytes per command, are
+# found again on each call, so as not to more than double the trace's memory for as long as it lives.
+class Trace(tuple):
+    def __new__(cls, ops, nds, args):
+        ops = np.ascontiguousarray(ops, dtype=np.uint8)
+        nds = np.ascontiguousarray(nds, dtype=np.uint8)
+        args = np.ascontiguousarray(args, dtype=np.uint8).reshape(-1, 4)
+        return super().__new__(cls, (ops, nds, args))
+
+    def __add__(self, other):
+        return Trace.concat([self, other])
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __repr__(self):
+        return f'Trace(cmds={self.cmd_count}, bytes={self.nbytes})'
+
+    @property
+    def ops(self):
+        return self[0]
+
+    @property
+    def nds(self):
+        return self[1]
+
+    @property
+    def args(self):
+        return self[2]
+
+    @property
+    def cmd_count(self):
+        return len(self[0])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self)
+
+    # Returns, for each command, the bid of its bot, its step, and its bot's position before it, as arrays
+    # (see BotTracker.track)
+    def bots(self):
+        return BotTracker().track(*self)
+
+    # Returns the commands of one bot, in order
+    def bot(self, bid):
+        keep = np.flatnonzero(self.bots()[0] == bid)
+        return Trace(self[0][keep], self[1][keep], self[2][keep])
+
+    # Lazily yields the commands as Cmd objects
+    def cmds(self, system=None):
+        return TraceCodec.iter_decode(TraceCodec.encode(self), system=system)
+
+    @staticmethod
+    def concat(traces):
+        traces = list(traces)
+        if not traces:
+            return Trace.empty()
+        return Trace(*(np.concatenate([t[k] for t in traces]) for k in range(3)))
+
+    def encode(self):
+        return TraceCodec.encode(self)
+
+    @staticmethod
+    def empty():
+        return Trace(np.zeros(0), np.zeros(0), np.zeros((0, 4)))
+
+    @staticmethod
+    def from_cmds(cmds):
+        return Trace(*TraceCodec.decode_arrays(TraceCodec.encode(list(cmds))))
+
+    @staticmethod
+    def read(filename):
+        return Trace(*TraceCodec.read_arrays(filename))
+
+    @property
+    def step_count(self):
+        return len(self.step_starts()) - 1
+
+    def step_starts(self):
+        if getattr(self, '_starts', None) is None:
+            self._starts = step_starts(self[0])
+        return self._starts
+
+    # Returns the commands of steps [first, last), as views of this trace's arrays
+    def steps(self, first, last=None):
+        starts = self.step_starts()
+        last = first + 1 if last is None else last
+        chunk = slice(starts[first], starts[min(last, len(starts) - 1)])
+        return Trace(self[0][chunk], self[1][chunk], self[2][chunk])
+
+    def write(self, filename):
+        TraceCodec.write_trace(filename, self)
@@ -1,4 +1,11 @@
 class Config:
+    BATCH_TIMEOUT_SECONDS = 600  # Per model
+    BATCH_WORKERS = None  # One per core
+
+    CACHE_MAX_BYTES = 4 << 30
+
+    COST_BOT_PER_STEP = 20
+
     COST_FILL_FULL = 6
     COST_FILL_VOID = 12
 
@@ -6,6 +13,21 @@ class Config:
 
     COST_FUSION = 24
 
+    COST_HARMONICS_HIGH = 30  # Per voxel (R**3) per time step
+    COST_HARMONICS_LOW = 3
+
+    COST_LMOVE_EXTRA = 2  # Charged like two extra units of distance
+    COST_MOVE = 2  # Per unit of Manhattan distance
+
+    COST_VOID_FULL = -12
+    COST_VOID_VOID = 3
+
+    DEBUG_CHECKS = False  # Operand type checks in Pos and Vec arithmetic
+
+    PORTFOLIO_WORKERS = 0  # Per model: if nonzero, batch runs race every planner that applies (see Portfolio)
+
+    PROFILE_DIR = None  # If set, batch runs write each model's simulation report and cProfile stats here
+
     RESOLUTION_WIDTH_BYTES = 1
 
     VERBOSE = False
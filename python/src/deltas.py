@@ -0,0 +1,112 @@
+import numpy as np
+
+
+from util import Util, Vec
+
+
+def _frozen(a):
+    a = np.array(a, dtype=np.int64)
+    a.flags.writeable = False
+    return a
+
+
+def _linear_deltas(max_step_size):
+    steps = [k for k in range(-max_step_size, max_step_size + 1) if k != 0]
+    return [(k, 0, 0) for k in steps] + [(0, k, 0) for k in steps] + [(0, 0, k) for k in steps]
+
+
+_UNIT = [-1, 0, 1]
+_NEIGHBOR = [(dx, dy, dz) for dx in _UNIT for dy in _UNIT for dz in _UNIT if (dx, dy, dz) != (0, 0, 0)]
+_ND = [d for d in _NEIGHBOR if sum(map(abs, d)) <= 2]
+_SLD = _linear_deltas(5)
+_LLD = _linear_deltas(15)
+_FACE = [d for d in _NEIGHBOR if sum(map(abs, d)) == 1]
+
+# Coordinate differences, as read-only (K, 3) offset arrays and as tuples of Vecs, in the same order:
+#   ND: the 18 near coordinate differences (each coordinate in [-1, 1], Manhattan length 1 or 2)
+#   SLD: the 30 short linear coordinate differences (length 1 to 5 along one axis)
+#   LLD: the 90 long linear coordinate differences (length 1 to 15 along one axis)
+#   NEIGHBOR: the 26 differences to the voxels surrounding a voxel
+#   FACE: the 6 differences to the voxels sharing a face with a voxel
+ND_OFFSETS = _frozen(_ND)
+SLD_OFFSETS = _frozen(_SLD)
+LLD_OFFSETS = _frozen(_LLD)
+NEIGHBOR_OFFSETS = _frozen(_NEIGHBOR)
+FACE_OFFSETS = _frozen(_FACE)
+
+ND_VECS = tuple(Vec(*d) for d in _ND)
+SLD_VECS = tuple(Vec(*d) for d in _SLD)
+LLD_VECS = tuple(Vec(*d) for d in _LLD)
+NEIGHBOR_VECS = tuple(Vec(*d) for d in _NEIGHBOR)
+
+# Encoded fields of each difference, in the same order: nd for ND, and (a, i) for SLD and LLD
+ND_CODES = _frozen([Util.encode_ncd(v) for v in ND_VECS])
+SLD_CODES = _frozen([Util.encode_sld(v) for v in SLD_VECS])
+LLD_CODES = _frozen([Util.encode_lld(v) for v in LLD_VECS])
+
+
+def _by_nd(deltas, codes):
+    table = [None] * 32
+    for delta, nd in zip(deltas, codes.tolist()):
+        table[nd] = delta
+    return table
+
+
+def _moves_by_code(deltas, codes, size):
+    table = [None] + [[None] * size for _ in range(3)]
+    for delta, (a, i) in zip(deltas, codes.tolist()):
+        table[a][i] = delta + (sum(map(abs, delta)),)
+    return table
+
+
+# The differences indexed by their encoded fields, for decoding commands; invalid encodings map to None:
+#   ND_DELTAS[nd]: (dx, dy, dz)
+#   SLD_MOVES[a][i] and LLD_MOVES[a][i]: linear moves, as (dx, dy, dz, mlen)
+#   FACE_DIRECTIONS: the FACE differences, as (axis, sign), by axis, the positive one first
+ND_DELTAS = _by_nd(_ND, ND_CODES)
+SLD_MOVES = _moves_by_code(_SLD, SLD_CODES, 16)
+LLD_MOVES = _moves_by_code(_LLD, LLD_CODES, 32)
+FACE_DIRECTIONS = sorted(((axis, d[axis]) for d in _FACE for axis in range(3) if d[axis]), key=lambda d: (d[0], -d[1]))
+
+
+# Returns x·R² + y·R + z for each row of an (..., 3) array: packed voxel indices for coordinates, or the
+# differences between packed indices for offsets.
+def packed(coords, resolution):
+    R = resolution
+    return (coords[..., 0] * R + coords[..., 1]) * R + coords[..., 2]
+
+
+# Vectorized Model.is_coord_valid, over an (..., 3) array of coordinates: the voxels that can be Full in a
+# target model. Returns a boolean array of the leading shape.
+def coords_valid(coords, resolution):
+    R = resolution
+    x, y, z = coords[..., 0], coords[..., 1], coords[..., 2]
+    return (1 <= x) & (x <= R - 2) & (0 <= y) & (y <= R - 2) & (1 <= z) & (z <= R - 2)
+
+
+# Vectorized test that an (..., 3) array of coordinates lies in the matrix
+def coords_in_bounds(coords, resolution):
+    return np.all((coords >= 0) & (coords < resolution), axis=-1)
+
+
+# Adds each of the K offsets to each of N positions (an (N, 3) array). Returns the (N, K, 3) array of
+# results, and an (N, K) mask of the results that are in bounds (or, if valid_only is True, that pass
+# coords_valid).
+def apply_offsets(positions, offsets, resolution, valid_only=False):
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+    results = positions[:, None, :] + offsets[None, :, :]
+    if valid_only:
+        return results, coords_valid(results, resolution)
+    return results, coords_in_bounds(results, resolution)
+
+
+# Returns the distinct in-bounds neighbours (of the 26) of N positions, as an (M, 3) array, optionally
+# excluding the positions themselves.
+def neighbor_coords(positions, resolution, valid_only=False, exclude_positions=True):
+    R = resolution
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+    results, mask = apply_offsets(positions, NEIGHBOR_OFFSETS, R, valid_only=valid_only)
+    cells = np.unique(packed(results[mask], R))
+    if exclude_positions:
+        cells = np.setdiff1d(cells, packed(positions, R), assume_unique=False)
+    return np.stack(np.unravel_index(cells, (R, R, R)), axis=-1)
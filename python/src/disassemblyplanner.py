@@ -0,0 +1,104 @@
+import numpy as np
+
+
+from boxplanner import BoxPlanner
+from cmdop import CmdOp
+from columnartrace import _near, INITIAL_SEEDS, Trace
+from util import NanoException
+
+
+# The command undoing each command, in a reversed trace. FusionS has none: a Fission's child is created by
+# its parent's command alone, and so the FusionP undoing it needs a FusionS, added for the child.
+INVERSE_OPS = np.array([CmdOp.Halt, CmdOp.Wait, CmdOp.Flip, CmdOp.SMove, CmdOp.LMove, CmdOp.Fission, CmdOp.Wait,
+                        CmdOp.FusionP, CmdOp.Void, CmdOp.Fill, CmdOp.GVoid, CmdOp.GFill], dtype=np.uint8)
+
+
+# Returns the trace that runs a trace backwards in time: from the state it ends in, before its final Halt,
+# back to the state it starts in, followed by a Halt. A trace building a model from nothing becomes one
+# dismantling it, through the same matrices in reverse order, and so grounded in the same steps, with the
+# same bot positions and volatile voxels in each step.
+#
+# Each step is replaced by one undoing it: moves are reversed, Fills become Voids and GFills GVoids (and vice
+# versa), and Flips stay Flips. A Fission becomes a fusion of the parent and child, and a fusion a Fission of
+# the secondary bot, as long as its bid and seeds are the primary's lowest after fusing, so that the Fission
+# recreates it. That's the case for fusions that undo Fissions, in reverse order, as every planner here
+# makes them.
+def reverse_trace(trace):
+    trace = Trace(*trace)
+    ops, nds, args = trace
+    bids, steps, positions = trace.bots()
+    starts = trace.step_starts()
+    step_count = len(starts) - 1
+    if not step_count or ops[-1] != CmdOp.Halt or starts[-2] != len(ops) - 1:
+        raise NanoException('Only a trace ending with one bot halting can be reversed')
+
+    # Fissions' children, and fusions' secondaries, as (bid, seeds), tracked through the trace
+    seeds = {1: list(INITIAL_SEEDS)}
+    children = {}  # Of Fissions, by command index
+    secondaries = {}  # Of FusionPs, by command index, as (bid, seed count)
+    for k in np.flatnonzero(np.isin(ops, [CmdOp.Fission, CmdOp.FusionP])).tolist():
+        step = int(steps[k])
+        target = np.array(_near(positions[k].tolist(), int(nds[k])))
+        bid = int(bids[k])
+        if ops[k] == CmdOp.Fission:
+            m = int(args[k][0])
+            parent = seeds[bid]
+            children[k] = parent[0]
+            seeds[parent[0]] = parent[1:m + 1]
+            seeds[bid] = parent[m + 1:]
+        else:
+            matches = np.flatnonzero((positions[starts[step]:starts[step + 1]] == target).all(axis=1))
+            if not len(matches):
+                raise NanoException(f'Unmatched fusion at step {step}')
+            other = int(bids[starts[step] + matches[0]])
+            merged = sorted(seeds[bid] + [other] + seeds[other])
+            m = len(seeds[other])
+            if merged[0] != other or merged[1:m + 1] != seeds[other]:
+                raise NanoException(f'Fusion at step {step} can\'t be reversed by a Fission')
+            secondaries[k] = (other, m)
+            seeds[bid] = merged
+
+    # The undoing commands, before the final Halt, with their steps and bids
+    keep = np.flatnonzero(ops[:-1] != CmdOp.FusionS)
+    new_ops = INVERSE_OPS[ops[keep]]
+    new_nds = nds[keep].copy()
+    new_args = args[keep].astype(np.int64)
+    new_steps = step_count - 2 - steps[keep].astype(np.int64)
+    new_bids = bids[keep].astype(np.int64)
+
+    is_smove = ops[keep] == CmdOp.SMove
+    new_args[is_smove, 1] = 30 - new_args[is_smove, 1]
+    is_lmove = ops[keep] == CmdOp.LMove
+    new_args[is_lmove] = np.stack([new_args[is_lmove, 2], 10 - new_args[is_lmove, 3],
+                                   new_args[is_lmove, 0], 10 - new_args[is_lmove, 1]], axis=1)
+    new_args[np.isin(ops[keep], [CmdOp.Fission, CmdOp.FusionP])] = 0
+    index = {k: i for i, k in enumerate(keep.tolist())}
+    for k, (other, m) in secondaries.items():
+        new_args[index[k], 0] = m
+
+    # FusionSs for the children of Fissions, in the same steps as their parents' FusionPs
+    fissions = sorted(children)
+    extra_steps = step_count - 2 - steps[fissions].astype(np.int64)
+    extra_bids = np.array([children[k] for k in fissions], dtype=np.int64)
+    extra_nds = 26 - nds[fissions]  # The opposite near coordinate difference
+
+    all_steps = np.concatenate([new_steps, extra_steps])
+    order = np.lexsort((np.concatenate([new_bids, extra_bids]), all_steps))
+    result_ops = np.concatenate([new_ops, np.full(len(fissions), CmdOp.FusionS, dtype=np.uint8)])[order]
+    result_nds = np.concatenate([new_nds, extra_nds.astype(np.uint8)])[order]
+    result_args = np.concatenate([new_args, np.zeros((len(fissions), 4), dtype=np.int64)])[order]
+    return Trace(np.append(result_ops, np.uint8(CmdOp.Halt)), np.append(result_nds, np.uint8(0)),
+                 np.vstack([result_args, np.zeros((1, 4), dtype=np.int64)]))
+
+
+# Dismantles a source model, by running a planner's trace for building it backwards (see reverse_trace). With
+# BoxPlanner, the default, solid boxes are voided top down, one layer of each at a time, with GVoids. With
+# LayerPlanner, the remainder stays grounded wherever it did while building, so the trace runs in Low
+# harmonics.
+class DisassemblyPlanner:
+    def __init__(self, source, planner=BoxPlanner):
+        self.source = source
+        self.planner = planner
+
+    def plan(self):
+        return reverse_trace(self.planner(self.source).plan())
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+from botplan import MAX_LLD, MAX_SLD
+from cmdop import CmdOp
+from columnartrace import step_starts
+from config import Config
+from harmonics import Harmonics
+
+
+# The farthest a near coordinate difference reaches, in Manhattan distance
+MAX_NEAR_DISTANCE = 2
+
+
+# Estimates energies without simulating voxels, to rank candidate traces, and to tell how far a trace is
+# from the best possible.
+#
+# lower_bound() is a bound on the energy of any valid trace for the problem. Each voxel only the target has
+# must be filled at least once, from Void, and each voxel only the source has must be voided last from Full.
+# The number of steps is bounded by the time for bots to reach the farthest voxel to change, and to return:
+# every step, a bot moves at most 15 voxels, a Fission's child starts within 2 of its parent, and a fusion
+# removes a bot within 2 of another. Each step costs at least its Low harmonics charge, plus one bot.
+#
+# estimate() adds up a trace's energy from its columnar form: the harmonics charge of each step, from the
+# parity of the Flips before it, the bots per step, and each command's own cost. It assumes that Fills and
+# GFills only fill Void voxels, and Voids and GVoids only void Full ones, which makes it exact for the
+# planners here. A group fill or void is charged once, split between its bots.
+class EnergyEstimator:
+    def __init__(self, model, source=None):
+        self.model = model
+        self.source = source
+
+    # The number of voxels to fill and to void
+    def changes(self):
+        target = self.model.matrix.to_array()
+        if self.source is None:
+            return int(np.count_nonzero(target)), 0, target
+        full = self.source.matrix.to_array()
+        changed = full != target
+        return int(np.count_nonzero(changed & target)), int(np.count_nonzero(changed & full)), changed
+
+    # A bound on the number of time steps of any valid trace, including the final Halt
+    def min_steps(self, changed=None):
+        if changed is None:
+            changed = self.changes()[2]
+        cells = np.argwhere(changed)
+        if not len(cells):
+            return 1
+        farthest = int(cells.sum(axis=1).max())
+        return 2 * -(-max(0, farthest - MAX_NEAR_DISTANCE) // MAX_LLD) + 1
+
+    def lower_bound(self):
+        fills, voids, changed = self.changes()
+        step_cost = Config.COST_HARMONICS_LOW * self.model.resolution**3 + Config.COST_BOT_PER_STEP
+        return Config.COST_FILL_VOID * fills + Config.COST_VOID_FULL * voids + self.min_steps(changed) * step_cost
+
+    # Returns the approximate energy of a trace, in columnar form
+    def estimate(self, trace, harmonics=Harmonics.Low):
+        ops, nds, args = trace
+        volume = self.model.resolution**3
+        starts = step_starts(ops)
+        ops = ops[:starts[-1]]
+        args = args[:starts[-1]].astype(np.int64)
+        if not len(ops):
+            return 0
+        counts = np.diff(starts)
+
+        flips = np.add.reduceat((ops == CmdOp.Flip).astype(np.int64), starts[:-1])
+        high = (np.cumsum(flips) - flips + (harmonics == Harmonics.High)) % 2 == 1
+        n_high = int(np.count_nonzero(high))
+        energy = (Config.COST_HARMONICS_HIGH * volume * n_high
+                  + Config.COST_HARMONICS_LOW * volume * (len(counts) - n_high)
+                  + Config.COST_BOT_PER_STEP * len(ops))
+
+        is_smove = ops == CmdOp.SMove
+        is_lmove = ops == CmdOp.LMove
+        distance = (int(np.abs(args[is_smove, 1] - MAX_LLD).sum())
+                    + int(np.abs(args[is_lmove, 1] - MAX_SLD).sum()) + int(np.abs(args[is_lmove, 3] - MAX_SLD).sum()))
+        energy += Config.COST_MOVE * (distance + Config.COST_LMOVE_EXTRA * int(np.count_nonzero(is_lmove)))
+
+        energy += Config.COST_FILL_VOID * int(np.count_nonzero(ops == CmdOp.Fill))
+        energy += Config.COST_VOID_FULL * int(np.count_nonzero(ops == CmdOp.Void))
+        energy += Config.COST_FISSION * int(np.count_nonzero(ops == CmdOp.Fission))
+        energy -= Config.COST_FUSION * int(np.count_nonzero(ops == CmdOp.FusionP))
+
+        for op, cost in [(CmdOp.GFill, Config.COST_FILL_VOID), (CmdOp.GVoid, Config.COST_VOID_FULL)]:
+            fds = np.abs(args[ops == op, :3] - 30)
+            if len(fds):
+                volumes = np.prod(fds + 1, axis=1)
+                corners = 2 ** np.count_nonzero(fds, axis=1)
+                energy += int(round(cost * float((volumes / corners).sum())))
+        return energy
@@ -0,0 +1,192 @@
+from array import array
+
+
+import numpy as np
+
+
+# The most voxels a void's local search visits before giving up and marking the structure dirty
+VOID_SEARCH_LIMIT = 4096
+
+
+# Tracks whether every Full voxel of a VoxelMatrix is grounded, as the matrix changes one voxel at a time.
+#
+# Full voxels are nodes of a union-find structure, along with the ground (node 0), which is joined to every
+# Full voxel with y = 0. Filling a voxel joins it to its Full face-adjacent neighbours, in near-constant
+# amortized time, and the matrix is grounded when the ground's set holds every Full voxel.
+#
+# Union-find can't split sets. A voided voxel's node is left behind as a ghost, which still links its set
+# together but no longer counts towards its size. If the voxel had more than one Full neighbour (counting the
+# ground), it may have split its set, so each neighbour is searched from, depth first and downwards first,
+# until it reaches the ground, or a voxel found to reach it. A neighbour that can't reach it is in a loose
+# component, which the search visits completely, and which is moved to a set of its own, with new nodes.
+# Only a search visiting more than VOID_SEARCH_LIMIT voxels marks the structure as dirty, and it's rebuilt
+# from the matrix, with vectorized searches, the next time it's queried.
+class Groundedness:
+    GROUND = 0
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.dirty = True  # Rebuild from the matrix before answering
+        self.full_count = 0
+        self._node = None  # The node of each Full voxel, by flat index, or -1
+        self._parent = None
+        self._size = None
+
+    def _find(self, n):
+        parent = self._parent
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    def _union(self, m, n):
+        m = self._find(m)
+        n = self._find(n)
+        if m == n:
+            return
+        size = self._size
+        if size[m] < size[n]:
+            m, n = n, m
+        self._parent[n] = m
+        size[m] += size[n]
+
+    # Returns the flat indices of the Full face-adjacent neighbours of voxel (x, y, z), the one below last
+    def _neighbor_cells(self, x, y, z):
+        R = self.matrix.resolution
+        node = self._node
+        idx = (x * R + y) * R + z
+        return [nidx for ok, nidx in ((x > 0, idx - R * R), (x < R - 1, idx + R * R),
+                                      (z > 0, idx - 1), (z < R - 1, idx + 1),
+                                      (y < R - 1, idx + R), (y > 0, idx - R))
+                if ok and node[nidx] >= 0]
+
+    # Returns the nodes of the Full face-adjacent neighbours of voxel (x, y, z), including the ground.
+    def _neighbor_nodes(self, x, y, z):
+        node = self._node
+        result = [Groundedness.GROUND] if y == 0 else []
+        result.extend(node[nidx] for nidx in self._neighbor_cells(x, y, z))
+        return result
+
+    # Searches from each Full neighbour of a voided voxel, whose set's root was root, and moves the loose
+    # components found to sets of their own. Returns False if the search gave up.
+    def _split(self, x, y, z, root):
+        R = self.matrix.resolution
+        node = self._node
+        grounded = set()  # Voxels found to reach the ground
+        visited = 0
+        for start in self._neighbor_cells(x, y, z):
+            if start in grounded or self._find(node[start]) != root:
+                continue  # Reaches the ground, or was moved with a loose component
+            seen = {start}
+            stack = [start]
+            reached = False
+            while stack:
+                idx = stack.pop()
+                xy, cz = divmod(idx, R)
+                cx, cy = divmod(xy, R)
+                if cy == 0 or idx in grounded:
+                    reached = True
+                    break
+                for nidx in self._neighbor_cells(cx, cy, cz):
+                    if nidx not in seen:
+                        seen.add(nidx)
+                        stack.append(nidx)
+                visited += 1
+                if visited > VOID_SEARCH_LIMIT:
+                    return False
+            if reached:
+                grounded |= seen  # Each was found next to a voxel joined to start
+                continue
+            base = len(self._parent)
+            for k, idx in enumerate(seen):
+                node[idx] = base + k
+                self._parent.append(base)
+                self._size.append(0)
+            self._size[base] = len(seen)
+            self._size[root] -= len(seen)
+        return True
+
+    # Call after voxel (x, y, z) of the matrix changes from Void to Full.
+    def fill(self, x, y, z):
+        if self.dirty:
+            return
+        R = self.matrix.resolution
+        n = len(self._parent)
+        self._parent.append(n)
+        self._size.append(1)
+        self._node[(x * R + y) * R + z] = n
+        self.full_count += 1
+        for m in self._neighbor_nodes(x, y, z):
+            self._union(m, n)
+
+    def invalidate(self):
+        self.dirty = True
+
+    def is_grounded(self):
+        if self.dirty:
+            self.rebuild()
+        return self._size[self._find(Groundedness.GROUND)] == self.full_count
+
+    # Rebuilds the structure from the matrix. Grounded voxels are found with a frontier search, and the
+    # (usually few) remaining Full voxels are grouped into components by hooking and pointer jumping.
+    def rebuild(self):
+        R = self.matrix.resolution
+        full = self.matrix.to_array().reshape(-1)
+        grounded = self.matrix.grounded_array().reshape(-1)
+        grounded_cells = np.flatnonzero(grounded)
+        loose_cells = np.flatnonzero(full & ~grounded)
+        g = len(grounded_cells)
+        k = len(loose_cells)
+
+        # Pairs of face-adjacent loose voxels, as indices into loose_cells
+        loose = np.full(R**3 if k else 0, -1, dtype=np.int64)
+        loose[loose_cells] = np.arange(k)
+        xyz = np.stack(np.unravel_index(loose_cells, (R, R, R)))
+        firsts = []
+        seconds = []
+        for axis, stride in enumerate((R * R, R, 1)):
+            has_next = xyz[axis] < R - 1
+            others = loose[loose_cells[has_next] + stride]
+            firsts.append(np.flatnonzero(has_next)[others >= 0])
+            seconds.append(others[others >= 0])
+        firsts = np.concatenate(firsts)
+        seconds = np.concatenate(seconds)
+
+        roots = np.arange(k)
+        while True:
+            r1 = roots[firsts]
+            r2 = roots[seconds]
+            apart = r1 != r2
+            if not apart.any():
+                break
+            np.minimum.at(roots, np.maximum(r1, r2)[apart], np.minimum(r1, r2)[apart])
+            while True:
+                jumped = roots[roots]
+                if np.array_equal(jumped, roots):
+                    break
+                roots = jumped
+
+        base = 1 + g
+        self._node = np.full(R**3, -1, dtype=np.int32)
+        self._node[grounded_cells] = np.arange(1, base, dtype=np.int32)
+        self._node[loose_cells] = np.arange(base, base + k, dtype=np.int32)
+        self._node = memoryview(self._node)  # Faster for single elements
+        self._parent = array('l', [0] * base)
+        self._parent.extend((roots + base).tolist())
+        self._size = array('l', [g] + [1] * g)
+        self._size.extend(np.bincount(roots, minlength=k).tolist())
+        self.full_count = g + k
+        self.dirty = False
+
+    # Call after voxel (x, y, z) of the matrix changes from Full to Void.
+    def void(self, x, y, z):
+        if self.dirty:
+            return
+        R = self.matrix.resolution
+        idx = (x * R + y) * R + z
+        root = self._find(self._node[idx])
+        self._node[idx] = -1
+        self.full_count -= 1
+        self._size[root] -= 1
+        if len(self._neighbor_nodes(x, y, z)) > 1 and not self._split(x, y, z, root):
+            self.dirty = True
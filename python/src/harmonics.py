@@ -5,4 +5,4 @@ class Harmonics(Enum):
     High = 1
 
     def flip(self):
-        return Low if self == High else Low
+        return Harmonics.Low if self == Harmonics.High else Harmonics.High
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+from cmdop import CmdOp
+from columnartrace import step_starts, Trace
+from system import System
+
+
+MERGE_GAP_STEPS = 1  # Ungrounded intervals this close together stay in High harmonics between them
+
+
+# Rewrites a trace so that it's in High harmonics only when it has to be: at the end of each step that
+# leaves Full voxels ungrounded.
+#
+# The trace is first simulated with every Flip replaced by a Wait, so that it runs in Low harmonics
+# throughout, logging the steps where the matrix becomes ungrounded and grounded again. For each ungrounded
+# interval of steps a..b, one bot's Wait is turned into a Flip in step a (or a - 1), and another in step
+# b + 1 (or b + 2). A step is charged by its harmonics at the start, so these are the cheapest places. If
+# those steps have no Waits, a new step, with one Flip and Waits for the other bots, is inserted instead,
+# before step a or b + 2; when the matrix is grounded again just before the end, step b + 2 is the Halt.
+# The result is simulated again to confirm that it's valid.
+class HarmonicsScheduler:
+    def __init__(self, model, source=None):
+        self.model = model
+        self.source = source
+
+    # Returns the intervals of steps, as (first, last), at the end of which the matrix isn't grounded
+    def ungrounded_intervals(self, trace):
+        system = System(self.model, self.source)
+        system.grounded_log = []
+        _, valid = system.run(trace)
+        if not valid:
+            return None
+        intervals = []
+        for step, grounded in system.grounded_log:
+            if not grounded:
+                intervals.append([step, None])
+            else:
+                intervals[-1][1] = step - 1
+        merged = []
+        for first, last in intervals:
+            if merged and merged[-1][1] is not None and first - merged[-1][1] - 1 <= MERGE_GAP_STEPS:
+                merged[-1][1] = last
+            else:
+                merged.append([first, last])
+        return merged
+
+    # Returns the rescheduled trace and its energy, or else the original trace and its energy, if it's
+    # cheaper or the rescheduled trace isn't valid.
+    def schedule(self, trace):
+        ops, nds, args = trace
+        original = System(self.model, self.source)
+        original_energy, original_valid = original.run(trace)
+
+        ops = np.where(ops == CmdOp.Flip, np.uint8(CmdOp.Wait), ops)
+        intervals = self.ungrounded_intervals((ops, nds, args))
+        if intervals is None or any(last is None for _, last in intervals):
+            return trace, original_energy
+        starts = step_starts(ops)
+        step_count = len(starts) - 1
+        is_wait = ops == CmdOp.Wait
+
+        # Returns the index of the first Wait in the steps that isn't already a Flip. Intervals two steps
+        # apart can both flip in the step between them, but with different bots, so that the Flips cancel out.
+        def find_wait(steps):
+            for step in steps:
+                if 0 <= step < step_count:
+                    for k in (starts[step] + np.flatnonzero(is_wait[starts[step]:starts[step + 1]])).tolist():
+                        if k not in flips:
+                            return k
+            return None
+
+        flips = set()
+        insertions = []  # Indices of commands that new Flip steps are inserted before, with their bot counts
+        for first, last in intervals:
+            k = find_wait([first, first - 1])
+            if k is None:
+                insertions.append((starts[first], starts[first + 1] - starts[first]))
+            else:
+                flips.add(k)
+            k = find_wait([last + 1, last + 2])
+            if k is not None:
+                flips.add(k)
+            elif last + 2 < step_count:
+                insertions.append((starts[last + 2], starts[last + 3] - starts[last + 2]))
+            else:  # Grounded again only in the last step, so there's no step after it to flip back in
+                return trace, original_energy
+
+        ops = ops.copy()
+        ops[sorted(flips)] = CmdOp.Flip
+        if insertions:
+            positions = np.concatenate([np.full(n, k) for k, n in insertions])
+            new_ops = np.concatenate([[CmdOp.Flip] + [CmdOp.Wait] * (n - 1) for _, n in insertions])
+            ops = np.insert(ops, positions, new_ops.astype(np.uint8))
+            nds = np.insert(nds, positions, 0)
+            args = np.insert(args, positions, 0, axis=0)
+
+        result = Trace(ops, nds, args)
+        energy, valid = System(self.model, self.source).run(result)
+        if not valid or (original_valid and energy >= original_energy):
+            return trace, original_energy
+        return result, energy
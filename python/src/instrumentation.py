@@ -0,0 +1,192 @@
+from array import array
+import cProfile
+import pstats
+import time
+
+
+import numpy as np
+
+
+from cmdop import CmdOp
+from config import Config
+
+
+ENERGY_CATEGORIES = {CmdOp.SMove: 'move', CmdOp.LMove: 'move', CmdOp.Fill: 'fill', CmdOp.Void: 'fill',
+                     CmdOp.GFill: 'fill', CmdOp.GVoid: 'fill', CmdOp.Fission: 'fission_fusion'}
+GROUNDEDNESS_METHODS = ['fill', 'void', 'is_grounded', 'rebuild']
+HANDLER_NAMES = ['exec_halt', 'exec_wait', 'exec_flip', 'exec_smove', 'exec_lmove', 'exec_fusionp', 'exec_fusions',
+                 'exec_fission', 'exec_fill', 'exec_void', 'exec_gfill', 'exec_gvoid']
+
+
+# Opt-in instrumentation of a System's simulation. attach() swaps the system's command handlers (both the
+# handlers table used by System.run and the exec_* methods used by Cmd.execute), and a few of its step and
+# groundedness methods, for wrappers that count and time them, and attribute the energy they use. A system
+# without it attached runs its own methods, so there's no cost unless it's used.
+#
+# By default, runs of single-bot steps are executed one command at a time, rather than in bulk, so that each
+# command is counted. With per_command=False, they stay vectorized, and are reported as 'solo' runs: their
+# commands are counted, but their time and energy aren't broken down.
+#
+# Group fills and voids, and fusions, take effect at the end of the step, where they're timed and charged
+# under 'end_step'. Time in groundedness is also included in that of the commands or step ends that use it.
+class Instrumentation:
+    def __init__(self, per_command=True):
+        self.per_command = per_command
+        self.counts = np.zeros(len(CmdOp), dtype=np.int64)
+        self.seconds = np.zeros(len(CmdOp))
+        self.cmd_energy = np.zeros(len(CmdOp), dtype=np.int64)
+        self.bot_energy = {}  # Energy of each bot's commands, by bid
+        self.bot_steps = {}  # Commands executed by each bot, by bid
+        self.step_bots = array('H')  # Active bots in each step
+        self.calls = {}  # Other instrumented methods: name -> [calls, seconds, energy]
+        self.solo = [0, 0, 0.0, 0]  # Bulk single-bot runs: [runs, commands, seconds, energy]
+        self.start_energy = 0
+        self.end_energy = 0
+        self.run_seconds = 0.0
+        self._last_step = -1
+        self._originals = None
+
+    def attach(self, system):
+        self._originals = {'handlers': system.handlers, 'groundedness': system.groundedness}
+        self.start_energy = self.end_energy = system.energy_used
+        wrappers = [self._wrap_handler(system, op, getattr(system, name)) for op, name in enumerate(HANDLER_NAMES)]
+        system.handlers = wrappers
+        for name, wrapper in zip(HANDLER_NAMES, wrappers):
+            setattr(system, name, wrapper)
+        for name in ['_apply_groups', '_fuse']:
+            setattr(system, name, self._wrap_call(system, f'end_step.{name[1:]}', getattr(system, name)))
+        system._run_solo = self._wrap_solo(system, system._run_solo)
+        for name in GROUNDEDNESS_METHODS:
+            method = getattr(system.groundedness, name)
+            setattr(system.groundedness, name, self._wrap_call(system, f'groundedness.{name}', method))
+        return self
+
+    # Restores the system's own methods
+    def detach(self, system):
+        for name in HANDLER_NAMES + ['_apply_groups', '_fuse', '_run_solo']:
+            system.__dict__.pop(name, None)
+        for name in GROUNDEDNESS_METHODS:
+            self._originals['groundedness'].__dict__.pop(name, None)
+        system.handlers = self._originals['handlers']
+        self.end_energy = system.energy_used
+
+    def _wrap_handler(self, system, op, handler):
+        counts = self.counts
+        seconds = self.seconds
+        cmd_energy = self.cmd_energy
+        bot_energy = self.bot_energy
+        bot_steps = self.bot_steps
+        step_bots = self.step_bots
+        clock = time.perf_counter
+
+        def wrapper(bot, nd, arg):
+            if system.step_count != self._last_step:
+                self._last_step = system.step_count
+                step_bots.append(len(system.bots))
+            bid = bot.bid
+            energy = system.energy_used
+            start = clock()
+            try:
+                handler(bot, nd, arg)
+            finally:
+                seconds[op] += clock() - start
+                counts[op] += 1
+                energy = system.energy_used - energy
+                cmd_energy[op] += energy
+                bot_energy[bid] = bot_energy.get(bid, 0) + energy
+                bot_steps[bid] = bot_steps.get(bid, 0) + 1
+        return wrapper
+
+    def _wrap_call(self, system, name, method):
+        record = self.calls.setdefault(name, [0, 0.0, 0])
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            energy = system.energy_used
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                record[0] += 1
+                record[1] += clock() - start
+                record[2] += system.energy_used - energy
+        return wrapper
+
+    def _wrap_solo(self, system, run_solo):
+        def wrapper(ops, nds, args, start, end):
+            if self.per_command:
+                return False
+            energy = system.energy_used
+            t0 = time.perf_counter()
+            done = run_solo(ops, nds, args, start, end)
+            if done:
+                bid = system.bots[0].bid
+                self.solo[0] += 1
+                self.solo[1] += end - start
+                self.solo[2] += time.perf_counter() - t0
+                self.solo[3] += system.energy_used - energy
+                self.counts += np.bincount(ops[start:end], minlength=len(CmdOp))
+                self.bot_steps[bid] = self.bot_steps.get(bid, 0) + end - start
+                self.step_bots.extend([1] * (end - start))
+                self._last_step = system.step_count - 1
+            return done
+        return wrapper
+
+    # Runs a trace on the system with instrumentation attached, and optionally under cProfile, with its
+    # statistics written to profile_filename (for pstats, or e.g. snakeviz). Returns what System.run does.
+    def run(self, system, trace, profile_filename=None):
+        self.attach(system)
+        start = time.perf_counter()
+        try:
+            if profile_filename:
+                profiler = cProfile.Profile()
+                result = profiler.runcall(system.run, trace)
+                profiler.dump_stats(profile_filename)
+            else:
+                result = system.run(trace)
+        finally:
+            self.run_seconds += time.perf_counter() - start
+            self.detach(system)
+        return result
+
+    # Returns the energy used while attached, by category. 'global' is what the harmonics cost, and 'bot_steps'
+    # what active bots cost, each time step.
+    def energy_breakdown(self):
+        total = self.end_energy - self.start_energy
+        bot_steps = Config.COST_BOT_PER_STEP * sum(self.bot_steps.values())
+        by_category = {'move': 0, 'fill': 0, 'fission_fusion': 0}
+        for op, category in ENERGY_CATEGORIES.items():
+            by_category[category] += int(self.cmd_energy[op])
+        by_category['fill'] += self.calls.get('end_step.apply_groups', [0, 0, 0])[2]
+        by_category['fission_fusion'] += self.calls.get('end_step.fuse', [0, 0, 0])[2]
+        accounted = sum(by_category.values()) + self.solo[3]
+        return dict({'total': total, 'global': total - accounted - bot_steps, 'bot_steps': bot_steps},
+                    **by_category, solo=self.solo[3])
+
+    # Returns the report as a dict of plain values, ready for writing as JSON
+    def report(self):
+        commands = {}
+        for op in CmdOp:
+            if self.counts[op]:
+                commands[f'Cmd{op.name}'] = {'count': int(self.counts[op]), 'seconds': round(float(self.seconds[op]), 6),
+                                             'energy': int(self.cmd_energy[op])}
+        step_bots = np.frombuffer(self.step_bots, dtype=np.uint16) if len(self.step_bots) else np.zeros(1, np.uint16)
+        histogram = np.bincount(step_bots)
+        return {
+            'seconds': round(self.run_seconds, 6),
+            'commands': commands,
+            'calls': {name: {'count': c, 'seconds': round(s, 6), 'energy': e} for name, (c, s, e) in self.calls.items()},
+            'solo': dict(zip(['runs', 'commands', 'seconds', 'energy'], self.solo)),
+            'energy': self.energy_breakdown(),
+            'bot_energy': {bid: self.bot_energy.get(bid, 0) + Config.COST_BOT_PER_STEP * steps
+                           for bid, steps in sorted(self.bot_steps.items())},
+            'steps': {'count': len(self.step_bots), 'max_bots': int(step_bots.max()),
+                      'mean_bots': round(float(step_bots.mean()), 3),
+                      'bots_histogram': {n: int(c) for n, c in enumerate(histogram.tolist()) if c}},
+        }
+
+    # Writes the top entries of a profile written by run(), sorted by cumulative time
+    @staticmethod
+    def print_profile(profile_filename, limit=30, ofile=None):
+        stats = pstats.Stats(profile_filename, stream=ofile)
+        stats.sort_stats('cumulative').print_stats(limit)
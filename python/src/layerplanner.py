@@ -0,0 +1,250 @@
+import bisect
+
+
+import numpy as np
+
+
+from botplan import BotPlan, merge
+from groundedness import Groundedness
+from voxelmatrix import VoxelMatrix
+
+
+MAX_PASSES = 8  # Sweeps over a layer's deferred voxels before filling them ungrounded
+
+
+# Labels the 4-connected components of a 2D boolean array. Returns an int32 array of labels, 1 to n for
+# Full cells and 0 for empty ones, and n.
+#
+# Full cells are grouped into runs along the second axis, vectorized; then runs overlapping in adjacent rows
+# are joined with a union-find over the runs, so the work is linear in the number of Full cells.
+def layer_components(layer):
+    X, Z = layer.shape
+    padded = np.zeros((X, Z + 2), dtype=np.int8)
+    padded[:, 1:-1] = layer
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    lengths = ends - starts
+    labels = np.zeros((X, Z), dtype=np.int32)
+    if not len(starts):
+        return labels, 0
+
+    run_ids = np.repeat(np.arange(len(starts), dtype=np.int32), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    cols = np.arange(len(run_ids)) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+    cell_rows = np.repeat(rows, lengths)
+    runs = np.full((X, Z), -1, dtype=np.int32)
+    runs[cell_rows, cols] = run_ids
+
+    both = layer[:-1] & layer[1:]
+    pairs = np.unique(runs[:-1][both].astype(np.int64) * len(starts) + runs[1:][both])
+    parent = list(range(len(starts)))
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for a, b in zip(*divmod(pairs, len(starts))):
+        ra, rb = find(int(a)), find(int(b))
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    roots = np.array([find(k) for k in range(len(starts))], dtype=np.int32)
+    unique_roots, component = np.unique(roots, return_inverse=True)
+    labels[cell_rows, cols] = component[run_ids] + 1
+    return labels, len(unique_roots)
+
+
+# A layer's components, and the components of the layer below supporting each of them (set() for none,
+# and None at y = 0, where everything rests on the ground)
+class LayerInfo:
+    def __init__(self, y, labels, count, supports):
+        self.y = y
+        self.labels = labels
+        self.count = count
+        self.supports = supports
+
+    # The components resting on nothing below, which can only be grounded through the layers above
+    def unsupported(self):
+        if self.supports is None:
+            return []
+        return [c for c in range(1, self.count + 1) if not self.supports[c]]
+
+
+# Builds a model layer by layer, bottom up, with a single bot that keeps the matrix grounded after every
+# step wherever it can, so that the trace runs in Low harmonics.
+#
+# The bot hovers one voxel above the layer being filled, and sweeps it in strips of three x planes, in a
+# serpentine: along z over each strip, alternating direction, with strips visited alternately left to right
+# and right to left. At each stop it fills the strip's Full voxels below it, with near coordinate
+# differences (dx, -1, 0). A voxel is only filled once it's grounded: resting on the layer below, or next
+# to a voxel of its layer already filled. Voxels that aren't are deferred to later sweeps of the layer.
+#
+# The components that analyze() finds resting on nothing below can only be grounded through the layers
+# above, and are left out of those sweeps. They're filled in a last sweep of their layer, along with any
+# voxels still deferred after MAX_PASSES sweeps. The bot flips to High harmonics just before the first of
+# these fills, and back to Low once the matrix is grounded again, as tracked with a Groundedness.
+class LayerPlanner:
+    def __init__(self, model):
+        self.model = model
+        self.full = model.matrix.to_array()
+        self.ungrounded = 0  # Voxels filled while not grounded, by the last plan
+
+    # Returns a LayerInfo for each layer
+    def analyze(self):
+        infos = []
+        below = None
+        for y in range(self.model.resolution):
+            layer = self.full[:, y, :]
+            labels, count = layer_components(layer)
+            if below is None:
+                supports = None
+            else:
+                touching = (labels > 0) & (below.labels > 0)
+                supports = {c: set() for c in range(1, count + 1)}
+                for upper, lower in zip(labels[touching].tolist(), below.labels[touching].tolist()):
+                    supports[upper].add(lower)
+            below = LayerInfo(y, labels, count, supports)
+            infos.append(below)
+        return infos
+
+    # Returns the stops of the bot over a layer, given its LayerInfo, as (x, z, dxs, loose), with the near
+    # coordinate differences of the voxels to fill there, in order, and whether any of them is filled while
+    # not grounded. The first sweep starts at the low x end if forward is True.
+    #
+    # Rather than rescanning the layer on each sweep, each strip keeps the columns (z) where a voxel may
+    # have become grounded: to start with, those resting on the layer below, and then those next to each
+    # voxel filled. A sweep only visits these, in serpentine order, and the columns that fills in a strip
+    # make ready further along its direction are visited in the same sweep. So the work is linear in the
+    # layer's Full voxels, up to the log factor of keeping the columns of a strip in order.
+    def fill_order(self, info, forward=True):
+        y = info.y
+        layer = self.full[:, y, :]
+        Z = layer.shape[1]
+        W = Z + 1  # Voxels are keyed x * W + z, so that neighbors along z don't wrap around to the next x
+        keys = np.flatnonzero(np.pad(layer, ((0, 0), (0, 1))))
+        if not len(keys):
+            return []
+        below = self.full[:, y - 1, :] & layer if y > 0 else layer
+        is_supported = np.pad(below, ((0, 0), (0, 1))).reshape(-1)[keys]
+        is_loose = np.pad(np.isin(info.labels, info.unsupported()), ((0, 0), (0, 1))).reshape(-1)[keys]
+        full = set(keys.tolist())
+        pending = set(full)  # The rest of full is filled
+        supported = set(keys[is_supported].tolist())
+        loose = set(keys[is_loose].tolist())
+        waiting = pending - supported - loose  # Voxels that can only be grounded by a neighbor filled first
+        x0, x1 = int(keys[0]) // W, int(keys[-1]) // W
+        strips = [(a, min(a + 2, x1)) for a in range(x0, x1 + 1, 3)]
+
+        # Columns are keyed k * W + z, for strip k
+        column_keys = (keys // W - x0) // 3 * W + keys % W
+        columns = dict(zip(*(a.tolist() for a in np.unique(column_keys, return_counts=True))))  # Voxels pending
+        starts = np.unique(column_keys[is_supported & ~is_loose])
+        bounds = np.searchsorted(starts, np.arange(len(strips) + 1) * W).tolist()
+        ready = [set((starts[bounds[k]:bounds[k + 1]] % W).tolist()) for k in range(len(strips))]
+
+        stops = []
+        ascending = True
+        for sweep in range(MAX_PASSES + 1):
+            # A last sweep fills the loose voxels, and any still deferred, grounded or not
+            last = sweep == MAX_PASSES or not any(ready)
+            if last:
+                ready = [set() for _ in strips]
+                for column in columns:
+                    ready[column // W].add(column % W)
+                if not any(ready):
+                    break
+            for k in (range(len(strips)) if forward else range(len(strips) - 1, -1, -1)):
+                if not ready[k]:
+                    continue
+                a, b = strips[k]
+                c = min(a + 1, b)
+                sign = 1 if ascending else -1
+                queue = sorted(-sign * z for z in ready[k])  # The next column last
+                ready[k] = set()
+                while queue:
+                    z = -sign * queue.pop()
+                    column = k * W + z
+                    if column not in columns:
+                        continue
+                    dxs = []
+                    ungrounded = False
+                    again = True
+                    while again:  # Until no voxel skipped as not grounded comes before one filled
+                        again = skipped = False
+                        for x in range(a, b + 1):
+                            key = x * W + z
+                            if key not in pending or (key in loose and not last):
+                                continue
+                            if key not in supported and all(n not in full or n in pending
+                                                            for n in (key - W, key + W, key - 1, key + 1)):
+                                if not last:
+                                    skipped = True
+                                    continue
+                                self.ungrounded += 1
+                                ungrounded = True
+                            again = again or skipped
+                            pending.remove(key)
+                            dxs.append(x - c)
+                    if not dxs:
+                        continue
+                    stops.append((c, z, dxs, ungrounded))
+                    columns[column] -= len(dxs)
+                    if not columns[column]:
+                        del columns[column]
+                    if not waiting or last:
+                        continue
+                    for dx in dxs:
+                        key = (c + dx) * W + z
+                        waiting.discard(key)
+                        for neighbor in (key - W, key + W, key - 1, key + 1):
+                            if neighbor not in waiting:
+                                continue
+                            waiting.remove(neighbor)
+                            nx, nz = divmod(neighbor, W)
+                            nk = (nx - x0) // 3
+                            if nk == k and sign * (nz - z) > 0:
+                                bisect.insort(queue, -sign * nz)
+                            else:
+                                ready[nk].add(nz)
+                ascending = not ascending
+            if last:
+                break
+            forward = not forward
+        return stops
+
+    def plan(self):
+        self.ungrounded = 0
+        bot = BotPlan(1, (0, 0, 0))
+        infos = [info for info in self.analyze() if info.count]
+        if not infos:
+            bot.halt()
+            return merge([bot])
+        orders = [(info.y, self.fill_order(info, k % 2 == 0)) for k, info in enumerate(infos)]
+        matrix = VoxelMatrix(self.model.resolution)
+        groundedness = Groundedness(matrix)
+        groundedness.is_grounded()  # Builds it, so that it's updated fill by fill
+        high = False
+        for y, stops in orders:
+            x, _, z = bot.pos
+            bot.move_to(x, y + 1, z, order='y')
+            for c, z, dxs, loose in stops:
+                bot.move_to(c, y + 1, z, order='zx' if bot.pos[0] == c else 'xz')
+                if loose and not high:
+                    bot.flip()
+                    high = True
+                for dx in dxs:
+                    bot.fill(dx, -1, 0)
+                    matrix.fill(c + dx, y, z)
+                    groundedness.fill(c + dx, y, z)
+                if high and groundedness.is_grounded():
+                    bot.flip()
+                    high = False
+        x, y, z = bot.pos
+        bot.move_to(0, y, z, order='x')
+        bot.move_to(0, 0, 0, order='yz')
+        if high:
+            bot.flip()
+        bot.halt()
+        return merge([bot])
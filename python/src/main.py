@@ -5,39 +5,33 @@ import os
 from os.path import isfile, join
 
 
+from batch import read_resolution, solve_all
 from config import Config
-from model import Model
-from system import System
 from util import Util
 
 
-# TODO: Loop over all model files, and output solutions/traces to solutions directory.
-def main(filenames=None, resolutions_filter=None, max_model_count=None):
+def main(filenames=None, resolutions_filter=None, max_model_count=None, workers=None, timeout=None,
+         use_cache=True, resolve_ratio=None):
     if not filenames:
-        paths = [join(Util.MODEL_DIR(), p) for p in os.listdir(Util.MODEL_DIR()) if p[0] == 'L']
+        paths = [join(Util.MODEL_DIR(), p) for p in os.listdir(Util.MODEL_DIR()) if p[0] in 'LF']
         filenames = [f for f in paths if isfile(f)]
+    # One file per problem: a Full round problem's source and target are loaded together
+    problems = {}
+    for filename in sorted(filenames):
+        problems.setdefault(Util.problem_name(filename), filename)
+    filenames = list(problems.values())
     resolutions_counter = defaultdict(int)
 
-    model_count = 0
-    for filename in filenames:
-        with open(filename, 'rb') as ifile:
-            data = ifile.read()
-            resolution = data[0]
-            resolutions_counter[resolution] += 1
-            if (not resolutions_filter) or (resolutions_filter and resolution in resolutions_filter):
-                m = Model(filename, data)
-                s = System(m)
-
-                s.trace = s.find_solution()
-                ofilename = join(Util.MY_TRACE_DIR(), 'LA001.nbt')
-                s.trace_write(ofilename, s.trace)
-
-                if Config.VERBOSE:
-                    print(f'Model #{model_count}', end='')
-                m.print()
-                model_count += 1
-                if max_model_count and model_count >= max_model_count:
-                    break
+    selected = []
+    for filename in sorted(filenames):
+        resolution = read_resolution(filename)
+        resolutions_counter[resolution] += 1
+        if (not resolutions_filter) or (resolutions_filter and resolution in resolutions_filter):
+            if not max_model_count or len(selected) < max_model_count:
+                selected.append(filename)
+
+    cache_dir = Util.CACHE_DIR() if use_cache else None
+    solve_all(selected, workers=workers, timeout=timeout, cache_dir=cache_dir, resolve_ratio=resolve_ratio)
 
     if Config.VERBOSE:
         for res in sorted(resolutions_counter.keys()):
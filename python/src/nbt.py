@@ -0,0 +1,205 @@
+import argparse
+from itertools import zip_longest
+import re
+import sys
+
+
+import numpy as np
+
+
+from cmdop import CmdOp
+from columnartrace import BotTracker
+from tracecodec import TraceCodec, WRITE_CHUNK_CMDS
+from util import NanoException, Util, Vec
+
+
+# Command-line tool for .nbt traces:
+#
+#   nbt.py disasm trace.nbt [-o trace.txt]     Writes a trace as text
+#   nbt.py asm trace.txt -o trace.nbt          Writes text back as a trace
+#   nbt.py diff a.nbt b.nbt [--max-diffs N]    Lists the time steps where two traces differ
+#
+# Each reads and writes a chunk at a time, so traces of any length take constant memory.
+#
+# The text has one line per time step: the step number, then each bot's command, in order of bid, with the
+# bot's id, and in the form Cmd's __str__ gives, e.g.:
+#
+#   17: @1 SMove <0, 0, 3>; @2 Fill <0, -1, 0>; @3 Fission <1, 0, 0> | 4
+#
+# Lines starting with '#' are comments. asm reads the commands in order, and ignores the step numbers and
+# bot ids, which are only annotations. It rejects, with the line number, any command whose operands are out of
+# range for its encoding (e.g. an SMove longer than 15, or a Fill of a voxel that isn't near).
+
+_VEC_PATTERN = re.compile(r'<\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*(-?\d+)\s*>')
+_CMD_PATTERN = re.compile(r'(?:@\d+\s+)?([A-Za-z]+)\s*(.*)')
+_ND_TEXT = [str(Util.decode_nd(nd)) for nd in range(27)]
+
+
+def cmd_text(op, nd, args):
+    name = CmdOp(op).name
+    if op in (CmdOp.Halt, CmdOp.Wait, CmdOp.Flip):
+        return name
+    if op == CmdOp.SMove:
+        return f'{name} {Util.decode_lld(args[0], args[1])}'
+    if op == CmdOp.LMove:
+        return f'{name} {Util.decode_sld(args[0], args[1])} {Util.decode_sld(args[2], args[3])}'
+    if op == CmdOp.Fission:
+        return f'{name} {_ND_TEXT[nd]} | {args[0]}'
+    if op in (CmdOp.GFill, CmdOp.GVoid):
+        return f'{name} {_ND_TEXT[nd]} {Util.decode_fd(*args[:3])}'
+    return f'{name} {_ND_TEXT[nd]}'
+
+
+# Checks a linear coordinate difference: non-zero, along one axis, and at most max_len long
+def _check_linear(vec, max_len, kind, text):
+    if vec.mlen() == 0 or vec.mlen() != vec.clen() or vec.mlen() > max_len:
+        raise NanoException(f'Invalid {kind} linear coordinate difference {vec}: {text}')
+
+
+# Returns a command's columnar form, (op, nd, args), from its text
+def parse_cmd(text):
+    text = text.strip()
+    match = _CMD_PATTERN.fullmatch(text)
+    if not match or match.group(1) not in CmdOp.__members__:
+        raise NanoException(f'Unrecognized command: {text}')
+    op = CmdOp[match.group(1)]
+    rest = match.group(2)
+    vecs = [Vec(*map(int, v)) for v in _VEC_PATTERN.findall(rest)]
+    m = re.search(r'\|\s*(\d+)\s*$', rest)
+    expected = {CmdOp.Halt: 0, CmdOp.Wait: 0, CmdOp.Flip: 0, CmdOp.SMove: 1, CmdOp.LMove: 2,
+                CmdOp.GFill: 2, CmdOp.GVoid: 2}.get(op, 1)
+    if len(vecs) != expected or (op == CmdOp.Fission) != (m is not None):
+        raise NanoException(f'Malformed command: {text}')
+    if op == CmdOp.SMove:
+        _check_linear(vecs[0], 15, 'long', text)
+        return op, 0, Util.encode_lld(vecs[0]) + (0, 0)
+    if op == CmdOp.LMove:
+        _check_linear(vecs[0], 5, 'short', text)
+        _check_linear(vecs[1], 5, 'short', text)
+        return op, 0, Util.encode_sld(vecs[0]) + Util.encode_sld(vecs[1])
+    if not expected:
+        return op, 0, (0, 0, 0, 0)
+    if vecs[0].clen() > 1 or not 1 <= vecs[0].mlen() <= 2:
+        raise NanoException(f'Invalid near coordinate difference {vecs[0]}: {text}')
+    nd = Util.encode_ncd(vecs[0])
+    if op == CmdOp.Fission:
+        if int(m.group(1)) > 255:
+            raise NanoException(f'Invalid seed count {m.group(1)}: {text}')
+        return op, nd, (int(m.group(1)), 0, 0, 0)
+    if op in (CmdOp.GFill, CmdOp.GVoid):
+        if vecs[1].clen() > 30:
+            raise NanoException(f'Invalid far coordinate difference {vecs[1]}: {text}')
+        fd = Util.encode_fd(vecs[1])
+        return op, nd, (fd.x, fd.y, fd.z, 0)
+    return op, nd, (0, 0, 0, 0)
+
+
+# Yields the time steps of a trace file, as (step, texts), with the text of each command, as '@bid Cmd'
+def iter_steps(ifilename):
+    tracker = BotTracker()
+    step = None
+    texts = []
+    for ops, nds, args in TraceCodec.iter_arrays(ifilename):
+        bids, steps, _ = tracker.track(ops, nds, args)
+        for bid, s, op, nd, arg in zip(bids.tolist(), steps.tolist(), ops.tolist(), nds.tolist(), args.tolist()):
+            if s != step:
+                if texts:
+                    yield step, texts
+                step = s
+                texts = []
+            texts.append(f'@{bid} {cmd_text(op, nd, arg)}')
+    if texts:
+        yield step, texts
+
+
+def disasm(ifilename, ofile):
+    ofile.write(f'# {ifilename}\n')
+    for step, texts in iter_steps(ifilename):
+        ofile.write(f'{step}: {"; ".join(texts)}\n')
+
+
+def asm(ifile, ofilename):
+    with open(ofilename, 'wb') as ofile:
+        cmds = []
+        for line_number, line in enumerate(ifile, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            line = re.sub(r'^\d+\s*:', '', line)
+            for text in line.split(';'):
+                try:
+                    cmds.append(parse_cmd(text))
+                except NanoException as e:
+                    raise NanoException(f'Line {line_number}: {e}') from None
+            if len(cmds) >= WRITE_CHUNK_CMDS:
+                ofile.write(_encode(cmds))
+                cmds = []
+        ofile.write(_encode(cmds))
+
+
+def _encode(cmds):
+    if not cmds:
+        return b''
+    ops, nds, args = zip(*cmds)
+    return TraceCodec.encode_arrays(np.array(ops), np.array(nds), np.array(args))
+
+
+# Writes the time steps where two traces differ, up to max_diffs of them. Returns the number of steps
+# that differ, including any that one trace has and the other doesn't.
+def diff(filename_a, filename_b, ofile, max_diffs=20):
+    differ = 0
+    steps = 0
+    for a, b in zip_longest(iter_steps(filename_a), iter_steps(filename_b)):
+        steps += 1
+        if a == b:
+            continue
+        differ += 1
+        if differ <= max_diffs:
+            step = a[0] if a else b[0]
+            ofile.write(f'{step}:\n')
+            ofile.write(f'- {"; ".join(a[1]) if a else "(none)"}\n')
+            ofile.write(f'+ {"; ".join(b[1]) if b else "(none)"}\n')
+    if differ > max_diffs:
+        ofile.write(f'... and {differ - max_diffs} more\n')
+    ofile.write(f'{differ} of {steps} steps differ\n')
+    return differ
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nbt', description='Disassemble, assemble and compare .nbt traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('disasm', help='Write a trace as text, one time step per line')
+    p.add_argument('input')
+    p.add_argument('-o', '--output', help='Text file to write (default: standard output)')
+    p = commands.add_parser('asm', help='Write text, as written by disasm, as a trace')
+    p.add_argument('input', help="Text file to read ('-' for standard input)")
+    p.add_argument('-o', '--output', required=True, help='Trace file to write')
+    p = commands.add_parser('diff', help='List the time steps where two traces differ')
+    p.add_argument('a')
+    p.add_argument('b')
+    p.add_argument('--max-diffs', type=int, default=20, help='Steps to show (default: 20)')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'disasm':
+            if args.output:
+                with open(args.output, 'w') as ofile:
+                    disasm(args.input, ofile)
+            else:
+                disasm(args.input, sys.stdout)
+        elif args.command == 'asm':
+            if args.input == '-':
+                asm(sys.stdin, args.output)
+            else:
+                with open(args.input) as ifile:
+                    asm(ifile, args.output)
+        else:
+            return 1 if diff(args.a, args.b, sys.stdout, args.max_diffs) else 0
+    except (NanoException, OSError) as e:
+        print(f'nbt: {e}', file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+import heapq
+from itertools import permutations
+import time
+
+
+import numpy as np
+
+
+from botplan import MAX_LLD, MAX_SLD
+from config import Config
+from deltas import FACE_DIRECTIONS
+from util import Pos
+
+
+# The six directions, as (axis, sign), in the order of the free run length arrays
+DIRECTIONS = FACE_DIRECTIONS
+
+COARSE_BLOCK = 5  # The side of the blocks of the coarse grid, in voxels
+GUIDED_WEIGHT = 1.5  # Of the heuristic in searches guided by the coarse grid
+
+# What moves cost a bot, as charged by System
+LMOVE_COST = Config.COST_MOVE * Config.COST_LMOVE_EXTRA  # On top of MOVE_COST per voxel
+MOVE_COST = Config.COST_MOVE  # Per voxel
+STEP_COST = Config.COST_BOT_PER_STEP
+
+# The states of a bot in searches: at rest in a voxel, or some voxels into an SMove, or into the first or second
+# leg of an LMove. A state is keyed by its voxel's index, mode, direction and number of voxels into the move.
+REST, SMOVE, LMOVE1, LMOVE2 = range(4)
+MODES = 4
+STATES = MODES * 6 * 16  # Per voxel
+REACH = (0, MAX_LLD, 2 * MAX_SLD, MAX_SLD)  # The most voxels a move can cover from the start of each mode
+
+
+# Which voxels bots can't move through: Full voxels, plus voxels reserved by other bots. Blocked voxels are
+# kept in a bit-packed VoxelMatrix.
+#
+# For each of the six directions, a free run length array holds the number of free voxels (up to 15) that
+# follow each voxel in that direction, so that whether a straight move is clear can be answered in O(1).
+# Blocking or unblocking a voxel updates the runs of the 15 voxels before it in each direction.
+#
+# For searches over long distances, a coarse grid of blocks of COARSE_BLOCK voxels per side tells, for each
+# block and axis, whether a bot can cross from the block into the next along the axis: whether some pair of
+# facing voxels across their shared face is free. It's built when first needed, and then only the faces of
+# blocks where voxels changed are recomputed.
+class Occupancy:
+    def __init__(self, matrix):
+        R = matrix.resolution
+        self.resolution = R
+        self.blocked = matrix.snapshot()
+        self.strides = (R * R, R, 1)
+        free = ~self.blocked.to_array()
+        self._runs = [Occupancy._free_runs(free, axis, sign) for axis, sign in DIRECTIONS]
+        self.runs = [memoryview(run.reshape(-1)) for run in self._runs]  # Faster for single elements
+        self.version = 0  # Counts changes, so that searches can tell when what they've cached is stale
+        self.coarse_size = -(-R // COARSE_BLOCK)
+        self._crossings = None
+        self._dirty_blocks = set()
+
+    # Returns, for each axis, a flat array over the coarse grid's blocks: whether the next block along the
+    # axis can be entered from the block
+    def crossings(self):
+        if self._crossings is None:
+            self._crossings = self._all_crossings()
+        elif self._dirty_blocks:
+            C = self.coarse_size
+            for block in self._dirty_blocks:
+                bx, by, bz = block // (C * C), block // C % C, block % C
+                for axis, stride in enumerate((C * C, C, 1)):
+                    b = (bx, by, bz)[axis]
+                    if b + 1 < C:
+                        self._crossings[axis][block] = self._crossing(bx, by, bz, axis)
+                    if b > 0:
+                        prev = [bx, by, bz]
+                        prev[axis] -= 1
+                        self._crossings[axis][block - stride] = self._crossing(*prev, axis)
+            self._dirty_blocks = set()
+        return self._crossings
+
+    def _all_crossings(self):
+        R = self.resolution
+        B = COARSE_BLOCK
+        C = self.coarse_size
+        free = np.zeros((C * B,) * 3, dtype=np.bool_)
+        free[:R, :R, :R] = ~self.blocked.to_array()
+        result = []
+        for axis in range(3):
+            f = np.moveaxis(free, axis, 0)
+            both = (f[B - 1:-1:B] & f[B::B]).reshape(C - 1, C, B, C, B).any(axis=(2, 4))
+            crossing = np.zeros((C, C, C), dtype=np.bool_)
+            crossing[:-1] = both
+            result.append(bytearray(np.ascontiguousarray(np.moveaxis(crossing, 0, axis)).tobytes()))
+        return result
+
+    # Whether block (bx, by, bz) and the next along an axis have a free pair of facing voxels
+    def _crossing(self, bx, by, bz, axis):
+        R = self.resolution
+        B = COARSE_BLOCK
+        lo = [bx * B, by * B, bz * B]
+        hi = [min(c + B, R) - 1 for c in lo]
+        lo[axis] = hi[axis] = (lo[axis] + B) - 1
+        hi[axis] += 1
+        layers = np.moveaxis(self.blocked.get_region(Pos(*lo), Pos(*hi)), axis, 0)
+        return bool(np.any(~layers[0] & ~layers[1]))
+
+    def _changed(self, x, y, z):
+        self.version += 1
+        if self._crossings is not None:
+            B = COARSE_BLOCK
+            C = self.coarse_size
+            self._dirty_blocks.add((x // B * C + y // B) * C + z // B)
+
+    @staticmethod
+    def _free_runs(free, axis, sign):
+        R = free.shape[0]
+        free = np.moveaxis(free, axis, 0)
+        runs = np.zeros(free.shape, dtype=np.uint8)
+        order = range(R - 2, -1, -1) if sign > 0 else range(1, R)
+        for k in order:
+            runs[k] = np.where(free[k + sign], np.minimum(runs[k + sign] + 1, MAX_LLD), 0)
+        return np.ascontiguousarray(np.moveaxis(runs, 0, axis))
+
+    # Recomputes the runs of the voxels before (x, y, z) in each direction, after its state changed
+    def _update_runs(self, x, y, z):
+        R = self.resolution
+        idx = (x * R + y) * R + z
+        coords = (x, y, z)
+        is_blocked = self.blocked.is_full
+        for d, (axis, sign) in enumerate(DIRECTIONS):
+            run = self.runs[d]
+            stride = self.strides[axis] * sign
+            nxt = list(coords)
+            nxt_idx = idx
+            for _ in range(MAX_LLD):
+                if not 0 <= nxt[axis] - sign < R:
+                    break
+                value = 0 if is_blocked(*nxt) else min(run[nxt_idx] + 1, MAX_LLD)
+                prev_idx = nxt_idx - stride
+                if run[prev_idx] == value and nxt_idx != idx:
+                    break
+                run[prev_idx] = value
+                nxt[axis] -= sign
+                nxt_idx = prev_idx
+
+    def block(self, x, y, z):
+        if self.blocked.fill(x, y, z):
+            self._update_runs(x, y, z)
+            self._changed(x, y, z)
+
+    def is_free(self, x, y, z):
+        R = self.resolution
+        return 0 <= x < R and 0 <= y < R and 0 <= z < R and not self.blocked.is_full(x, y, z)
+
+    # The number of free voxels (up to 15) after (x, y, z), in direction d (an index into DIRECTIONS)
+    def run(self, x, y, z, d):
+        return self.runs[d][(x * self.resolution + y) * self.resolution + z]
+
+    # True if the straight move of distance dist (of any length) along an axis from (x, y, z) is clear
+    def segment_free(self, x, y, z, axis, dist):
+        if not dist:
+            return True
+        d = 2 * axis + (dist < 0)
+        step = 1 if dist > 0 else -1
+        remaining = abs(dist)
+        pos = [x, y, z]
+        while remaining > 0:
+            free = self.run(*pos, d)
+            if free >= min(remaining, MAX_LLD):
+                n = min(remaining, MAX_LLD)
+                pos[axis] += n * step
+                remaining -= n
+            else:
+                return False
+        return True
+
+    def unblock(self, x, y, z):
+        if self.blocked.void(x, y, z):
+            self._update_runs(x, y, z)
+            self._changed(x, y, z)
+
+
+# Finds paths for a bot through free voxels. Paths are returned as lists of (axis, distance) legs, with axes
+# 'x', 'y' or 'z' and distances of up to 15, as taken by BotPlan.move_legs (which turns consecutive short
+# legs into LMoves).
+#
+# A path along the axes in some order is tried first, since in open space it's optimal and takes O(1) per
+# leg to check, using the free run lengths. Otherwise, the search is A* over the states of a bot moving a
+# voxel at a time: at rest, or some voxels into an SMove or into either leg of an LMove, as far as the free
+# run lengths allow. Steps cost what moves do in a trace: 2 per voxel, plus 4 for an LMove, plus the bot's 20
+# for the time step each move takes. So the path found is the cheapest, trading a few voxels of detour for
+# fewer moves where that's cheaper. States with fewer voxels into the same move, or at rest, for no more
+# than it costs to start a move, dominate those with more. The heuristic is the cost of covering the
+# Manhattan distance in as few moves as could (2 per voxel, and 20 per 15 voxels, after those the current
+# move can still cover), which is admissible. Ties are broken in favor of deeper nodes.
+#
+# Around large obstacles, like a wall with one opening, A* expands everything closer to the target than the
+# way around. So after local_expansions, it starts over, guided by the coarse grid (see Occupancy): a
+# breadth-first search over blocks from the target's block gives each block a number of faces that any path
+# from it has to cross. Blocks that can't reach the target's are skipped, and if the source's is one of
+# them, there's no path. A path crossing n faces moves at least COARSE_BLOCK · (n - 3) voxels, which
+# sharpens the heuristic while keeping it admissible. Even so, A* would expand the many states whose paths
+# cost within a little of the cheapest, so the heuristic is weighted by GUIDED_WEIGHT, which makes the
+# search nearly direct. Since states are reopened when a cheaper path to them is found, the path then costs
+# at most GUIDED_WEIGHT times the cheapest (in practice, within a few percent). The guided search gives up
+# after max_expansions, or max_seconds.
+class PathFinder:
+    def __init__(self, occupancy, local_expansions=5_000, max_expansions=1_000_000, max_seconds=2.0):
+        self.occupancy = occupancy
+        self.local_expansions = local_expansions
+        self.max_expansions = max_expansions
+        self.max_seconds = max_seconds
+        R = occupancy.resolution
+        self.strides = [(R * R, R, 1)[axis] * sign for axis, sign in DIRECTIONS]
+        self._block_distances = (None, None, None)  # (occupancy version, target block, distances)
+
+    # Returns a path along the axes in some order, or None
+    def direct_path(self, src, dst):
+        occupancy = self.occupancy
+        for order in permutations(range(3)):
+            pos = list(src)
+            for axis in order:
+                if not occupancy.segment_free(*pos, axis, dst[axis] - pos[axis]):
+                    break
+                pos[axis] = dst[axis]
+            else:
+                return PathFinder._legs([(axis, dst[axis] - src[axis]) for axis in order])
+        return None
+
+    @staticmethod
+    def _legs(moves):
+        legs = []
+        for axis, dist in moves:
+            while dist:
+                n = max(-MAX_LLD, min(MAX_LLD, dist))
+                legs.append(('xyz'[axis], n))
+                dist -= n
+        return legs
+
+    # Returns the cheapest path from src to dst, given as (x, y, z), as a list of legs, or None if there isn't
+    # one (or the search gives up). src itself may be blocked, e.g., by the bot's own reservation.
+    def find(self, src, dst):
+        src = tuple(src)
+        dst = tuple(dst)
+        if src == dst:
+            return []
+        if not self.occupancy.is_free(*dst):
+            return None
+        path = self.direct_path(src, dst)
+        if path is not None:
+            return path
+        path = self.search(src, dst, self.local_expansions)
+        if path is not None:
+            return path
+        distances = self.block_distances(dst)
+        if distances[self._block(src)] < 0:
+            return None
+        return self.search(src, dst, self.max_expansions, distances, time.perf_counter() + self.max_seconds,
+                           GUIDED_WEIGHT)
+
+    def _block(self, pos):
+        B = COARSE_BLOCK
+        C = self.occupancy.coarse_size
+        return (pos[0] // B * C + pos[1] // B) * C + pos[2] // B
+
+    # Returns the number of faces between each block of the coarse grid and the one holding dst, by
+    # breadth-first search, a level at a time, or -1 for the blocks that can't reach it. The result is kept
+    # until the occupancy changes.
+    def block_distances(self, dst):
+        version = self.occupancy.version
+        target = self._block(dst)
+        if self._block_distances[:2] == (version, target):
+            return self._block_distances[2]
+        C = self.occupancy.coarse_size
+        crossings = [np.frombuffer(c, dtype=np.bool_) for c in self.occupancy.crossings()]
+        distances = np.full(C**3, -1, dtype=np.int32)
+        distances[target] = 0
+        frontier = np.array([target])
+        d = 0
+        while len(frontier):
+            d += 1
+            reached = []
+            for axis, stride in enumerate((C * C, C, 1)):
+                coord = frontier // stride % C
+                forward = frontier[coord + 1 < C]
+                reached.append(forward[crossings[axis][forward]] + stride)
+                backward = frontier[coord > 0] - stride
+                reached.append(backward[crossings[axis][backward]])
+            frontier = np.unique(np.concatenate(reached))
+            frontier = frontier[distances[frontier] < 0]
+            distances[frontier] = d
+        distances = distances.tolist()
+        self._block_distances = (version, target, distances)
+        return distances
+
+    # A* from src to dst, expanding at most max_expansions states, until the deadline, if any. With block
+    # distances (see block_distances), they prune and sharpen the heuristic, which is multiplied by weight.
+    def search(self, src, dst, max_expansions, block_distances=None, deadline=None, weight=1):
+        R = self.occupancy.resolution
+        runs = self.occupancy.runs
+        strides = self.strides
+        B = COARSE_BLOCK
+        C = self.occupancy.coarse_size
+        tx, ty, tz = dst
+        target = (tx * R + ty) * R + tz
+        start = (src[0] * R + src[1]) * R + src[2]
+        costs = {start * STATES: 0}
+        parents = {start * STATES: None}
+        heap = [(0, 0, start * STATES, start, src)]
+        expansions = 0
+
+        def push(g, idx, pos, mode, d, k):
+            key = idx * STATES + (mode * 6 + d) * 16 + k
+            if g >= costs.get(key, g + 1):
+                return
+            # Being fewer voxels into the same move, or at rest, for as little, leaves at least as many options
+            restart = STEP_COST + (LMOVE_COST if mode == LMOVE1 else 0)
+            if mode != REST and (g >= costs.get(idx * STATES, g + 1) + restart
+                                 or any(g >= costs.get(key - j, g + 1) for j in range(1, k))):
+                return
+            distance = abs(pos[0] - tx) + abs(pos[1] - ty) + abs(pos[2] - tz)
+            if block_distances is not None:
+                n = block_distances[(pos[0] // B * C + pos[1] // B) * C + pos[2] // B]
+                if n < 0:
+                    return
+                distance = max(distance, B * (n - 3))
+            left = distance - (REACH[mode] - k)  # Beyond what the current move can still cover
+            h = MOVE_COST * distance + STEP_COST * (-(-left // MAX_LLD) if left > 0 else 0)
+            costs[key] = g
+            parents[key] = prev
+            heapq.heappush(heap, (g + weight * h, -g, key, idx, pos))
+
+        while heap:
+            _, neg_g, prev, idx, pos = heapq.heappop(heap)
+            k = prev % 16
+            mode, d = divmod(prev // 16 % (MODES * 6), 6)
+            if mode == REST and idx == target:
+                return PathFinder._path(parents, prev)
+            g = -neg_g
+            if g > costs[prev]:
+                continue
+            expansions += 1
+            if expansions > max_expansions:
+                return None
+            if deadline and not expansions & 1023 and time.perf_counter() > deadline:
+                return None
+            if mode == REST:
+                for d1, (axis1, sign1) in enumerate(DIRECTIONS):
+                    if runs[d1][idx]:
+                        npos = list(pos)
+                        npos[axis1] += sign1
+                        npos = tuple(npos)
+                        push(g + STEP_COST + MOVE_COST, idx + strides[d1], npos, SMOVE, d1, 1)
+                        push(g + STEP_COST + LMOVE_COST + MOVE_COST, idx + strides[d1], npos, LMOVE1, d1, 1)
+                continue
+            if mode != LMOVE1:
+                push(g, idx, pos, REST, 0, 0)
+            axis, sign = DIRECTIONS[d]
+            if k < (MAX_LLD if mode == SMOVE else MAX_SLD) and runs[d][idx]:
+                npos = list(pos)
+                npos[axis] += sign
+                push(g + MOVE_COST, idx + strides[d], tuple(npos), mode, d, k + 1)
+            if mode == LMOVE1:
+                for d2, (axis2, sign2) in enumerate(DIRECTIONS):
+                    if axis2 != axis and runs[d2][idx]:
+                        npos = list(pos)
+                        npos[axis2] += sign2
+                        push(g + MOVE_COST, idx + strides[d2], tuple(npos), LMOVE2, d2, 1)
+        return None
+
+    # Returns the legs of the path that ends in the given state
+    @staticmethod
+    def _path(parents, key):
+        states = []
+        while parents[key] is not None:
+            states.append(key)
+            key = parents[key]
+        legs = []
+        for key in reversed(states):
+            k = key % 16
+            mode, d = divmod(key // 16 % (MODES * 6), 6)
+            if mode == REST:
+                continue
+            axis, sign = DIRECTIONS[d]
+            if k == 1:
+                legs.append(['xyz'[axis], sign])
+            else:
+                legs[-1][1] += sign
+        return [tuple(leg) for leg in legs]
@@ -0,0 +1,220 @@
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import multiprocessing
+import os
+from os.path import join
+import signal
+import tempfile
+import time
+
+
+import numpy as np
+
+
+from boxplanner import BoxPlanner
+from cmdop import CmdOp
+from disassemblyplanner import DisassemblyPlanner
+from energyestimator import EnergyEstimator
+from harmonicsscheduler import HarmonicsScheduler
+from layerplanner import LayerPlanner
+from reassemblyplanner import ReassemblyPlanner
+from slabplanner import SlabPlanner
+from system import System
+from traceoptimizer import TraceOptimizer
+from util import NanoException
+
+
+class SolveTimeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise SolveTimeout('Timed out')
+
+
+# Registered planners, by name: (plan, applies), where plan(model, source) returns a trace, and
+# applies(model, source) tells whether it can solve the problem
+PLANNERS = {}
+
+
+def register_planner(name, plan, applies):
+    PLANNERS[name] = (plan, applies)
+
+
+def _assembly(model, source):
+    return source is None
+
+
+def _disassembly(model, source):
+    return source is not None and not model.matrix.count_full()
+
+
+def _reassembly(model, source):
+    return source is not None
+
+
+register_planner('slab', lambda model, source: SlabPlanner(model).plan(), _assembly)
+register_planner('box', lambda model, source: BoxPlanner(model).plan(), _assembly)
+register_planner('layer', lambda model, source: LayerPlanner(model).plan(), _assembly)
+register_planner('disassembly-box', lambda model, source: DisassemblyPlanner(source, BoxPlanner).plan(),
+                 _disassembly)
+register_planner('disassembly-slab', lambda model, source: DisassemblyPlanner(source, SlabPlanner).plan(),
+                 _disassembly)
+register_planner('disassembly-layer', lambda model, source: DisassemblyPlanner(source, LayerPlanner).plan(),
+                 _disassembly)
+register_planner('reassembly', lambda model, source: ReassemblyPlanner(source, model).plan(), _reassembly)
+
+
+_best_energy = None  # In worker processes, the lowest energy of a valid trace found so far, shared by all
+
+
+def _init_worker(best_energy):
+    global _best_energy
+    _best_energy = best_energy
+
+
+# Runs one planner, in a worker process, within timeout seconds: plans, post-processes with TraceOptimizer
+# and HarmonicsScheduler, and simulates the result. Gives up if EnergyEstimator shows that the trace can't beat
+# the best found so far by any worker: before planning, if even the problem's lower bound can't, and after each
+# post-processing pass, from the trace's estimate (after optimizing, as if it were all in Low harmonics, which
+# scheduling can't improve on). A raw plan isn't judged, as both passes only ever lower its energy. Returns a
+# summary, with the trace if it's valid and the best so far.
+def run_planner(name, model, source=None, timeout=None):
+    start = time.perf_counter()
+    result = {'planner': name, 'status': 'ok', 'energy': None, 'valid': False, 'error': None, 'seconds': None,
+              'trace': None}
+    estimator = EnergyEstimator(model, source)
+
+    def beaten(energy):
+        if _best_energy is None or energy < _best_energy.value:
+            return False
+        result['status'] = 'pruned'
+        result['energy'] = energy
+        return True
+
+    def estimate(trace, scheduled):
+        ops, nds, args = trace
+        if not scheduled:
+            trace = (np.where(ops == CmdOp.Flip, np.uint8(CmdOp.Wait), ops), nds, args)
+        return estimator.estimate(trace)
+
+    if timeout:
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if beaten(estimator.lower_bound()):
+            return result
+        plan, _ = PLANNERS[name]
+        trace = plan(model, source)
+        trace, _ = TraceOptimizer(model, source).optimize(trace)
+        if beaten(estimate(trace, False)):
+            return result
+        trace, _ = HarmonicsScheduler(model, source).schedule(trace)
+        if beaten(estimate(trace, True)):
+            return result
+        system = System(model, source)
+        energy, valid = system.run(trace)
+        result.update(energy=energy, valid=valid, error=system.error)
+        if valid:
+            if _best_energy is None:
+                result['trace'] = trace
+            else:
+                with _best_energy.get_lock():
+                    if energy < _best_energy.value:
+                        _best_energy.value = energy
+                        result['trace'] = trace
+    except SolveTimeout:
+        result['status'] = 'timeout'
+    except NanoException as e:
+        result.update(status='error', error=str(e))
+    except Exception as e:  # A bug in one planner fails its run, not the whole portfolio
+        result.update(status='error', error=f'{type(e).__name__}: {e}')
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# Which planner won each model, and the energies each planner reached, kept as a JSON file per model, so
+# that later runs can start with the planners most likely to win. Files are written to a temporary name and
+# renamed, so concurrent runs never read a partial one.
+class PlannerHistory:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, name):
+        try:
+            with open(join(self.directory, f'{name}.json')) as ifile:
+                return json.load(ifile)
+        except (OSError, ValueError):
+            return {'winner': None, 'wins': {}, 'energies': {}}
+
+    def record(self, name, winner, energies):
+        history = self.load(name)
+        if winner:
+            history['winner'] = winner
+            history['wins'][winner] = history['wins'].get(winner, 0) + 1
+        for planner, energy in energies.items():
+            best = history['energies'].get(planner)
+            history['energies'][planner] = energy if best is None else min(best, energy)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as ofile:
+            json.dump(history, ofile, indent=2)
+        os.replace(tmp_filename, join(self.directory, f'{name}.json'))
+
+    # Orders planner names: the last winner first, then by the best energy each has reached, then the rest
+    def order(self, name, planners):
+        history = self.load(name)
+        energies = history['energies']
+
+        def key(planner):
+            return (planner != history['winner'], planner not in energies, energies.get(planner, 0))
+        return sorted(planners, key=key)
+
+
+# Races the registered planners that apply to a problem, each in its own worker process with a wall-clock
+# budget of timeout seconds, and keeps the lowest-energy valid trace. The workers share the best energy found
+# so far, so that planners that can't beat it stop after planning. With a history, planners are started in
+# order of their past results, so that with fewer workers than planners, the likely winner sets the bar early.
+class Portfolio:
+    def __init__(self, model, source=None, planners=None, workers=None, timeout=None, history=None):
+        self.model = model
+        self.source = source
+        names = planners or list(PLANNERS)
+        self.planners = [name for name in names if PLANNERS[name][1](model, source)]
+        self.workers = workers or min(len(self.planners), os.cpu_count()) or 1
+        self.timeout = timeout
+        self.history = history
+        self.results = []  # Summaries of the last solve's runs, without their traces
+
+    # Returns the best trace, its energy, and the planner that made it, or (None, None, None) if no planner
+    # made a valid trace
+    def solve(self):
+        planners = self.planners
+        if self.history:
+            planners = self.history.order(self.model.name, planners)
+        best = (None, None, None)
+        self.results = []
+        best_energy = multiprocessing.Value('d', float('inf'))
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(best_energy,)) as pool:
+            futures = {pool.submit(run_planner, name, self.model, self.source, self.timeout): name
+                       for name in planners}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = f'Worker died: {e}' if isinstance(e, BrokenProcessPool) else f'{type(e).__name__}: {e}'
+                    result = {'planner': futures[future], 'status': 'error', 'energy': None, 'valid': False,
+                              'error': error, 'seconds': None, 'trace': None}
+                trace = result.pop('trace')
+                if trace is not None and (best[1] is None or result['energy'] < best[1]):
+                    best = (trace, result['energy'], result['planner'])
+                self.results.append(result)
+        if self.history:
+            energies = {r['planner']: r['energy'] for r in self.results if r['valid']}
+            self.history.record(self.model.name, best[2], energies)
+        return best
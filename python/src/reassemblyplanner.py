@@ -0,0 +1,128 @@
+import numpy as np
+
+
+from botplan import BotPlan, merge
+from deltas import ND_OFFSETS
+from pathfinder import Occupancy, PathFinder
+from slabplanner import INITIAL_SEEDS, MAX_BOTS, SlabPlanner
+from util import NanoException
+from voxelmatrix import VoxelMatrix
+
+
+# Near coordinate differences from a bot to a voxel it fills or voids, in order of preference: from above
+# (where the planner hovers), then from the side, then from below
+NEAR_DELTAS = sorted(map(tuple, ND_OFFSETS.tolist()), key=lambda d: (d[1], abs(d[0]) + abs(d[2])))
+
+
+# Turns a source model into a target model, leaving the voxels they share in place, with up to 40 bots
+# working in parallel, each on its own slab of x planes, as in SlabPlanner.
+#
+# Each bot first voids its slab's voxels that only the source has, top down, then fills those that only the
+# target has, bottom up, one layer at a time, hovering over strips of three x planes, as in SlabPlanner.
+# Since shared voxels stay, the places it would hover at can be Full, and it moves with a PathFinder,
+# confined to its slab. Where it can't hover over a voxel, it reaches it from any free voxel nearby. The
+# line y = 0, z = 0, where bots travel to and from their slabs, is kept clear of the others' paths.
+#
+# Voiding top down and filling bottom up doesn't always keep the matrix grounded, so the trace is built in
+# High harmonics, for HarmonicsScheduler to trim.
+class ReassemblyPlanner:
+    def __init__(self, source, target, max_bots=MAX_BOTS):
+        self.source = source
+        self.target = target
+        self.max_bots = max_bots
+
+    def plan(self):
+        R = self.target.resolution
+        full = self.source.matrix.to_array()
+        target = self.target.matrix.to_array()
+        remove = full & ~target
+        add = target & ~full
+        root = BotPlan(1, (0, 0, 0), seeds=INITIAL_SEEDS)
+        if not (remove.any() or add.any()) or R < 3:
+            root.halt()
+            return merge([root])
+
+        slabs = SlabPlanner(self.target, self.max_bots).slabs(remove | add)
+        n = len(slabs)
+        root.flip()
+        root.move_to(slabs[0][0], 0, 0)
+        bots = [root]
+        for k in range(1, n):
+            child = bots[-1].fission(1, 0, 0, n - 1 - k)
+            child.move_to(slabs[k][0], 0, 0)
+            bots.append(child)
+
+        for bot, slab in zip(bots, slabs):
+            self.plan_slab(bot, full, remove, add, slab)
+
+        for k in range(n - 1, 0, -1):
+            bots[k].move_to(slabs[k - 1][0] + 1, 0, 0)
+            bots[k - 1].fuse(bots[k])
+        root.move_to(0, 0, 0)
+        root.flip()
+        root.halt()
+        return merge(bots)
+
+    # Voids, then fills, a slab's voxels, and returns to the slab's home
+    def plan_slab(self, bot, full, remove, add, slab):
+        x0, x1 = slab
+        home = bot.pos
+        if not (remove[x0:x1 + 1].any() or add[x0:x1 + 1].any()):
+            return
+        blocked = full.copy()
+        blocked[:x0] = True
+        blocked[x1 + 1:] = True
+        blocked[x0 + 1:x1 + 1, 0, 0] = True  # The line bots travel on, besides home
+        occupancy = Occupancy(VoxelMatrix.from_array(blocked))
+        finder = PathFinder(occupancy)
+
+        def go(station):
+            if station == bot.pos:
+                return True
+            if not occupancy.is_free(*station):
+                return False
+            legs = finder.find(bot.pos, station)
+            if legs is None:
+                return False
+            bot.move_legs(legs)
+            return True
+
+        def change(voxels, is_fill):
+            for x, y, z in voxels:
+                if is_fill:
+                    occupancy.block(x, y, z)
+                    bot.fill(x - bot.pos[0], y - bot.pos[1], z - bot.pos[2])
+                else:
+                    occupancy.unblock(x, y, z)
+                    bot.void(x - bot.pos[0], y - bot.pos[1], z - bot.pos[2])
+
+        def reach(voxel):
+            for dx, dy, dz in NEAR_DELTAS:
+                station = (voxel[0] - dx, voxel[1] - dy, voxel[2] - dz)
+                if go(station):
+                    return
+            raise NanoException(f'Voxel {voxel} can\'t be reached')
+
+        for voxels, layers, is_fill in [(remove, range(full.shape[1] - 1, -1, -1), False),
+                                        (add, range(full.shape[1]), True)]:
+            strips = [(a, min(a + 2, x1)) for a in range(x0, x1 + 1, 3)]
+            layers = [y for y in layers if voxels[x0:x1 + 1, y].any()]
+            for layer_index, y in enumerate(layers):
+                for a, b in (strips if layer_index % 2 == 0 else strips[::-1]):
+                    mask = voxels[a:b + 1, y, :]
+                    zs = np.flatnonzero(mask.any(axis=0))
+                    if not len(zs):
+                        continue
+                    c = min(a + 1, b)
+                    if abs(bot.pos[2] - zs[-1]) < abs(bot.pos[2] - zs[0]):
+                        zs = zs[::-1]
+                    for z in zs.tolist():
+                        column = [(a + k, y, z) for k in np.flatnonzero(mask[:, z]).tolist()]
+                        if go((c, y + 1, z)):
+                            change(column, is_fill)
+                            continue
+                        for voxel in column:
+                            reach(voxel)
+                            change([voxel], is_fill)
+        if not go(home):
+            raise NanoException(f'Bot {bot.bid} can\'t return home')
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+from botplan import BotPlan, merge
+
+
+MAX_BOTS = 40
+INITIAL_SEEDS = list(range(2, MAX_BOTS + 1))
+
+
+# Builds a model with up to 40 bots working in parallel, each on its own slab of x planes.
+#
+# Model voxels lie in x and z in [1, R - 2] and y in [0, R - 2], so the planes x = 0 and z = 0 are empty.
+# The slabs are contiguous ranges of x planes, balanced by their number of Full voxels. Bots travel on the
+# line y = 0, z = 0: the first bot moves to its slab's first plane (its home), and each bot in turn fissions
+# the next one, which moves on to its own home.
+#
+# Each bot then fills its slab bottom up, one layer at a time. It works in strips of up to three x planes,
+# hovering over the strip's middle plane at height y + 1 and filling the voxels below it, so it only ever
+# moves through empty voxels of its own slab. When done, it returns home along z = 0, and the bots fuse
+# back in reverse order, each moving next to the previous bot's home. The trace is built in High harmonics,
+# ending with the first bot back at the origin.
+class SlabPlanner:
+    def __init__(self, model, max_bots=MAX_BOTS):
+        self.model = model
+        self.max_bots = max_bots
+
+    # Returns the inclusive ranges of x planes of the slabs, balanced by their number of Full voxels
+    def slabs(self, full):
+        R = self.model.resolution
+        plane_count = R - 2
+        counts = full.sum(axis=(1, 2))[1:R - 1]
+        n = max(1, min(self.max_bots, plane_count))
+        cumulative = np.cumsum(counts)
+        total = cumulative[-1] if plane_count > 0 else 0
+        cuts = np.searchsorted(cumulative, total * np.arange(1, n) / n, side='right') + 1
+        bounds = [0]
+        for k, cut in enumerate(cuts.tolist()):
+            bounds.append(min(max(cut, bounds[-1] + 1), plane_count - (n - 1 - k)))
+        bounds.append(plane_count)
+        return [(1 + bounds[k], bounds[k + 1]) for k in range(n)]
+
+    def plan(self):
+        R = self.model.resolution
+        full = self.model.matrix.to_array()
+        root = BotPlan(1, (0, 0, 0), seeds=INITIAL_SEEDS)
+        if not full.any() or R < 3:
+            root.halt()
+            return merge([root])
+
+        slabs = self.slabs(full)
+        n = len(slabs)
+        root.flip()
+        root.move_to(slabs[0][0], 0, 0)
+        bots = [root]
+        for k in range(1, n):
+            child = bots[-1].fission(1, 0, 0, n - 1 - k)
+            child.move_to(slabs[k][0], 0, 0)
+            bots.append(child)
+
+        for bot, slab in zip(bots, slabs):
+            self.plan_slab(bot, full, slab)
+
+        for k in range(n - 1, 0, -1):
+            bots[k].move_to(slabs[k - 1][0] + 1, 0, 0)
+            bots[k - 1].fuse(bots[k])
+        root.move_to(0, 0, 0)
+        root.flip()
+        root.halt()
+        return merge(bots)
+
+    # Fills a slab layer by layer, then returns to the slab's home.
+    def plan_slab(self, bot, full, slab):
+        x0, x1 = slab
+        home = bot.pos
+        strips = [(a, min(a + 2, x1)) for a in range(x0, x1 + 1, 3)]
+        layers = np.flatnonzero(full[x0:x1 + 1].any(axis=(0, 2)))
+        if not len(layers):
+            return
+        bot.move_to(x0, 1, 0, order='y')
+        for layer_index, y in enumerate(layers.tolist()):
+            ordered = strips if layer_index % 2 == 0 else strips[::-1]
+            for a, b in ordered:
+                mask = full[a:b + 1, y, :]
+                zs = np.flatnonzero(mask.any(axis=0))
+                if not len(zs):
+                    continue
+                c = min(a + 1, b)
+                x, _, z = bot.pos
+                if abs(z - zs[-1]) < abs(z - zs[0]):
+                    zs = zs[::-1]
+                bot.move_to(x, y + 1, z, order='y')
+                bot.move_to(c, y + 1, int(zs[0]), order='xz')
+                columns = mask[:, zs].T.tolist()
+                for z, column in zip(zs.tolist(), columns):
+                    bot.move_to(c, y + 1, z, order='z')
+                    for dx, is_full in zip(range(a - c, b - c + 1), column):
+                        if is_full:
+                            bot.fill(dx, -1, 0)
+        x, y, z = bot.pos
+        bot.move_to(x0, y, 0, order='zx')
+        bot.move_to(*home, order='y')
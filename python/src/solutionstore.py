@@ -0,0 +1,84 @@
+import fcntl
+import hashlib
+import json
+import os
+from os.path import basename, join
+import tempfile
+
+
+from tracecodec import TraceCodec
+from util import Util
+
+
+# Returns a digest of a problem's model files (e.g. a Full round problem's source and target), from their names
+# and contents. file_hash(filename), if given, returns a file's digest, e.g. Cache.file_hash, which remembers
+# them.
+def problem_hash(filenames, file_hash=None):
+    h = hashlib.sha256()
+    for filename in sorted(filenames):
+        if file_hash:
+            digest = file_hash(filename)
+        else:
+            with open(filename, 'rb') as ifile:
+                digest = hashlib.sha256(ifile.read()).hexdigest()
+        h.update(f'{basename(filename)} {digest}\n'.encode())
+    return h.hexdigest()
+
+
+def _write_json(filename, value):
+    with open(filename, 'w') as ofile:
+        json.dump(value, ofile, indent=2)
+
+
+# The best trace known for each problem, as <name>.nbt, ready for submission, with a record of it in
+# <name>.json: its simulated energy, the planner that made it, the hash of the problem's model files, and the
+# lower bound on the energy (see EnergyEstimator). A trace is only replaced by one using less energy, or if
+# the problem's files have changed since it was stored.
+#
+# Files are written to temporary names and renamed, so readers never see a partial one. Writers hold a lock on
+# <name>.lock while they compare and replace, so that concurrent runs can't replace a better trace with a
+# worse one.
+class SolutionStore:
+    def __init__(self, directory=None):
+        self.directory = directory or Util.MY_TRACE_DIR()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # Writes a file with write(filename), under a temporary name, and renames it
+    def _replace(self, filename, write):
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            write(tmp_filename)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
+
+    # Returns the record of a problem's best trace, or None if there's none for its current files
+    def best(self, name, model_hash=None):
+        try:
+            with open(join(self.directory, f'{name}.json')) as ifile:
+                record = json.load(ifile)
+        except (OSError, ValueError):
+            return None
+        if model_hash and record['model_hash'] != model_hash:
+            return None
+        return record
+
+    # Whether a problem is worth solving again: it has no best trace, or its energy is more than ratio times
+    # the lower bound
+    def needs_solving(self, name, model_hash, ratio):
+        record = self.best(name, model_hash)
+        return record is None or record['energy'] > ratio * record['lower_bound']
+
+    # Stores a valid trace if it's the problem's best. Returns whether it was stored.
+    def submit(self, name, trace, energy, planner, model_hash, lower_bound):
+        with open(join(self.directory, f'{name}.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            record = self.best(name, model_hash)
+            if record is not None and record['energy'] <= energy:
+                return False
+            record = {'energy': energy, 'planner': planner, 'model_hash': model_hash, 'lower_bound': lower_bound}
+            self._replace(join(self.directory, f'{name}.nbt'), lambda filename: TraceCodec.write_trace(filename, trace))
+            self._replace(join(self.directory, f'{name}.json'), lambda filename: _write_json(filename, record))
+            return True
@@ -0,0 +1,280 @@
+from collections import deque
+
+
+from botplan import BotPlan, merge
+from cmdop import CmdOp
+from columnartrace import INITIAL_SEEDS
+from deltas import LLD_MOVES, ND_DELTAS, SLD_MOVES
+from pathfinder import Occupancy, PathFinder
+from util import NanoException
+from voxelmatrix import VoxelMatrix
+
+
+MAX_STALL_STEPS = 100  # Steps in which no bot makes progress before giving up
+REROUTE_AFTER_STEPS = 2  # Steps a move waits before looking for another path
+MOVE_OPS = (CmdOp.SMove, CmdOp.LMove)
+
+
+# Returns the voxels along a move's path, after its start, or None if the command is invalid
+def move_cells(pos, op, args):
+    if op == CmdOp.SMove:
+        legs = [LLD_MOVES[args[0]][args[1]]]
+    else:
+        legs = [SLD_MOVES[args[0]][args[1]], SLD_MOVES[args[2]][args[3]]]
+    cells = []
+    x, y, z = pos
+    for leg in legs:
+        if leg is None:
+            return None
+        dx, dy, dz, n = leg
+        for _ in range(n):
+            x, y, z = x + dx // n, y + dy // n, z + dz // n
+            cells.append((x, y, z))
+    return cells
+
+
+def near(pos, nd):
+    dx, dy, dz = ND_DELTAS[nd]
+    return (pos[0] + dx, pos[1] + dy, pos[2] + dz)
+
+
+# Returns a group command's region, as (x0, x1, y0, y1, z0, z1)
+def group_region(pos, nd, args):
+    cx, cy, cz = near(pos, nd)
+    ox, oy, oz = cx + args[0] - 30, cy + args[1] - 30, cz + args[2] - 30
+    return (min(cx, ox), max(cx, ox), min(cy, oy), max(cy, oy), min(cz, oz), max(cz, oz))
+
+
+# Volatile voxels by time step, each reserved by one bot, or by one group command for all of its bots
+class ReservationTable:
+    def __init__(self):
+        self._steps = {}
+
+    def conflicts(self, step, cells, bid):
+        reserved = self._steps.get(step, {})
+        return any(reserved.get(cell, bid) != bid for cell in cells)
+
+    def owner(self, step, cell):
+        return self._steps.get(step, {}).get(cell)
+
+    def release_before(self, step):
+        for s in [s for s in self._steps if s < step]:
+            del self._steps[s]
+
+    def reserve(self, step, cells, bid):
+        reserved = self._steps.setdefault(step, {})
+        for cell in cells:
+            reserved[cell] = bid
+
+
+# A bot while it's being scheduled: its position, seeds, remaining commands, and scheduled plan
+class _Bot:
+    def __init__(self, plan, pos, seeds, start):
+        self.bid = plan.bid
+        self.pos = pos
+        self.seeds = seeds
+        self.queue = deque(zip(plan.ops, plan.nds, plan.args))
+        self.out = BotPlan(plan.bid, pos, start)
+        self.stalled = 0  # Consecutive steps its next command has waited
+
+
+# Interleaves per-bot command queues into a valid multi-bot trace.
+#
+# Each bot's BotPlan is taken as a queue of commands, whose step alignment is ignored: the scheduler steps
+# through time, and in each step, in order of bid, gives each active bot its next command if it can run,
+# or else a Wait. Every bot's position is reserved for the step first; then each command reserves the rest
+# of its volatile voxels (a move's path, a Fill's voxel, a group's region), and can't run if any of them is
+# reserved by another bot, or if it moves through a Full voxel. Fusions run once both bots are ready, group
+# commands once every corner's bot is, and a Halt once its bot is alone. Fissions start the child's plan
+# (found by the bid the child gets) in the next step.
+#
+# A move that has waited for REROUTE_AFTER_STEPS is re-routed, with a PathFinder, around the Full voxels
+# and the other bots, to the end of the moves at the head of its queue.
+class StepScheduler:
+    def __init__(self, model):
+        self.model = model
+        self.matrix = VoxelMatrix(model.resolution)
+        self.occupancy = None  # Built on the first re-route, then kept up to date
+        self.table = ReservationTable()
+
+    def _block(self, x, y, z):
+        if self.occupancy is not None:
+            self.occupancy.block(x, y, z)
+
+    def _in_bounds(self, cells):
+        R = self.model.resolution
+        return all(0 <= c < R for cell in cells for c in cell)
+
+    # Replaces the moves at the head of a bot's queue with a path around the Full voxels and the other
+    # bots, if there is one
+    def _reroute(self, bot, bots):
+        pos = bot.pos
+        moves = 0
+        for op, nd, args in bot.queue:
+            if op not in MOVE_OPS:
+                break
+            cells = move_cells(pos, op, args)
+            if cells is None or not self._in_bounds(cells):
+                raise NanoException(f'StepScheduler: Invalid move for bot {bot.bid}')
+            pos = cells[-1]
+            moves += 1
+        if self.occupancy is None:
+            self.occupancy = Occupancy(self.matrix)
+        others = [b.pos for b in bots.values() if b is not bot and not self.occupancy.blocked.is_full(*b.pos)]
+        for p in others:
+            self.occupancy.block(*p)
+        legs = PathFinder(self.occupancy).find(bot.pos, pos)
+        for p in others:
+            self.occupancy.unblock(*p)
+        if not legs:
+            return
+        detour = BotPlan(bot.bid, bot.pos)
+        detour.move_legs(legs)
+        for _ in range(moves):
+            bot.queue.popleft()
+        bot.queue.extendleft(reversed(list(zip(detour.ops, detour.nds, detour.args))))
+
+    # Returns the voxels a bot's next command needs besides the bot's position, or None if it can't run in
+    # this step. Fusions and group commands are checked by the caller.
+    def _needs(self, bot, op, nd, args, bots):
+        if op in MOVE_OPS:
+            cells = move_cells(bot.pos, op, args)
+            if cells is None or not self._in_bounds(cells):
+                raise NanoException(f'StepScheduler: Invalid move for bot {bot.bid}')
+            if any(self.matrix.is_full(*cell) for cell in cells):
+                return None
+            return cells
+        if op in (CmdOp.Fill, CmdOp.Void):
+            return [near(bot.pos, nd)]
+        if op == CmdOp.Fission:
+            cell = near(bot.pos, nd)
+            return None if self.matrix.is_full(*cell) else [cell]
+        if op == CmdOp.Halt:
+            return [] if len(bots) == 1 else None
+        return []
+
+    # Returns the fusions that can run in this step, as a dict from each bot's bid to its partner's: those
+    # where both bots' next commands are the matching FusionP and FusionS
+    def _ready_fusions(self, step, bots):
+        ready = {}
+        for bot in bots.values():
+            if not bot.queue or bot.queue[0][0] != CmdOp.FusionP:
+                continue
+            other = bots.get(self.table.owner(step, near(bot.pos, bot.queue[0][1])))
+            if other is None or not other.queue or other.queue[0][0] != CmdOp.FusionS:
+                continue
+            if near(other.pos, other.queue[0][1]) == bot.pos:
+                ready[bot.bid] = other.bid
+                ready[other.bid] = bot.bid
+        return ready
+
+    # Returns the set of bids of the bots whose group commands can run in this step: those whose groups
+    # have a bot at every corner, and whose regions don't hold any bot, including their own. A region is
+    # reserved for its group as a whole, under the group's key rather than any one member's bid.
+    def _ready_groups(self, step, bots):
+        groups = {}
+        for bot in bots.values():
+            if bot.queue and bot.queue[0][0] in (CmdOp.GFill, CmdOp.GVoid):
+                op, nd, args = bot.queue[0]
+                key = (op, group_region(bot.pos, nd, args))
+                groups.setdefault(key, []).append(bot)
+        ready = set()
+        for (op, region), members in groups.items():
+            x0, x1, y0, y1, z0, z1 = region
+            dim = (x0 != x1) + (y0 != y1) + (z0 != z1)
+            corners = {near(b.pos, b.queue[0][1]) for b in members}
+            if len(members) != 1 << dim or len(corners) != len(members):
+                continue
+            if any(x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1 for x, y, z in (b.pos for b in members)):
+                continue
+            cells = [(x, y, z) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for z in range(z0, z1 + 1)]
+            if not self.table.conflicts(step, cells, (op, region)):
+                self.table.reserve(step, cells, (op, region))
+                ready.update(b.bid for b in members)
+        return ready
+
+    def _apply(self, bot, op, nd, args, cells, partner, spawned, plans):
+        if op in MOVE_OPS:
+            bot.pos = cells[-1]
+        elif op == CmdOp.Fill:
+            if self.matrix.fill(*cells[0]):
+                self._block(*cells[0])
+        elif op == CmdOp.Void:
+            if self.matrix.void(*cells[0]) and self.occupancy is not None:
+                self.occupancy.unblock(*cells[0])
+        elif op in (CmdOp.GFill, CmdOp.GVoid):
+            x0, x1, y0, y1, z0, z1 = group_region(bot.pos, nd, args)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    for z in range(z0, z1 + 1):
+                        if op == CmdOp.GVoid:
+                            if self.matrix.void(x, y, z) and self.occupancy is not None:
+                                self.occupancy.unblock(x, y, z)
+                        elif self.matrix.fill(x, y, z):
+                            self._block(x, y, z)
+        elif op == CmdOp.Fission:
+            m = args[0]
+            child_bid = bot.seeds[0]
+            queue = plans.get(child_bid)
+            if not queue:
+                raise NanoException(f'StepScheduler: No plan for bot {child_bid}')
+            spawned.append((queue.popleft(), cells[0], bot.seeds[1:m + 1]))
+            bot.seeds = bot.seeds[m + 1:]
+        elif op == CmdOp.FusionP:
+            bot.seeds = sorted(bot.seeds + [partner.bid] + partner.seeds)
+
+    # Returns the trace, in columnar form, and the scheduled bot plans
+    def schedule(self, plans):
+        queues = {}
+        for plan in sorted(plans, key=lambda p: p.start):
+            queues.setdefault(plan.bid, deque()).append(plan)
+        root = queues[1].popleft()
+        bots = {1: _Bot(root, (0, 0, 0), list(INITIAL_SEEDS), 0)}
+        scheduled = []
+        step = 0
+        stalled_steps = 0
+        while bots and any(b.queue for b in bots.values()):
+            self.table.release_before(step)
+            for bot in bots.values():
+                self.table.reserve(step, [bot.pos], bot.bid)
+            fusions = self._ready_fusions(step, bots)
+            groups = self._ready_groups(step, bots)
+            spawned = []
+            finished = []
+            progress = False
+            for bid in sorted(bots):
+                bot = bots[bid]
+                if not bot.queue:
+                    bot.out.wait()
+                    continue
+                op, nd, args = bot.queue[0]
+                if op in (CmdOp.GFill, CmdOp.GVoid):
+                    cells = [] if bid in groups else None
+                elif op in (CmdOp.FusionP, CmdOp.FusionS):
+                    cells = [] if bid in fusions else None
+                else:
+                    cells = self._needs(bot, op, nd, args, bots)
+                if cells is None or self.table.conflicts(step, cells, bid):
+                    bot.out.wait()
+                    bot.stalled += 1
+                    if op in MOVE_OPS and bot.stalled >= REROUTE_AFTER_STEPS:
+                        self._reroute(bot, bots)
+                    continue
+                self.table.reserve(step, cells, bid)
+                bot.queue.popleft()
+                bot.out.add(op, nd, args)
+                bot.stalled = 0
+                progress = True
+                self._apply(bot, op, nd, args, cells, bots.get(fusions.get(bid)), spawned, queues)
+                if op in (CmdOp.FusionS, CmdOp.Halt):
+                    finished.append(bid)
+            for bid in finished:
+                scheduled.append(bots.pop(bid).out)
+            for plan, pos, seeds in spawned:
+                bots[plan.bid] = _Bot(plan, pos, seeds, step + 1)
+            stalled_steps = 0 if progress else stalled_steps + 1
+            if stalled_steps > MAX_STALL_STEPS:
+                raise NanoException(f'StepScheduler: Deadlock at step {step}')
+            step += 1
+        scheduled.extend(b.out for b in bots.values())
+        return merge(scheduled), scheduled
@@ -1,49 +1,353 @@
+from itertools import chain
 from os.path import join
 
 
+import numpy as np
+
+
 from cmd import *
+from cmdop import CmdOp
+from columnartrace import Trace
 from config import Config
+from deltas import LLD_MOVES, ND_DELTAS, SLD_MOVES
+from groundedness import Groundedness
 from competitionphase import CompetitionPhase
+from disassemblyplanner import DisassemblyPlanner
 from harmonics import Harmonics
 from nanobot import Nanobot
+from reassemblyplanner import ReassemblyPlanner
+from slabplanner import SlabPlanner
+from tracecodec import TraceCodec
 from util import NanoException, Pos, Util
+from voxelmatrix import VoxelMatrix
+
+
+def _delta(vec):
+    return (vec.x, vec.y, vec.z)
+
+
+# The decoding tables of deltas, as arrays for the vectorized single-bot path. Invalid entries are all zero.
+ND_ARRAY = np.array([d or (0, 0, 0) for d in ND_DELTAS], dtype=np.int64)
+LLD_ARRAY = np.array([[m or (0, 0, 0, 0) for m in row] for row in [[None] * 32] + LLD_MOVES[1:]], dtype=np.int64)
+SLD_ARRAY = np.array([[m or (0, 0, 0, 0) for m in row] for row in [[None] * 16] + SLD_MOVES[1:]], dtype=np.int64)
+
+GROUP_INCREMENTAL_MAX = 1000  # Larger group fills and voids rebuild groundedness rather than update it voxel by voxel
+RUN_CHUNK_CMDS = 1 << 16
+SOLO_MIN_CMDS = 32  # Shorter runs of single-bot steps aren't worth vectorizing
+SOLO_OPS = [CmdOp.Wait, CmdOp.Flip, CmdOp.SMove, CmdOp.LMove, CmdOp.Fill, CmdOp.Void]
 
 
+# Simulates traces that turn a source model (or, without one, nothing) into a target model. A target model
+# with no Full voxels stands for the Full round's disassembly problems.
 class System:
-    def __init__(self, model):
+    def __init__(self, model, source=None):
+        if source is not None:
+            Util.nano_assert(source.resolution == model.resolution, 'The source and target resolutions differ')
         self.bots = []
         self.competition_phase = CompetitionPhase.Full
         self.energy_used = 0
+        self.error = None  # Why the last run was invalid
+        self.grounded_log = None  # If a list, changes in groundedness are logged here rather than rejected
         self.harmonics = Harmonics.Low
-        self.matrix = None
+        self.matrix = source.matrix.snapshot() if source is not None else VoxelMatrix(model.resolution)
+        self.groundedness = Groundedness(self.matrix)
         self.model = model
+        self.resolution = model.resolution
+        self.source = source
+        self.step_count = 0
         self.trace = []  # List of commands
 
+        R = model.resolution
+        self.handlers = [self.exec_halt, self.exec_wait, self.exec_flip, self.exec_smove, self.exec_lmove,
+                         self.exec_fusionp, self.exec_fusions, self.exec_fission, self.exec_fill, self.exec_void,
+                         self.exec_gfill, self.exec_gvoid]
+        self.volatile = bytearray(R**3)  # Holds the current step's tag at each volatile voxel
+        self.volatile_array = np.frombuffer(self.volatile, dtype=np.uint8).reshape(R, R, R)
+        self.volatile_tag = 0
+        self._bot = None  # The bot whose command is executing
+        self._fusions = []
+        self._groups = {}  # This step's group fills and voids, by (is_fill, region): the corners claimed
+        self._matrix_changed = False  # Since groundedness was last checked
+        self._solo = True  # Volatile voxels can't interfere while only one bot is active
+        self._spawned = []
+
         pos = Pos(0, 0, 0)
         seeds = list(range(1, 41))
         bot = Nanobot(pos, seeds)
         self.bots.append(bot)
 
+    def _begin_step(self):
+        R = self.resolution
+        cost = Config.COST_HARMONICS_HIGH if self.harmonics == Harmonics.High else Config.COST_HARMONICS_LOW
+        self.energy_used += cost * R**3 + Config.COST_BOT_PER_STEP * len(self.bots)
+        self._solo = len(self.bots) == 1
+        if not self._solo:
+            self._next_volatile_tag()
+
+    def _end_step(self):
+        if self._groups:
+            self._apply_groups()
+        if self._fusions:
+            self._fuse()
+        if self._spawned:
+            self.bots = sorted(self.bots + self._spawned, key=lambda b: b.bid)
+            self._spawned = []
+        self.step_count += 1
+        if self._matrix_changed and self.harmonics == Harmonics.Low:
+            if self.grounded_log is None:
+                Util.nano_assert(self.groundedness.is_grounded(), f'Ungrounded Full voxels in Low harmonics at step {self.step_count}')
+            else:
+                self._log_grounded()
+            self._matrix_changed = False
+
+    def _apply_groups(self):
+        for (is_fill, region), corners in self._groups.items():
+            x0, x1, y0, y1, z0, z1 = region
+            dim = (x0 != x1) + (y0 != y1) + (z0 != z1)
+            kind = 'GFill' if is_fill else 'GVoid'
+            Util.nano_assert(len(corners) == 1 << dim, f'Incomplete {kind} group at step {self.step_count}')
+            c1 = Pos(x0, y0, z0)
+            c2 = Pos(x1, y1, z1)
+            was_full = self.matrix.get_region(c1, c2)
+            changed = self.matrix.set_region(c1, c2, is_fill)
+            unchanged = was_full.size - changed
+            if is_fill:
+                self.energy_used += Config.COST_FILL_VOID * changed + Config.COST_FILL_FULL * unchanged
+                if changed <= GROUP_INCREMENTAL_MAX:
+                    for dx, dy, dz in zip(*np.nonzero(~was_full)):
+                        self.groundedness.fill(x0 + int(dx), y0 + int(dy), z0 + int(dz))
+                else:
+                    self.groundedness.invalidate()
+            else:
+                self.energy_used += Config.COST_VOID_FULL * changed + Config.COST_VOID_VOID * unchanged
+                if changed <= GROUP_INCREMENTAL_MAX:
+                    for dx, dy, dz in zip(*np.nonzero(was_full)):
+                        self.groundedness.void(x0 + int(dx), y0 + int(dy), z0 + int(dz))
+                else:
+                    self.groundedness.invalidate()
+            if changed:
+                self._matrix_changed = True
+        self._groups = {}
+
+    # Logs the step just ended, as (step, is_grounded), if the matrix's groundedness changed in it
+    def _log_grounded(self):
+        grounded = self.groundedness.is_grounded()
+        was_grounded = self.grounded_log[-1][1] if self.grounded_log else True
+        if grounded != was_grounded:
+            self.grounded_log.append((self.step_count - 1, grounded))
+
+    def _fuse(self):
+        primaries = {}
+        secondaries = {}
+        for is_primary, bot, other in self._fusions:
+            (primaries if is_primary else secondaries)[_delta(bot.pos)] = (bot, other)
+        self._fusions = []
+        Util.nano_assert(len(primaries) == len(secondaries), f'Unmatched fusion at step {self.step_count}')
+        for pos, (bot_p, other) in primaries.items():
+            bot_s, back = secondaries.get(other, (None, None))
+            Util.nano_assert(bot_s is not None and back == pos, f'Unmatched fusion at step {self.step_count}')
+            bot_p.seeds = sorted(bot_p.seeds + [bot_s.bid] + bot_s.seeds)
+            self.energy_used -= Config.COST_FUSION
+        removed = set(id(bot_s) for bot_s, _ in secondaries.values())
+        self.bots = [b for b in self.bots if id(b) not in removed]
+
+    # Checks that the voxels after (x, y, z) through (x, y, z) + (dx, dy, dz) are valid and Void, and marks
+    # them (and the start, if include_start is True) as volatile. Returns the end point.
+    def _move_leg(self, x, y, z, dx, dy, dz, n, include_start):
+        R = self.resolution
+        ex, ey, ez = x + dx, y + dy, z + dz
+        if not (0 <= ex < R and 0 <= ey < R and 0 <= ez < R):
+            raise NanoException(f'Move leaves the matrix at step {self.step_count}')
+        sx, sy, sz = dx // n, dy // n, dz // n
+        is_full = self.matrix.is_full
+        for k in range(1, n + 1):
+            if is_full(x + k * sx, y + k * sy, z + k * sz):
+                raise NanoException(f'Move through a Full voxel at step {self.step_count}')
+        if not self._solo:
+            volatile = self.volatile
+            tag = self.volatile_tag
+            idx = (x * R + y) * R + z
+            stride = (sx * R + sy) * R + sz
+            for k in range(0 if include_start else 1, n + 1):
+                if volatile[idx + k * stride] == tag:
+                    raise NanoException(f'Interference at step {self.step_count}')
+                volatile[idx + k * stride] = tag
+        return ex, ey, ez
+
+    # Adds a bot's part in a group fill or void. Its region is the box from pos + nd to pos + nd + fd, and
+    # unless the bot is alone, the whole region is marked as volatile by the first bot of the group.
+    def _group(self, bot, nd, arg, is_fill):
+        R = self.resolution
+        delta = ND_DELTAS[nd]
+        if delta is None:
+            raise NanoException(f'Invalid near coordinate difference at step {self.step_count}')
+        fx, fy, fz = arg[0] - 30, arg[1] - 30, arg[2] - 30
+        if not 0 < max(abs(fx), abs(fy), abs(fz)) <= 30:
+            raise NanoException(f'Invalid far coordinate difference at step {self.step_count}')
+        p = bot.pos
+        cx, cy, cz = p.x + delta[0], p.y + delta[1], p.z + delta[2]
+        ox, oy, oz = cx + fx, cy + fy, cz + fz
+        if not (0 <= min(cx, cy, cz, ox, oy, oz) and max(cx, cy, cz, ox, oy, oz) < R):
+            raise NanoException(f'Group region outside the matrix at step {self.step_count}')
+        region = (min(cx, ox), max(cx, ox), min(cy, oy), max(cy, oy), min(cz, oz), max(cz, oz))
+        x0, x1, y0, y1, z0, z1 = region
+        if x0 <= p.x <= x1 and y0 <= p.y <= y1 and z0 <= p.z <= z1:
+            raise NanoException(f'Bot inside its group region at step {self.step_count}')
+        self._occupy(p)
+        corners = self._groups.get((is_fill, region))
+        if corners is None:
+            corners = self._groups[(is_fill, region)] = set()
+            if not self._solo:
+                view = self.volatile_array[x0:x1 + 1, y0:y1 + 1, z0:z1 + 1]
+                if (view == self.volatile_tag).any():
+                    raise NanoException(f'Interference at step {self.step_count}')
+                view[...] = self.volatile_tag
+        if (cx, cy, cz) in corners:
+            raise NanoException(f'Two bots at the same group corner at step {self.step_count}')
+        corners.add((cx, cy, cz))
+
+    # Returns the coordinates of pos + nd, after checking that they're valid. Unless the bot is alone, marks
+    # both as volatile.
+    def _near(self, pos, nd):
+        R = self.resolution
+        delta = ND_DELTAS[nd]
+        if delta is None:
+            raise NanoException(f'Invalid near coordinate difference at step {self.step_count}')
+        x, y, z = pos.x + delta[0], pos.y + delta[1], pos.z + delta[2]
+        if not (0 <= x < R and 0 <= y < R and 0 <= z < R):
+            raise NanoException(f'Near coordinate outside the matrix at step {self.step_count}')
+        if not self._solo:
+            volatile = self.volatile
+            tag = self.volatile_tag
+            idx0 = (pos.x * R + pos.y) * R + pos.z
+            idx1 = (x * R + y) * R + z
+            if volatile[idx0] == tag or volatile[idx1] == tag:
+                raise NanoException(f'Interference at step {self.step_count}')
+            volatile[idx0] = tag
+            volatile[idx1] = tag
+        return x, y, z
+
+    def _next_volatile_tag(self):
+        self.volatile_tag += 1
+        if self.volatile_tag > 255:
+            self.volatile_array[...] = 0
+            self.volatile_tag = 1
+
+    # Unless the bot is alone, marks its position as volatile
+    def _occupy(self, pos):
+        if self._solo:
+            return
+        R = self.resolution
+        idx = (pos.x * R + pos.y) * R + pos.z
+        if self.volatile[idx] == self.volatile_tag:
+            raise NanoException(f'Interference at step {self.step_count}')
+        self.volatile[idx] = self.volatile_tag
+
+    # Returns the coordinates of a fusion partner's position
+    def _partner(self, pos, nd):
+        delta = ND_DELTAS[nd]
+        if delta is None:
+            raise NanoException(f'Invalid near coordinate difference at step {self.step_count}')
+        return (pos.x + delta[0], pos.y + delta[1], pos.z + delta[2])
+
     def assert_ready_to_halt(self):
         Util.nano_assert(self.is_ready_to_halt())
 
-    # TODO: Find actual solution trace.
-    # TODO: Break model into clusters (e.g., w/ k-means) and send distinct nanobots to them.
-    # TODO: Optimize branching into clusters
+    def current_bot(self):
+        return self._bot
+
+    def exec_fill(self, bot, nd, arg):
+        x, y, z = self._near(bot.pos, nd)
+        if self.matrix.fill(x, y, z):
+            self.groundedness.fill(x, y, z)
+            self.energy_used += Config.COST_FILL_VOID
+            self._matrix_changed = True
+        else:
+            self.energy_used += Config.COST_FILL_FULL
+
+    def exec_fission(self, bot, nd, arg):
+        x, y, z = self._near(bot.pos, nd)
+        m = arg[0]
+        Util.nano_assert(m + 1 <= len(bot.seeds), f'Fission without enough seeds at step {self.step_count}')
+        Util.nano_assert(not self.matrix.is_full(x, y, z), f'Fission into a Full voxel at step {self.step_count}')
+        self._spawned.append(Nanobot(Pos(x, y, z), bot.seeds[:m + 1]))
+        bot.seeds = bot.seeds[m + 1:]
+        self.energy_used += Config.COST_FISSION
+
+    def exec_flip(self, bot, nd, arg):
+        self._occupy(bot.pos)
+        self.harmonics = self.harmonics.flip()
+
+    def exec_fusionp(self, bot, nd, arg):
+        self._occupy(bot.pos)
+        self._fusions.append((True, bot, self._partner(bot.pos, nd)))
+
+    def exec_fusions(self, bot, nd, arg):
+        self._occupy(bot.pos)
+        self._fusions.append((False, bot, self._partner(bot.pos, nd)))
+
+    def exec_gfill(self, bot, nd, arg):
+        self._group(bot, nd, arg, True)
+
+    def exec_gvoid(self, bot, nd, arg):
+        self._group(bot, nd, arg, False)
+
+    def exec_halt(self, bot, nd, arg):
+        Util.nano_assert(self.is_ready_to_halt(), f'Halt while not ready to halt at step {self.step_count}')
+        self.bots = []
+
+    def exec_lmove(self, bot, nd, arg):
+        move1 = SLD_MOVES[arg[0]][arg[1]]
+        move2 = SLD_MOVES[arg[2]][arg[3]]
+        if move1 is None or move2 is None:
+            raise NanoException(f'Invalid short linear coordinate difference at step {self.step_count}')
+        p = bot.pos
+        x, y, z = self._move_leg(p.x, p.y, p.z, *move1, include_start=True)
+        bot.pos = Pos(*self._move_leg(x, y, z, *move2, include_start=False))
+        self.energy_used += Config.COST_MOVE * (move1[3] + move2[3] + Config.COST_LMOVE_EXTRA)
+
+    def exec_smove(self, bot, nd, arg):
+        move = LLD_MOVES[arg[0]][arg[1]]
+        if move is None:
+            raise NanoException(f'Invalid long linear coordinate difference at step {self.step_count}')
+        p = bot.pos
+        bot.pos = Pos(*self._move_leg(p.x, p.y, p.z, *move, include_start=True))
+        self.energy_used += Config.COST_MOVE * move[3]
+
+    def exec_void(self, bot, nd, arg):
+        x, y, z = self._near(bot.pos, nd)
+        if self.matrix.void(x, y, z):
+            self.groundedness.void(x, y, z)
+            self.energy_used += Config.COST_VOID_FULL
+            self._matrix_changed = True
+        else:
+            self.energy_used += Config.COST_VOID_VOID
+
+    def exec_wait(self, bot, nd, arg):
+        self._occupy(bot.pos)
+
+    # The default trace for the model
+    def default_trace(self, cache=None):
+        ifilename = join(Util.ICFP_TRACE_DIR(), f'{self.model.name}.nbt')
+        return cache.load_trace(ifilename) if cache else Trace.read(ifilename)
+
+    # TODO: Break model into clusters (e.g., w/ k-means) rather than slabs.
     # TODO: Within each cluster, optimize path.
     def find_solution(self):
-        ifilename = join(Util.ICFP_TRACE_DIR(), 'LA001.nbt')
-        trace = self.trace_read(ifilename)
-        return trace
+        if self.source is None:
+            return SlabPlanner(self.model).plan()
+        if not self.model.matrix.count_full():
+            return DisassemblyPlanner(self.source).plan()
+        return ReassemblyPlanner(self.source, self.model).plan()
 
     def is_ready_to_halt(self):
-        return self.pos.is_origin() and len(self.bots) == 1 and self.harmonics == Harmonics.Low
+        return len(self.bots) == 1 and self.bots[0].pos.is_origin() and self.harmonics == Harmonics.Low
 
     def is_solution(self):
         result = (self.harmonics == Harmonics.Low
                   and len(self.bots) == 0
                   # and self.trace
-                  and self.matrix.matches(self.model)
+                  and self.matrix == self.model.matrix
                   )
         return result
 
@@ -51,94 +355,181 @@ class System:
     def is_well_formed(self):
         return False
 
-    # TODO: Address issue: Trace (.nbt) files read & written back to disk aren't identical to the original.
-    #                      Related: Why do the default trace files all begin with 0x34?
-    def trace_read(self, ifilename):
+    # Executes a whole trace (a Trace or other columnar form, or a list of Cmds), one time step at a time. Each
+    # step, every active bot, in order of bid, executes the next command. Returns the energy used, and whether
+    # the trace was valid and produced the model. If it wasn't, the reason is in self.error.
+    def run(self, trace):
+        ops, nds, args = trace if isinstance(trace, tuple) else TraceCodec.decode_arrays(TraceCodec.encode(trace))
+        self.error = None
+        try:
+            self._run(ops, nds, args)
+            Util.nano_assert(self.matrix == self.model.matrix, 'The final matrix does not match the model')
+        except NanoException as e:
+            self.error = str(e)
+        return self.energy_used, self.error is None
+
+    def _run(self, ops, nds, args):
+        cmd_count = len(ops)
+        handlers = self.handlers
+        volume = self.resolution**3
+        cost_low = Config.COST_HARMONICS_LOW * volume
+        cost_high = Config.COST_HARMONICS_HIGH * volume
+        high = Harmonics.High
+        low = Harmonics.Low
+
+        # Runs of single-bot steps can be executed in bulk, up to the next command that isn't one of
+        # SOLO_OPS, or that ends in Low harmonics after a fill, void or flip (and so may need a groundedness check).
+        flipped = np.bitwise_xor.accumulate(ops == CmdOp.Flip)
+        ends_low = flipped if self.harmonics == high else ~flipped
+        may_unground = (ops == CmdOp.Fill) | (ops == CmdOp.Void) | (ops == CmdOp.Flip)
+        solo_breaks = np.flatnonzero(~np.isin(ops, SOLO_OPS) | (may_unground & ends_low))
+        del flipped, ends_low, may_unground
+
+        cmds = self._iter_cmds(ops, nds, args, 0)
+        cmd_index = 0
+        while self.bots:
+            bots = self.bots
+            n = len(bots)
+            if n == 1:
+                k = np.searchsorted(solo_breaks, cmd_index)
+                end = int(solo_breaks[k]) if k < len(solo_breaks) else cmd_count
+                if end - cmd_index >= SOLO_MIN_CMDS and self._run_solo(ops, nds, args, cmd_index, end):
+                    cmd_index = end
+                    cmds = self._iter_cmds(ops, nds, args, cmd_index)
+                    continue
+            if cmd_index + n > cmd_count:
+                raise NanoException(f'Trace ended before Halt, at step {self.step_count}')
+            self.energy_used += (cost_high if self.harmonics is high else cost_low) + Config.COST_BOT_PER_STEP * n
+            self._solo = n == 1
+            if n > 1:
+                self._next_volatile_tag()
+            for bot in bots:
+                op, nd, arg = next(cmds)
+                handlers[op](bot, nd, arg)
+            cmd_index += n
+            if self._fusions or self._spawned or self._groups or self._matrix_changed and self.harmonics is low:
+                self._end_step()
+            else:
+                self.step_count += 1
+        Util.nano_assert(cmd_index == cmd_count, f'Trace continues after Halt, at command {cmd_index}')
+
+    @staticmethod
+    def _iter_cmds(ops, nds, args, start):
+        chunks = (zip(ops[k:k + RUN_CHUNK_CMDS].tolist(), nds[k:k + RUN_CHUNK_CMDS].tolist(),
+                      args[k:k + RUN_CHUNK_CMDS].tolist())
+                  for k in range(start, len(ops), RUN_CHUNK_CMDS))
+        return chain.from_iterable(chunks)
+
+    # Executes commands [start, end) of a trace in bulk, as consecutive steps of a single bot. Any Fill or Void
+    # is in High harmonics, which no Flip changes back to Low. Every check is made before any state changes. If one fails,
+    # returns False, so that the commands can be re-run one by one to report the error where it happens.
+    def _run_solo(self, ops, nds, args, start, end):
+        R = self.resolution
+        bot = self.bots[0]
+        ops = ops[start:end]
+        nds = nds[start:end].astype(np.int64)
+        args = args[start:end].astype(np.int64)
+        count = end - start
+        times = np.arange(count)
+
+        # Positions before and after each command
+        is_smove = ops == CmdOp.SMove
+        is_lmove = ops == CmdOp.LMove
+        leg1 = np.zeros((count, 4), dtype=np.int64)
+        leg2 = np.zeros((count, 4), dtype=np.int64)
+        leg1[is_smove] = LLD_ARRAY[args[is_smove, 0], args[is_smove, 1]]
+        leg1[is_lmove] = SLD_ARRAY[args[is_lmove, 0], args[is_lmove, 1]]
+        leg2[is_lmove] = SLD_ARRAY[args[is_lmove, 2], args[is_lmove, 3]]
+        if np.any(leg1[is_smove | is_lmove, 3] == 0) or np.any(leg2[is_lmove, 3] == 0):
+            return False
+        after = np.cumsum(leg1[:, :3] + leg2[:, :3], axis=0) + _delta(bot.pos)
+        before = np.vstack([[_delta(bot.pos)], after[:-1]])
+        corners = before + leg1[:, :3]
+        if np.any((after < 0) | (after >= R)) or np.any((corners < 0) | (corners >= R)):
+            return False
+
+        # Voxels passed through by each move, after its start
+        leg_starts = np.concatenate([before[is_smove | is_lmove], corners[is_lmove]])
+        leg_moves = np.concatenate([leg1[is_smove | is_lmove], leg2[is_lmove]])
+        leg_times = np.concatenate([times[is_smove | is_lmove], times[is_lmove]])
+        lengths = leg_moves[:, 3]
+        leg_index = np.repeat(np.arange(len(lengths)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        steps = np.arange(int(lengths.sum())) - offsets[leg_index] + 1
+        units = leg_moves[:, :3] // lengths[:, None]
+        path = leg_starts[leg_index] + steps[:, None] * units[leg_index]
+        path_times = leg_times[leg_index]
+
+        # Voxels filled or voided
+        is_fill = ops == CmdOp.Fill
+        is_edit = is_fill | (ops == CmdOp.Void)
+        if not ND_ARRAY[nds[is_edit]].any(axis=1).all():
+            return False
+        targets = before[is_edit] + ND_ARRAY[nds[is_edit]]
+        if np.any((targets < 0) | (targets >= R)):
+            return False
+        edit_times = times[is_edit]
+        edit_fills = is_fill[is_edit]
+
+        # The state of a voxel at the start of a step is set by its last edit in an earlier step, if any
+        edit_cells = (targets[:, 0] * R + targets[:, 1]) * R + targets[:, 2]
+        order = np.lexsort((edit_times, edit_cells))
+        keys = edit_cells[order] * count + edit_times[order]
+        sorted_cells = edit_cells[order]
+        sorted_fills = edit_fills[order]
+
+        def state_before(cells, cell_times, xyz):
+            initial = self.matrix.are_full(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+            if not len(keys):
+                return initial
+            k = np.searchsorted(keys, cells * count + cell_times) - 1
+            has_edit = (k >= 0) & (sorted_cells[np.maximum(k, 0)] == cells)
+            return np.where(has_edit, sorted_fills[np.maximum(k, 0)], initial)
+
+        path_cells = (path[:, 0] * R + path[:, 1]) * R + path[:, 2]
+        if np.any(state_before(path_cells, path_times, path)):
+            return False
+        was_full = state_before(edit_cells, edit_times, targets)
+
+        # Commit
+        high_before = np.bitwise_xor.accumulate(np.concatenate([[self.harmonics == Harmonics.High],
+                                                                ops[:-1] == CmdOp.Flip]))
+        volume = R**3
+        energy = (Config.COST_HARMONICS_HIGH * volume * int(np.count_nonzero(high_before))
+                  + Config.COST_HARMONICS_LOW * volume * int(count - np.count_nonzero(high_before))
+                  + Config.COST_BOT_PER_STEP * count
+                  + Config.COST_MOVE * int(lengths.sum())
+                  + Config.COST_MOVE * Config.COST_LMOVE_EXTRA * int(np.count_nonzero(is_lmove)))
+        energy += int(np.where(edit_fills,
+                               np.where(was_full, Config.COST_FILL_FULL, Config.COST_FILL_VOID),
+                               np.where(was_full, Config.COST_VOID_FULL, Config.COST_VOID_VOID)).sum())
+        self.energy_used += energy
+
+        is_last = np.append(sorted_cells[1:] != sorted_cells[:-1], True) if len(sorted_cells) else sorted_cells
+        last_cells = sorted_cells[is_last]
+        self.matrix.set_many(last_cells // (R * R), (last_cells // R) % R, last_cells % R, sorted_fills[is_last])
+        if np.any(was_full != edit_fills):
+            self.groundedness.invalidate()
+            self._matrix_changed = True
+        if np.count_nonzero(ops == CmdOp.Flip) % 2:
+            self.harmonics = self.harmonics.flip()
+        bot.pos = Pos(*after[-1].tolist())
+        self.step_count += count
+        return True
+
+    # Executes one time step, from a list of Cmds with one per active bot, in order of bid
+    def step(self, cmds):
+        Util.nano_assert(len(cmds) == len(self.bots), f'Expected {len(self.bots)} commands, not {len(cmds)}')
+        self._begin_step()
+        for bot, cmd in zip(list(self.bots), cmds):
+            self._bot = bot
+            cmd.execute()
+        self._bot = None
+        self._end_step()
+
+    def trace_read(self, ifilename, progress=None):
         Util.nano_assert(ifilename.endswith('.nbt'), f'Unrecognized trace filename extension: {ifilename}')
-        cmds = []
-        with open(ifilename, 'rb') as ifile:
-            data = ifile.read()
-            byte_count = 0
-            cmd_count = 0
-            while byte_count < len(data):
-                print(Util.log_chars(cmd_count), end='')
-                b = data[byte_count]
-                b13 = b & 0b0000_0111
-                is_b48_full = (b & 0b1111_1000) == 0b1111_1000
-
-                bsel14 = lambda b: (b & 0b0000_1111)
-                bsel15 = lambda b: (b & 0b0001_1111)
-                bsel48 = lambda b: (b & 0b1111_1000) >> 3
-                bsel56 = lambda b: (b & 0b0011_0000) >> 4
-                bsel58 = lambda b: (b & 0b1111_0000) >> 4
-                bsel78 = lambda b: (b & 0b1100_0000) >> 6
-
-                cmd = None
-                if b13 == 0b000:  # GVOID
-                    nd = Util.decode_nd(bsel48(b))
-                    fdx = data[byte_count + 1]
-                    fdy = data[byte_count + 2]
-                    fdz = data[byte_count + 3]
-                    fd = Util.decode_fd(fdx, fdy, fdz)
-                    cmd = CmdGVoid(system=self, nd=nd, fd=fd)
-                elif b13 == 0b001:  # GFILL
-                    nd = Util.decode_nd(bsel48(b))
-                    fdx = data[byte_count + 1]
-                    fdy = data[byte_count + 2]
-                    fdz = data[byte_count + 3]
-                    fd = Util.decode_fd(fdx, fdy, fdz)
-                    cmd = CmdGFill(system=self, nd=nd, fd=fd)
-                elif b13 == 0b011:  # VOID
-                    nd = Util.decode_nd(bsel48(b))
-                    cmd = CmdVoid(system=self, nd=nd)
-                elif b13 == 0b011:  # FILL
-                    nd = Util.decode_nd(bsel48(b))
-                    return CmdFill(system=self, nd=nd)
-                elif b13 == 0b100:  # SMOVE or LMOVE
-                    if b & 0b0000_1111 == 0b0000_0100:
-                        lld_a = bsel56(b)
-                        lld_i = bsel15(b)
-                        lld = Util.decode_lld(lld_a, lld_i)
-                        cmd = CmdSMove(system=self, lld=lld)
-                    elif b & 0b0000_1111 == 0b0000_1100:
-                        sld1_a = bsel56(b)
-                        sld2_a = bsel78(b)
-
-                        bnext = data[byte_count + 1]
-                        sld1_i = bsel14(bnext)
-                        sld2_i = bsel58(bnext)
-
-                        sld1 = Util.decode_sld(sld1_a, sld1_i)
-                        sld2 = Util.decode_sld(sld2_a, sld2_i)
-                        cmd = CmdLMove(system=self, sld1=sld1, sdl2=sld2)
-                    else:
-                        raise NanoException(f'Unregonized trace bit sequence staring with "100": {bin(b)}')
-                elif b13 == 0b101:  # FLIP or FISSION
-                    if is_b48_full:
-                        cmd = CmdFlip(system=self)
-                    else:
-                        nd = Util.decode_nd(bsel48(b))
-                        m = data[byte_count + 1]
-                        cmd = CmdFission(system=self, nd=nd, m=m)
-                elif b13 == 0b110:  # WAIT or FUSIONS
-                    if is_b48_full:
-                        cmd = CmdWait(system=self)
-                    else:
-                        nd = Util.decode_nd(bsel48(b))
-                        cmd = CmdFusionS(system=self, nd=nd)
-                elif b13 == 0b111:  # HALT or FUSIONP
-                    if is_b48_full:
-                        cmd = CmdHalt(system=self)
-                    else:
-                        nd = Util.decode(bsel48(b))
-                        cmd = CmdFusionP(system=self, nd=nd)
-                else:
-                    raise NanoException(f'Unregonized trace bit sequence: {bin(b)}')
-                cmds.append(cmd)
-                byte_count += Util.byte_count(type(cmd).__name__)
-                cmd_count += 1
-            print()
-        return cmds
+        return list(TraceCodec.iter_trace(ifilename, system=self, progress=progress))
 
     def trace_repr(self, cmds):
         cmd_strs = list(map(lambda c: f'{str(c):20s}', cmds))
@@ -146,9 +537,4 @@ class System:
         return '\n'.join(chunk_strs)
 
     def trace_write(self, ofilename, cmds):
-        if Config.VERBOSE:
-            print(self.trace_repr(cmds))
-        data = bytes([b for cmd in self.trace for b in cmd.bytes_repr()])
-        with open(ofilename, 'wb') as ofile:
-            ofile.write(data)
-
+        TraceCodec.write_trace(ofilename, cmds)
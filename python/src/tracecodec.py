@@ -0,0 +1,306 @@
+import mmap
+import os
+
+
+import numpy as np
+
+
+from cmd import *
+from cmdop import CmdOp
+from util import NanoException, Util
+
+
+INVALID = 0xFF  # Opcode table entry for bytes that can't start a command
+
+WRITE_CHUNK_BYTES = 1 << 20
+WRITE_CHUNK_CMDS = 1 << 20
+
+BYTE_COUNTS = {CmdOp.Halt: 1, CmdOp.Wait: 1, CmdOp.Flip: 1,
+               CmdOp.SMove: 2, CmdOp.LMove: 2,
+               CmdOp.FusionP: 1, CmdOp.FusionS: 1, CmdOp.Fission: 2,
+               CmdOp.Fill: 1, CmdOp.Void: 1,
+               CmdOp.GFill: 4, CmdOp.GVoid: 4}
+
+
+# Tables indexed by the first byte of a command: its opcode, its nd field (if any), its length in bytes,
+# and the axis fields of SMove (a) and LMove (sld1.a, sld2.a).
+def _build_tables():
+    ops = np.full(256, INVALID, dtype=np.uint8)
+    nds = np.zeros(256, dtype=np.uint8)
+    axes1 = np.zeros(256, dtype=np.uint8)
+    axes2 = np.zeros(256, dtype=np.uint8)
+    nd_ops = {0b111: CmdOp.FusionP, 0b110: CmdOp.FusionS, 0b101: CmdOp.Fission,
+              0b011: CmdOp.Fill, 0b010: CmdOp.Void, 0b001: CmdOp.GFill, 0b000: CmdOp.GVoid}
+    for b in range(256):
+        nd = b >> 3
+        if b == 0b1111_1111:
+            ops[b] = CmdOp.Halt
+        elif b == 0b1111_1110:
+            ops[b] = CmdOp.Wait
+        elif b == 0b1111_1101:
+            ops[b] = CmdOp.Flip
+        elif b & 0b1100_1111 == 0b0000_0100 and (b >> 4) & 0b11:
+            ops[b] = CmdOp.SMove
+            axes1[b] = (b >> 4) & 0b11
+        elif b & 0b0000_1111 == 0b0000_1100 and (b >> 4) & 0b11 and b >> 6:
+            ops[b] = CmdOp.LMove
+            axes1[b] = (b >> 4) & 0b11
+            axes2[b] = b >> 6
+        elif b & 0b111 in nd_ops and nd < 27:
+            ops[b] = nd_ops[b & 0b111]
+            nds[b] = nd
+    lengths = np.array([BYTE_COUNTS[CmdOp(op)] if op != INVALID else 0 for op in ops], dtype=np.uint8)
+    return ops, nds, lengths, axes1, axes2
+
+
+OPCODE_TABLE, ND_TABLE, LENGTH_TABLE, AXIS1_TABLE, AXIS2_TABLE = _build_tables()
+
+# Tables indexed by CmdOp: the fixed bits of the first byte, whether the nd field is present, and the length.
+OP_BASE_TABLE = np.array([0b1111_1111, 0b1111_1110, 0b1111_1101, 0b0100, 0b1100,
+                          0b111, 0b110, 0b101, 0b011, 0b010, 0b001, 0b000], dtype=np.uint8)
+OP_HAS_ND_TABLE = np.array([op in (CmdOp.FusionP, CmdOp.FusionS, CmdOp.Fission, CmdOp.Fill, CmdOp.Void,
+                                   CmdOp.GFill, CmdOp.GVoid) for op in CmdOp], dtype=np.bool_)
+OP_LENGTH_TABLE = np.array([BYTE_COUNTS[op] for op in CmdOp], dtype=np.uint8)
+
+_OPS = OPCODE_TABLE.tolist()
+_NDS = ND_TABLE.tolist()
+_LENGTHS = LENGTH_TABLE.tolist()
+_AXES1 = AXIS1_TABLE.tolist()
+_AXES2 = AXIS2_TABLE.tolist()
+_ND_VECS = [Util.decode_nd(nd) for nd in range(27)]
+
+
+# Decodes and encodes .nbt trace files.
+#
+# The columnar form of a trace is three parallel arrays with one entry per command:
+#   ops:  CmdOp values (uint8)
+#   nds:  the encoded near coordinate difference, for commands that have one (uint8)
+#   args: up to four operand fields per command, as they appear in the encoding (uint8, shape (N, 4)):
+#           SMove: (lld.a, lld.i)          LMove: (sld1.a, sld1.i, sld2.a, sld2.i)
+#           Fission: (m,)                  GFill, GVoid: (fd.x + 30, fd.y + 30, fd.z + 30)
+class TraceCodec:
+    @staticmethod
+    def decode_arrays(data):
+        buf = np.frombuffer(data, dtype=np.uint8)
+        starts = TraceCodec.command_starts(buf)
+
+        padded = np.concatenate([buf, np.zeros(3, dtype=np.uint8)])
+        del buf  # Release the view, so that a memory-mapped source can be closed
+        first = padded[starts]
+        ops = OPCODE_TABLE[first]
+        nds = ND_TABLE[first]
+        args = np.zeros((len(starts), 4), dtype=np.uint8)
+
+        second = padded[starts + 1]
+        is_smove = ops == CmdOp.SMove
+        args[is_smove, 0] = AXIS1_TABLE[first[is_smove]]
+        args[is_smove, 1] = second[is_smove] & 0b1_1111
+        is_lmove = ops == CmdOp.LMove
+        args[is_lmove, 0] = AXIS1_TABLE[first[is_lmove]]
+        args[is_lmove, 1] = second[is_lmove] & 0b1111
+        args[is_lmove, 2] = AXIS2_TABLE[first[is_lmove]]
+        args[is_lmove, 3] = second[is_lmove] >> 4
+        is_fission = ops == CmdOp.Fission
+        args[is_fission, 0] = second[is_fission]
+        is_group = (ops == CmdOp.GFill) | (ops == CmdOp.GVoid)
+        for k in range(3):
+            args[is_group, k] = padded[starts[is_group] + 1 + k]
+        return ops, nds, args
+
+    # Accepts either a sequence of Cmds or the columnar form of a trace
+    @staticmethod
+    def encode(trace):
+        if isinstance(trace, tuple):
+            return bytes(TraceCodec.encode_arrays(*trace))
+        buf = bytearray()
+        for cmd in trace:
+            cmd.encode_into(buf)
+        return bytes(buf)
+
+    # Encodes the columnar form of a trace into a bytearray allocated once at its final size
+    @staticmethod
+    def encode_arrays(ops, nds, args):
+        ops = np.asarray(ops, dtype=np.uint8)
+        nds = np.asarray(nds, dtype=np.uint8)
+        args = np.asarray(args, dtype=np.uint8)
+        if len(ops) == 0:
+            return bytearray()
+        lengths = OP_LENGTH_TABLE[ops]
+        offsets = np.zeros(len(ops), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        result = bytearray(int(offsets[-1]) + int(lengths[-1]))
+        out = np.frombuffer(result, dtype=np.uint8)
+
+        first = OP_BASE_TABLE[ops]
+        has_nd = OP_HAS_ND_TABLE[ops]
+        first[has_nd] |= nds[has_nd] << 3
+
+        is_smove = ops == CmdOp.SMove
+        first[is_smove] |= args[is_smove, 0] << 4
+        out[offsets[is_smove] + 1] = args[is_smove, 1]
+        is_lmove = ops == CmdOp.LMove
+        first[is_lmove] |= (args[is_lmove, 2] << 6) | (args[is_lmove, 0] << 4)
+        out[offsets[is_lmove] + 1] = (args[is_lmove, 3] << 4) | args[is_lmove, 1]
+        is_fission = ops == CmdOp.Fission
+        out[offsets[is_fission] + 1] = args[is_fission, 0]
+        is_group = (ops == CmdOp.GFill) | (ops == CmdOp.GVoid)
+        for k in range(3):
+            out[offsets[is_group] + 1 + k] = args[is_group, k]
+        out[offsets] = first
+        del out
+        return result
+
+    @staticmethod
+    def iter_decode(data, system=None, progress=None):
+        ops = _OPS
+        nds = _NDS
+        lengths = _LENGTHS
+        nd_vecs = _ND_VECS
+        FILL, SMOVE, LMOVE, WAIT, FLIP, HALT, VOID, FISSION, FUSIONP, FUSIONS, GFILL = (
+            CmdOp.Fill, CmdOp.SMove, CmdOp.LMove, CmdOp.Wait, CmdOp.Flip, CmdOp.Halt, CmdOp.Void,
+            CmdOp.Fission, CmdOp.FusionP, CmdOp.FusionS, CmdOp.GFill)
+        pos = 0
+        cmd_count = 0
+        while pos < len(data):
+            b = data[pos]
+            op = ops[b]
+            size = lengths[b]
+            if not size:
+                raise NanoException(f'Unrecognized trace byte at offset {pos}: {bin(b)}')
+            if pos + size > len(data):
+                raise NanoException(f'Truncated trace command at offset {pos}')
+
+            if op == FILL:
+                cmd = CmdFill(system=system, nd=nd_vecs[nds[b]])
+            elif op == SMOVE:
+                cmd = CmdSMove(system=system, lld=Util.decode_lld(_AXES1[b], data[pos + 1] & 0b1_1111))
+            elif op == LMOVE:
+                bnext = data[pos + 1]
+                sld1 = Util.decode_sld(_AXES1[b], bnext & 0b1111)
+                sld2 = Util.decode_sld(_AXES2[b], bnext >> 4)
+                cmd = CmdLMove(system=system, sld1=sld1, sld2=sld2)
+            elif op == WAIT:
+                cmd = CmdWait(system=system)
+            elif op == FLIP:
+                cmd = CmdFlip(system=system)
+            elif op == HALT:
+                cmd = CmdHalt(system=system)
+            elif op == VOID:
+                cmd = CmdVoid(system=system, nd=nd_vecs[nds[b]])
+            elif op == FISSION:
+                cmd = CmdFission(system=system, nd=nd_vecs[nds[b]], m=data[pos + 1])
+            elif op == FUSIONP:
+                cmd = CmdFusionP(system=system, nd=nd_vecs[nds[b]])
+            elif op == FUSIONS:
+                cmd = CmdFusionS(system=system, nd=nd_vecs[nds[b]])
+            else:  # GFill or GVoid
+                fd = Util.decode_fd(data[pos + 1], data[pos + 2], data[pos + 3])
+                cls = CmdGFill if op == GFILL else CmdGVoid
+                cmd = cls(system=system, nd=nd_vecs[nds[b]], fd=fd)
+
+            yield cmd
+            pos += size
+            cmd_count += 1
+            if progress:
+                progress(cmd_count)
+
+    # Lazily yields the commands of a trace file, without reading the whole file into memory.
+    @staticmethod
+    def iter_trace(ifilename, system=None, progress=None):
+        if os.path.getsize(ifilename) == 0:
+            return
+        with open(ifilename, 'rb') as ifile:
+            with mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from TraceCodec.iter_decode(data, system=system, progress=progress)
+
+    @staticmethod
+    def read_arrays(ifilename):
+        if os.path.getsize(ifilename) == 0:
+            return TraceCodec.decode_arrays(b'')
+        with open(ifilename, 'rb') as ifile:
+            with mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                try:
+                    return TraceCodec.decode_arrays(data)
+                except NanoException as e:
+                    # The traceback holds views of the map, which would keep it from closing
+                    error = str(e)
+        raise NanoException(error)
+
+    # Returns the byte offset of each command. A command's length depends only on its first byte, so the
+    # offsets are the orbit of 0 under the map i -> i + length(data[i]).
+    @staticmethod
+    def command_starts(buf):
+        n = len(buf)
+        starts = TraceCodec._orbit(buf)
+        if len(starts):
+            lengths = LENGTH_TABLE[buf[starts]]
+            invalid = np.flatnonzero(lengths == 0)
+            if len(invalid):
+                pos = int(starts[invalid[0]])
+                raise NanoException(f'Unrecognized trace byte at offset {pos}: {bin(buf[pos])}')
+            last = int(starts[-1])
+            Util.nano_assert(last + int(lengths[-1]) == n, f'Truncated trace command at offset {last}')
+        return starts
+
+    # Returns the orbit of 0 under i -> i + length(buf[i]), up to the first invalid byte. It's found by pointer
+    # doubling: each round marks the successors of everything marked so far, then squares the map.
+    @staticmethod
+    def _orbit(buf):
+        n = len(buf)
+        lengths = LENGTH_TABLE[buf]
+        jump = np.arange(n + 1, dtype=np.int64)
+        jump[:n] += lengths
+        jump[:n][lengths == 0] = n  # Invalid bytes end the orbit. They're reported by the caller.
+        np.minimum(jump, n, out=jump)
+
+        marked = np.zeros(n + 1, dtype=np.bool_)
+        marked[0] = True
+        while True:
+            marked[jump[np.flatnonzero(marked)]] = True
+            if jump[0] >= n:
+                break
+            jump = jump[jump]
+        return np.flatnonzero(marked[:n])
+
+    # Yields the columnar form of a trace file a chunk of about chunk_bytes at a time, in constant memory
+    @staticmethod
+    def iter_arrays(ifilename, chunk_bytes=WRITE_CHUNK_BYTES):
+        if os.path.getsize(ifilename) == 0:
+            return
+        with open(ifilename, 'rb') as ifile:
+            with mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                n = len(data)
+                pos = 0
+                while pos < n:
+                    # The window extends past the chunk by the longest command's length less one, so that the
+                    # last command starting in the chunk ends in the window.
+                    window = np.frombuffer(data, dtype=np.uint8, count=min(n - pos, chunk_bytes + 3), offset=pos)
+                    starts = TraceCodec._orbit(window)
+                    starts = starts[starts < chunk_bytes]
+                    last = int(starts[-1])
+                    end = last + max(1, int(LENGTH_TABLE[window[last]]))
+                    chunk = bytes(window[:min(end, len(window))])
+                    del window
+                    try:
+                        yield TraceCodec.decode_arrays(chunk)
+                    except NanoException as e:
+                        raise NanoException(f'{e} (in the chunk at offset {pos})') from None
+                    pos += end
+
+    # Writes either a sequence of Cmds or the columnar form of a trace, a chunk at a time
+    @staticmethod
+    def write_trace(ofilename, trace):
+        with open(ofilename, 'wb') as ofile:
+            if isinstance(trace, tuple):
+                ops, nds, args = trace
+                for k in range(0, len(ops), WRITE_CHUNK_CMDS):
+                    chunk = slice(k, k + WRITE_CHUNK_CMDS)
+                    ofile.write(TraceCodec.encode_arrays(ops[chunk], nds[chunk], args[chunk]))
+            else:
+                buf = bytearray()
+                for cmd in trace:
+                    cmd.encode_into(buf)
+                    if len(buf) >= WRITE_CHUNK_BYTES:
+                        ofile.write(buf)
+                        buf.clear()
+                ofile.write(buf)
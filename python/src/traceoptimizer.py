@@ -0,0 +1,191 @@
+import numpy as np
+
+
+from botplan import MAX_LLD, MAX_SLD
+from cmdop import CmdOp
+from columnartrace import step_starts, Trace
+from stepscheduler import group_region, move_cells, near
+from system import System
+
+
+# Returns the cells a command makes volatile, besides its bot's position
+def volatile_cells(pos, op, nd, args):
+    if op in (CmdOp.SMove, CmdOp.LMove):
+        return move_cells(pos, op, args) or []
+    if op in (CmdOp.Fill, CmdOp.Void, CmdOp.Fission):
+        return [near(pos, nd)]
+    if op in (CmdOp.GFill, CmdOp.GVoid):
+        x0, x1, y0, y1, z0, z1 = group_region(pos, nd, args)
+        return [(x, y, z) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for z in range(z0, z1 + 1)]
+    return []
+
+
+# Returns the region, as (x0, x1, y0, y1, z0, z1), whose voxels a command fills or voids, or None
+def edited_region(pos, op, nd, args):
+    if op in (CmdOp.Fill, CmdOp.Void):
+        x, y, z = near(pos, nd)
+        return x, x, y, y, z, z
+    if op in (CmdOp.GFill, CmdOp.GVoid):
+        return group_region(pos, nd, args)
+    return None
+
+
+def in_region(cell, region):
+    x0, x1, y0, y1, z0, z1 = region
+    return x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1 and z0 <= cell[2] <= z1
+
+
+# Shortens traces with peephole rewrites, each of which keeps the trace valid:
+#
+# - A bot's consecutive SMoves along one axis are merged into one SMove, as long as the total is up to 15
+#   (or dropped, if they cancel out). When the bot is alone, two short SMoves along different axes are
+#   merged into an LMove.
+# - The commands merged away become Waits, so that the other bots' commands stay in their steps.
+# - Steps in which every bot waits, as left by merges or by padding, are dropped.
+#
+# A merge makes the later moves' voxels volatile in the step of the first move, and the bot waits at the
+# end point in the steps after it. Where other bots are active, it's only made if none of those voxels are
+# volatile for another bot in those steps, from either the original trace or earlier merges, and if no other
+# bot fills or voids the voxels it crosses in those steps: the merged move crosses them before the original
+# moves did, so they must hold the same state over the whole window. The result is simulated; a merge in
+# whose steps it fails is undone, and the result is kept only if it's valid and cheaper.
+class TraceOptimizer:
+    def __init__(self, model, source=None):
+        self.model = model
+        self.source = source
+        self.merges = []  # The last merge_moves' merges, as (first step, last step, indices of merged commands)
+
+    # Returns the trace with moves merged, and the number of commands merged away
+    def merge_moves(self, trace):
+        trace = Trace(*trace)
+        ops, nds, args = trace
+        bids, steps, positions = trace.bots()
+        ops = ops[:len(bids)].copy()
+        nds = nds[:len(bids)].copy()
+        args = args[:len(bids)].copy()
+        starts = step_starts(ops)
+        counts = np.diff(starts)
+        owners = {}  # Volatile cells of multi-bot steps, with the bids of the bots they belong to
+        edits = {}  # Regions filled or voided in multi-bot steps, with the bids of the bots that edit them
+        self.merges = []
+
+        def step_owners(step):
+            if step not in owners:
+                cells = {}
+                for k in range(starts[step], starts[step + 1]):
+                    pos = tuple(positions[k].tolist())
+                    cells[pos] = int(bids[k])
+                    for cell in volatile_cells(pos, ops[k], nds[k], args[k].tolist()):
+                        cells[cell] = int(bids[k])
+                owners[step] = cells
+            return owners[step]
+
+        def step_edits(step):
+            if step not in edits:
+                edits[step] = []
+                for k in range(starts[step], starts[step + 1]):
+                    region = edited_region(tuple(positions[k].tolist()), ops[k], nds[k], args[k].tolist())
+                    if region is not None:
+                        edits[step].append((int(bids[k]), region))
+            return edits[step]
+
+        def claim(bid, first_step, cells, end, last_step):
+            claims = [(first_step, cells)] + [(s, [end]) for s in range(first_step + 1, last_step + 1)]
+            for s, claimed in claims:
+                if counts[s] > 1 and any(step_owners(s).get(c, bid) != bid for c in claimed):
+                    return False
+                if counts[s] > 1 and any(b != bid and in_region(c, region) for b, region in step_edits(s)
+                                         for c in cells):
+                    return False
+            for s, claimed in claims:
+                if counts[s] > 1:
+                    step_owners(s).update((c, bid) for c in claimed)
+            return True
+
+        merged = 0
+        present, first = np.unique(bids, return_index=True)
+        for bid in present[np.argsort(first)].tolist():  # In order of their first commands
+            cmds = np.flatnonzero(bids == bid).tolist()
+            i = 0
+            while i < len(cmds):
+                head = cmds[i]
+                i += 1
+                if ops[head] != CmdOp.SMove:
+                    continue
+                axis, d = int(args[head][0]), int(args[head][1]) - MAX_LLD
+                pos = tuple(positions[head].tolist())
+                absorbed = []
+                lmove = None
+                while i < len(cmds) and ops[cmds[i]] == CmdOp.SMove and lmove is None:
+                    k = cmds[i]
+                    axis2, d2 = int(args[k][0]), int(args[k][1]) - MAX_LLD
+                    if axis2 == axis and abs(d + d2) <= MAX_LLD:
+                        candidate = (CmdOp.SMove, (axis, d + d2 + MAX_LLD, 0, 0))
+                    elif axis2 != axis and d and abs(d) <= MAX_SLD and abs(d2) <= MAX_SLD \
+                            and counts[steps[head]:steps[k] + 1].max() == 1:
+                        candidate = (CmdOp.LMove, (axis, d + MAX_SLD, axis2, d2 + MAX_SLD))
+                    else:
+                        break
+                    cells = move_cells(pos, *candidate) if candidate[1][:2] != (axis, MAX_LLD) else []
+                    end = cells[-1] if cells else pos
+                    if not claim(bid, steps[head], cells, end, steps[k]):
+                        break
+                    absorbed.append(k)
+                    if candidate[0] == CmdOp.LMove:
+                        lmove = candidate
+                    else:
+                        d += d2
+                    i += 1
+                if not absorbed:
+                    continue
+                if lmove is not None:
+                    ops[head], args[head] = lmove[0], lmove[1]
+                elif d:
+                    args[head] = (axis, d + MAX_LLD, 0, 0)
+                else:
+                    ops[head] = CmdOp.Wait
+                    args[head] = 0
+                ops[absorbed] = CmdOp.Wait
+                args[absorbed] = 0
+                merged += len(absorbed)
+                self.merges.append((int(steps[head]), int(steps[absorbed[-1]]), [head] + absorbed))
+        return Trace(ops, nds, args), merged
+
+    # Returns the trace without the steps in which every bot waits
+    @staticmethod
+    def drop_padding(trace):
+        ops, nds, args = trace
+        starts = step_starts(ops)
+        if len(starts) < 2:
+            return trace
+        counts = np.diff(starts)
+        waits = np.add.reduceat((ops[:starts[-1]] == CmdOp.Wait).astype(np.int64), starts[:-1])
+        keep = np.repeat(waits < counts, counts)
+        keep = np.concatenate([keep, np.ones(len(ops) - starts[-1], dtype=np.bool_)])
+        return Trace(ops[keep], nds[keep], args[keep])
+
+    # Returns the optimized trace and its energy, or the original trace and its energy, if the optimized one
+    # isn't valid or cheaper
+    def optimize(self, trace):
+        original_energy, original_valid = System(self.model, self.source).run(trace)
+        if not len(trace[0]):
+            return trace, original_energy
+        original = Trace(*trace)
+        result, _ = self.merge_moves(original)
+        while self.merges:
+            system = System(self.model, self.source)
+            if system.run(result)[1]:
+                break
+            # Merges keep the steps of the original trace, so the failure is in the steps of one of them
+            failed = [m for m in self.merges if m[0] <= system.step_count <= m[1]]
+            if not failed:
+                return trace, original_energy
+            self.merges = [m for m in self.merges if m not in failed]
+            for _, _, cmds in failed:
+                result[0][cmds] = original[0][cmds]
+                result[2][cmds] = original[2][cmds]
+        result = TraceOptimizer.drop_padding(result)
+        energy, valid = System(self.model, self.source).run(result)
+        if not valid or (original_valid and energy >= original_energy):
+            return trace, original_energy
+        return result, energy
@@ -1,39 +1,85 @@
 import os
-from os.path import join
+from os.path import basename, join, splitext
+
+
+from config import Config
 
 
 class NanoException(Exception):
     pass
 
 
+# Makes a Pos or Vec from coordinates that are already ints, skipping __init__'s conversions
+def _make(cls, x, y, z):
+    result = object.__new__(cls)
+    result.x = x
+    result.y = y
+    result.z = z
+    return result
+
+
+# Positions and coordinate differences are immutable, hashable value types. Hot loops can also use packed
+# positions (ints x·R² + y·R + z, or NumPy arrays of them), converting with packed() and from_packed().
+# Operand type checks are made only if Config.DEBUG_CHECKS is set.
 class Pos:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x, y, z):
         self.x = int(x)
         self.y = int(y)
         self.z = int(z)
 
     def __add__(self, vec):
-        vec_type = type(vec).__name__
-        Util.nano_assert(vec_type == 'Vec', 'Type mismatch in Pos addition')
-        return Pos(self.x + vec.x, self.y + vec.y, self.z + vec.z)
+        if Config.DEBUG_CHECKS:
+            Util.nano_assert(isinstance(vec, Vec), 'Type mismatch in Pos addition')
+        return _make(Pos, self.x + vec.x, self.y + vec.y, self.z + vec.z)
+
+    def __eq__(self, other):
+        if not isinstance(other, Pos):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __hash__(self):
+        return hash((self.x, self.y, self.z))
 
-    def __iadd__(self, vec):
-        vec_type = type(vec).__name__
-        Util.nano_assert(vec_type == 'Vec', 'Type mismatch in Pos incremental addition')
-        self.x += vec.x
-        self.y += vec.y
-        self.z += vec.z
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.z
+
+    def __repr__(self):
+        return f'Pos({self.x}, {self.y}, {self.z})'
+
+    def __str__(self):
+        return f'({self.x}, {self.y}, {self.z})'
 
     def __sub__(self, pos):
-        pos_type = type(pos).__name__
-        Util.nano_assert(pos_type == 'Pos', 'Type mismatch in Pos subtraction')
-        return Vec(self.x - pos.x, self.y - pos.y, self.z - pos.z)
+        if Config.DEBUG_CHECKS:
+            Util.nano_assert(isinstance(pos, Pos), 'Type mismatch in Pos subtraction')
+        return _make(Vec, self.x - pos.x, self.y - pos.y, self.z - pos.z)
+
+    @staticmethod
+    def from_packed(n, resolution):
+        R = resolution
+        xy, z = divmod(n, R)
+        x, y = divmod(xy, R)
+        return Pos(x, y, z)
 
     def is_origin(self):
         return self.x == 0 and self.y == 0 and self.z == 0
 
+    def packed(self, resolution):
+        R = resolution
+        return (self.x * R + self.y) * R + self.z
+
 
 class Util:
+    @staticmethod
+    def CACHE_DIR():
+        if '_CACHE_DIR' not in dir(Util):
+            Util._CACHE_DIR = join(os.environ['PROJECT_DIR'], '../cache')
+        return Util._CACHE_DIR
+
     @staticmethod
     def ICFP_TRACE_DIR():
         if '_ICFP_TRACE_DIR' not in dir(Util):
@@ -52,37 +98,6 @@ class Util:
             Util._MY_TRACE_DIR = join(os.environ['PROJECT_DIR'], '../my_solutions')
         return Util._MY_TRACE_DIR
 
-    @staticmethod
-    def byte_count(clsname):
-        count = None
-        if clsname == 'CmdHalt':
-            count = 1
-        elif clsname == 'CmdFill':
-            count = 1
-        elif clsname == 'CmdFission':
-            count = 2
-        elif clsname == 'CmdFlip':
-            count = 1
-        elif clsname == 'CmdFusionP':
-            count = 1
-        elif clsname == 'CmdFusionS':
-            count = 1
-        elif clsname == 'CmdGFill':
-            count = 4
-        elif clsname == 'CmdGVoid':
-            count = 1
-        elif clsname == 'CmdLMove':
-            count = 2
-        elif clsname == 'CmdSMove':
-            count = 2
-        elif clsname == 'CmdVoid':
-            count = 1
-        elif clsname == 'CmdWait':
-            count = 1
-        else:
-            raise Util.NanoException('Unrecognized command type')
-        return count
-
     @staticmethod
     def chunks(size, items):
         for k in range(0, len(items), size):
@@ -90,7 +105,7 @@ class Util:
 
     @staticmethod
     def decode_fd(x, y, z):
-        return (x - 30, y - 30, z - 30)
+        return Vec(x - 30, y - 30, z - 30)
 
     @staticmethod
     def decode_lld(a, i):
@@ -104,16 +119,13 @@ class Util:
         elif a == 3:  # dz != 0
             dz = i - 15
         else:
-            raise Util.NanoException('decode_sld: Invalid value of a')
+            raise NanoException('decode_lld: Invalid value of a')
         return Vec(dx, dy, dz)
 
     @staticmethod
     def decode_nd(b5):
-        z_enc = b5 % 3
-        b5 = (b5 - z_enc) / 3
-        y_enc = b5 % 3
-        b5 = (b5 - y_enc) / 3
-        x_enc = b5 % 3
+        b5, z_enc = divmod(b5, 3)
+        x_enc, y_enc = divmod(b5, 3)
 
         dz = z_enc - 1
         dy = y_enc - 1
@@ -132,7 +144,7 @@ class Util:
         elif a == 3:  # dz != 0
             dz = i - 5
         else:
-            raise Util.NanoException('decode_sld: Invalid value of a')
+            raise NanoException('decode_sld: Invalid value of a')
         return Vec(dx, dy, dz)
 
     @staticmethod
@@ -152,7 +164,7 @@ class Util:
             a = 3
             i = delta.z + 15
         else:
-            raise Util.NanoException('Long linear coordinate difference violation')
+            raise NanoException('Long linear coordinate difference violation')
         return a, i
 
     # Near coordinate difference
@@ -174,7 +186,7 @@ class Util:
             a = 3
             i = delta.z + 5
         else:
-            raise Util.NanoException('Short linear coordinate difference violation')
+            raise NanoException('Short linear coordinate difference violation')
         return a, i
 
     @staticmethod
@@ -223,6 +235,11 @@ class Util:
         for coord in region(c1, c2):
             Util.nano_assert(coord, pred, msg)
 
+    # The problem name in a model or trace filename, e.g., 'LA001' for '.../LA001_tgt.mdl'
+    @staticmethod
+    def problem_name(filename):
+        return splitext(basename(filename))[0].split('_')[0]
+
     @staticmethod
     def region(c1, c2):
         xmin = min(c1.x, c2.x)
@@ -241,29 +258,45 @@ class Util:
 
 
 class Vec:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x, y, z):
         self.x = int(x)
         self.y = int(y)
         self.z = int(z)
 
     def __add__(self, vec):
-        vec_type = type(vec).__name__
-        Util.nano_assert(vec_type == 'Vec', 'Type mismatch in Vec addition')
-        return Vec(self.x + vec.x, self.y + vec.y, self.z + vec.z)
+        if Config.DEBUG_CHECKS:
+            Util.nano_assert(isinstance(vec, Vec), 'Type mismatch in Vec addition')
+        return _make(Vec, self.x + vec.x, self.y + vec.y, self.z + vec.z)
+
+    def __eq__(self, other):
+        if not isinstance(other, Vec):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __hash__(self):
+        return hash((self.x, self.y, self.z))
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.z
+
+    def __neg__(self):
+        return _make(Vec, -self.x, -self.y, -self.z)
 
-    def __iadd__(self, vec):
-        self.x += vec.x
-        self.y += vec.y
-        self.z += vec.z
+    def __repr__(self):
+        return f'Vec({self.x}, {self.y}, {self.z})'
 
     def __str__(self):
         result = f'<{self.x}, {self.y}, {self.z}>'
         return result
 
     def __sub__(self, vec):
-        vec_type = type(vec).__name__
-        Util.nano_assert(vec_type == 'Vec', 'Type mismatch in Vec subtraction')
-        return Vec(self.x - vec.x, self.y - vec.y, self.z - vec.z)
+        if Config.DEBUG_CHECKS:
+            Util.nano_assert(isinstance(vec, Vec), 'Type mismatch in Vec subtraction')
+        return _make(Vec, self.x - vec.x, self.y - vec.y, self.z - vec.z)
 
     def clen(self):
         return max(abs(self.x), abs(self.y), abs(self.z))
@@ -274,3 +307,7 @@ class Vec:
     def mlen(self):
         return abs(self.x) + abs(self.y) + abs(self.z)
 
+    # The difference between the packed positions that this separates
+    def packed(self, resolution):
+        R = resolution
+        return (self.x * R + self.y) * R + self.z
@@ -0,0 +1,193 @@
+import numpy as np
+
+
+from fillstate import FillState
+from util import Util
+
+
+# Number of set bits in each possible byte value
+POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+
+# Voxels are stored one bit each, packed eight to a byte along the z axis (least-significant bit first),
+# so that each (x, y) column is a row of ceil(R / 8) bytes. An R=250 matrix takes 2,000,000 bytes.
+#
+# Snapshots share their buffer with the matrix they were taken from. Whichever of them is written to
+# first makes a private copy (copy-on-write), so taking a snapshot costs nothing until it's needed.
+class VoxelMatrix:
+    def __init__(self, resolution, data=None):
+        R = resolution
+        self.resolution = R
+        self.row_bytes = (R + 7) // 8
+        size = R * R * self.row_bytes
+        if data is None:
+            data = bytearray(size)
+            self._shares = [1]
+        else:
+            Util.nano_assert(len(data) == size, f'VoxelMatrix: Expected {size} bytes of data, not {len(data)}')
+            self._shares = [2]  # Data we don't own is treated as shared with its owner
+        self._set_buffer(data)
+
+    def __eq__(self, other):
+        if not isinstance(other, VoxelMatrix):
+            return NotImplemented
+        return self.resolution == other.resolution and np.array_equal(self._bits, other._bits)
+
+    __hash__ = None
+
+    def __getitem__(self, pos):
+        x, y, z = pos if isinstance(pos, tuple) else (pos.x, pos.y, pos.z)
+        return FillState(self.is_full(x, y, z))
+
+    def __reduce__(self):
+        return (VoxelMatrix, (self.resolution, bytes(self._buf)))
+
+    def __setitem__(self, pos, fillstate):
+        x, y, z = pos if isinstance(pos, tuple) else (pos.x, pos.y, pos.z)
+        if isinstance(fillstate, FillState):
+            fillstate = fillstate.value
+        if fillstate:
+            self.fill(x, y, z)
+        else:
+            self.void(x, y, z)
+
+    def __str__(self):
+        return f'VoxelMatrix(R={self.resolution}, full={self.count_full()})'
+
+    def _set_buffer(self, data):
+        R = self.resolution
+        self._buf = data
+        self._bits = np.frombuffer(data, dtype=np.uint8).reshape(R, R, self.row_bytes)
+
+    def _unshare(self):
+        self._shares[0] -= 1
+        self._shares = [1]
+        self._set_buffer(bytearray(self._buf))
+
+    # Vectorized is_full over arrays of coordinates
+    def are_full(self, xs, ys, zs):
+        return ((self._bits[xs, ys, zs >> 3] >> (zs & 7)) & 1).astype(np.bool_)
+
+    def count_full(self):
+        return int(POPCOUNT[self._bits].sum(dtype=np.int64))
+
+    def count_region(self, c1, c2):
+        return int(np.count_nonzero(self.get_region(c1, c2)))
+
+    # Returns True if the voxel was Void (and so has been changed).
+    def fill(self, x, y, z):
+        if self._shares[0] != 1:
+            self._unshare()
+        k = (x * self.resolution + y) * self.row_bytes + (z >> 3)
+        mask = 1 << (z & 7)
+        b = self._buf[k]
+        if b & mask:
+            return False
+        self._buf[k] = b | mask
+        return True
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.asarray(array, dtype=np.bool_)
+        R = array.shape[0]
+        Util.nano_assert(array.shape == (R, R, R), f'VoxelMatrix: Array shape is not cubic: {array.shape}')
+        packed = np.packbits(array, axis=2, bitorder='little')
+        result = cls(R)
+        result._bits[...] = packed
+        return result
+
+    # Returns a boolean array covering the inclusive box with corners c1 and c2.
+    def get_region(self, c1, c2):
+        (x0, x1), (y0, y1), (z0, z1) = VoxelMatrix.region_bounds(c1, c2)
+        rows = self._bits[x0:x1 + 1, y0:y1 + 1, z0 >> 3:(z1 >> 3) + 1]
+        bits = np.unpackbits(rows, axis=2, bitorder='little').view(np.bool_)
+        offset = z0 & ~7
+        return bits[:, :, z0 - offset:z1 - offset + 1]
+
+    # Returns a boolean array marking the Full voxels joined to the ground (y = 0) by a chain of face-adjacent
+    # Full voxels. The search advances a whole frontier at a time, over flat voxel indices.
+    def grounded_array(self):
+        R = self.resolution
+        full = self.to_array().reshape(-1)
+        reached = np.zeros_like(full)
+        owner = np.empty(full.size, dtype=np.int32)  # Scratch space for removing duplicates from the frontier
+        frontier = np.flatnonzero(full.reshape(R, R, R)[:, 0, :]).astype(np.int32)
+        frontier = (frontier // R) * R * R + frontier % R
+        reached[frontier] = True
+        while frontier.size:
+            z = frontier % R
+            y = (frontier // R) % R
+            candidates = np.concatenate([frontier[z > 0] - 1, frontier[z < R - 1] + 1,
+                                         frontier[y > 0] - R, frontier[y < R - 1] + R,
+                                         frontier[frontier >= R * R] - R * R,
+                                         frontier[frontier < R**3 - R * R] + R * R])
+            candidates = candidates[full[candidates] & ~reached[candidates]]
+            order = np.arange(candidates.size, dtype=np.int32)
+            owner[candidates] = order
+            frontier = candidates[owner[candidates] == order]
+            reached[frontier] = True
+        return reached.reshape(R, R, R)
+
+    def is_full(self, x, y, z):
+        k = (x * self.resolution + y) * self.row_bytes + (z >> 3)
+        return bool(self._buf[k] & (1 << (z & 7)))
+
+    def is_grounded(self):
+        return int(np.count_nonzero(self.grounded_array())) == self.count_full()
+
+    @staticmethod
+    def region_bounds(c1, c2):
+        return ((min(c1.x, c2.x), max(c1.x, c2.x)),
+                (min(c1.y, c2.y), max(c1.y, c2.y)),
+                (min(c1.z, c2.z), max(c1.z, c2.z)))
+
+    # Sets every voxel in the inclusive box with corners c1 and c2, from a FillState, a bool, or a boolean
+    # array of the box's shape. Returns the number of voxels whose state changed.
+    def set_region(self, c1, c2, value):
+        if self._shares[0] != 1:
+            self._unshare()
+        if isinstance(value, FillState):
+            value = value.value
+        (x0, x1), (y0, y1), (z0, z1) = VoxelMatrix.region_bounds(c1, c2)
+        view = self._bits[x0:x1 + 1, y0:y1 + 1, z0 >> 3:(z1 >> 3) + 1]
+        bits = np.unpackbits(view, axis=2, bitorder='little').view(np.bool_)
+        offset = z0 & ~7
+        region = bits[:, :, z0 - offset:z1 - offset + 1]
+        changed = int(np.count_nonzero(region != value))
+        region[...] = value
+        view[...] = np.packbits(bits, axis=2, bitorder='little')
+        return changed
+
+    # Vectorized fill/void: sets each voxel (xs[k], ys[k], zs[k]) to Full if values[k] is True, or else Void
+    def set_many(self, xs, ys, zs, values):
+        if self._shares[0] != 1:
+            self._unshare()
+        masks = (1 << (zs & 7)).astype(np.uint8)
+        index = (xs, ys, zs >> 3)
+        np.bitwise_or.at(self._bits, tuple(i[values] for i in index), masks[values])
+        np.bitwise_and.at(self._bits, tuple(i[~values] for i in index), ~masks[~values])
+
+    def snapshot(self):
+        result = VoxelMatrix.__new__(VoxelMatrix)
+        result.resolution = self.resolution
+        result.row_bytes = self.row_bytes
+        result._shares = self._shares
+        result._shares[0] += 1
+        result._set_buffer(self._buf)
+        return result
+
+    def to_array(self):
+        R = self.resolution
+        return np.unpackbits(self._bits, axis=2, count=R, bitorder='little').view(np.bool_)
+
+    # Returns True if the voxel was Full (and so has been changed).
+    def void(self, x, y, z):
+        if self._shares[0] != 1:
+            self._unshare()
+        k = (x * self.resolution + y) * self.row_bytes + (z >> 3)
+        mask = 1 << (z & 7)
+        b = self._buf[k]
+        if not b & mask:
+            return False
+        self._buf[k] = b & ~mask
+        return True
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The modules live in python/src, and import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,63 @@
+import os
+from os.path import join
+import time
+
+
+import numpy as np
+
+
+from cache import Cache
+from model import Model
+from voxelmatrix import VoxelMatrix
+
+
+def write_model(filename, seed):
+    a = np.random.default_rng(seed).random((8, 8, 8)) < 0.5
+    Model(filename, matrix=VoxelMatrix.from_array(a)).write()
+    return a
+
+
+def entries(cache):
+    return sorted(os.listdir(cache.entries_dir))
+
+
+def test_changed_model_file_is_rebuilt(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    filename = str(tmp_path / 'X.mdl')
+    a = write_model(filename, 0)
+    assert np.array_equal(cache.load_model(filename).matrix.to_array(), a)
+    assert len(entries(cache)) == 1
+
+    # Rewritten in place, at the same size, and touched
+    st = os.stat(filename)
+    b = write_model(filename, 1)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert np.array_equal(cache.load_model(filename).matrix.to_array(), b)
+    assert len(entries(cache)) == 2
+
+    # Replaced by another file
+    c = write_model(filename + '.new', 2)
+    os.replace(filename + '.new', filename)
+    assert np.array_equal(cache.load_model(filename).matrix.to_array(), c)
+    assert len(entries(cache)) == 3
+
+    # Touched without changing, which re-hashes it to its existing entry
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert np.array_equal(cache.load_model(filename).matrix.to_array(), c)
+    assert len(entries(cache)) == 3
+
+
+def test_storing_past_capacity_evicts_the_least_recently_used(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    filenames = [str(tmp_path / f'{name}.mdl') for name in 'ABC']
+    for seed, filename in enumerate(filenames):
+        write_model(filename, seed)
+    keys = ['mdl-' + cache.file_hash(filename) for filename in filenames]
+
+    cache.load_model(filenames[0])
+    cache.max_bytes = 2.5 * cache._entry_size(join(cache.entries_dir, keys[0]))  # Room for two entries
+    for filename in filenames[1], filenames[0], filenames[2]:  # Loading A again makes B the oldest
+        time.sleep(0.02)  # Apart in modification time
+        cache.load_model(filename)
+    assert entries(cache) == sorted([keys[0], keys[2]])
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+
+import groundedness
+from groundedness import Groundedness
+from voxelmatrix import VoxelMatrix
+
+
+def tracked(R):
+    matrix = VoxelMatrix(R)
+    tracker = Groundedness(matrix)
+    tracker.is_grounded()  # Builds it, so that it's updated voxel by voxel
+    return matrix, tracker
+
+
+def fill(matrix, tracker, x, y, z):
+    if matrix.fill(x, y, z):
+        tracker.fill(x, y, z)
+
+
+def void(matrix, tracker, x, y, z):
+    if matrix.void(x, y, z):
+        tracker.void(x, y, z)
+
+
+def test_void_that_splits_a_component():
+    # An arch: pillars at x = 0 and x = 4, joined by a beam at y = 2
+    matrix, tracker = tracked(6)
+    for y in range(3):
+        fill(matrix, tracker, 0, y, 0)
+        fill(matrix, tracker, 4, y, 0)
+    for x in range(1, 4):
+        fill(matrix, tracker, x, 2, 0)
+    assert tracker.is_grounded()
+
+    void(matrix, tracker, 2, 2, 0)  # Splits the beam, but each half rests on a pillar
+    assert tracker.is_grounded() == matrix.is_grounded() is True
+    void(matrix, tracker, 4, 1, 0)  # Cuts the right half off the ground
+    assert tracker.is_grounded() == matrix.is_grounded() is False
+    fill(matrix, tracker, 2, 2, 0)  # Hangs it from the left half again
+    assert tracker.is_grounded() == matrix.is_grounded() is True
+    void(matrix, tracker, 0, 0, 0)  # Cuts the whole arch off the ground
+    assert tracker.is_grounded() == matrix.is_grounded() is False
+    assert not tracker.dirty
+
+
+# Fills voxels next to Full ones or on the ground, and voids Full ones at random, so that the matrix is often
+# grounded, and voids often split components
+def random_changes(rng, matrix, count):
+    for _ in range(count):
+        full = matrix.to_array()
+        if full.any() and rng.random() < 0.4:
+            yield False, tuple(rng.choice(np.argwhere(full)).tolist())
+            continue
+        touching = np.zeros_like(full)
+        touching[:, 0, :] = True
+        touching[1:] |= full[:-1]
+        touching[:-1] |= full[1:]
+        touching[:, 1:] |= full[:, :-1]
+        touching[:, :-1] |= full[:, 1:]
+        touching[:, :, 1:] |= full[:, :, :-1]
+        touching[:, :, :-1] |= full[:, :, 1:]
+        yield True, tuple(rng.choice(np.argwhere(touching & ~full)).tolist())
+
+
+@pytest.mark.parametrize('limit', [groundedness.VOID_SEARCH_LIMIT, 3])
+def test_random_fills_and_voids_match_the_matrix(monkeypatch, limit):
+    monkeypatch.setattr(groundedness, 'VOID_SEARCH_LIMIT', limit)  # A small limit exercises the rebuilds
+    rng = np.random.default_rng(limit)
+    for _ in range(10):
+        matrix, tracker = tracked(6)
+        for full, (x, y, z) in random_changes(rng, matrix, 300):
+            if full:
+                fill(matrix, tracker, x, y, z)
+            else:
+                void(matrix, tracker, x, y, z)
+            assert tracker.is_grounded() == matrix.is_grounded()
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+from botplan import BotPlan, merge
+from cmdop import CmdOp
+from harmonicsscheduler import HarmonicsScheduler
+from model import Model
+from system import System
+from voxelmatrix import VoxelMatrix
+
+
+# A voxel hanging from another, at resolution 3, which a bot at the origin fills before the one below it
+def hanging_model():
+    a = np.zeros((3, 3, 3), dtype=np.bool_)
+    a[1, 0:2, 0] = True
+    return Model('X.mdl', matrix=VoxelMatrix.from_array(a))
+
+
+def hanging_plan(waits):
+    bot = BotPlan(1, (0, 0, 0))
+    bot.flip()
+    bot.wait(waits)
+    bot.fill(1, 1, 0)  # Ungrounded
+    bot.fill(1, 0, 0)  # Grounds it, in the last step before the Halt
+    bot.wait(waits)
+    bot.halt()
+    return merge([bot])
+
+
+def flip_steps(trace):
+    return np.flatnonzero(trace[0] == CmdOp.Flip).tolist()
+
+
+def test_flip_back_reuses_a_wait_before_the_halt():
+    model = hanging_model()
+    trace = hanging_plan(1)  # Flips in step 0, and never back
+    original_energy, valid = System(model).run(trace)
+    assert not valid
+    result, energy = HarmonicsScheduler(model).schedule(trace)
+    assert System(model).run(result) == (energy, True)
+    assert flip_steps(result) == [1, 4]  # The Waits before and after the ungrounded fill
+    assert len(result[0]) == len(trace[0])
+
+
+def test_flip_back_is_inserted_just_before_the_halt():
+    model = hanging_model()
+    trace = hanging_plan(0)
+    result, energy = HarmonicsScheduler(model).schedule(trace)
+    assert System(model).run(result) == (energy, True)
+    assert flip_steps(result) == [0, 3]
+    assert result[0].tolist() == [CmdOp.Flip, CmdOp.Fill, CmdOp.Fill, CmdOp.Flip, CmdOp.Halt]
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+from cmdop import CmdOp
+from layerplanner import layer_components, LayerPlanner
+from model import Model
+from system import System
+from voxelmatrix import VoxelMatrix
+
+
+def test_layer_components():
+    layer = np.array([[1, 1, 0, 1],
+                      [0, 1, 0, 1],
+                      [1, 0, 0, 1],
+                      [1, 1, 1, 1]], dtype=np.bool_)
+    labels, count = layer_components(layer)
+    assert count == 2
+    assert len(set(labels[:2, :2][layer[:2, :2]].tolist())) == 1
+    assert labels[0, 0] != labels[0, 3] == labels[3, 0]
+    assert not labels[~layer].any()
+
+
+def test_hanging_voxels_run_in_high_harmonics_only_while_ungrounded():
+    R = 10
+    a = np.zeros((R, R, R), dtype=np.bool_)
+    a[2, 0:6, 2] = True  # A pillar, and a beam on top
+    a[7, 3:5, 2] = True  # Hanging from the beam's far end, so resting on nothing until the beam is filled
+    a[2:8, 5, 2] = True
+    model = Model('X.mdl', matrix=VoxelMatrix.from_array(a))
+    planner = LayerPlanner(model)
+    infos = planner.analyze()
+    assert [info.y for info in infos if info.unsupported()] == [3]
+
+    trace = planner.plan()
+    assert planner.ungrounded == 1
+    system = System(model)
+    assert system.run(trace)[1], system.error
+    flips = np.flatnonzero(trace[0] == CmdOp.Flip)
+    assert len(flips) == 2 and flips[0] > 0 and flips[1] < len(trace[0]) - 2
+
+
+def test_fill_order_grounds_a_winding_layer_without_deferring_to_the_last_sweep():
+    R = 12
+    a = np.zeros((R, R, R), dtype=np.bool_)
+    for x in range(1, 11, 2):  # A zigzag: rows along z, joined at alternate ends
+        a[x, 1, 1:11] = True
+        if x > 1:
+            a[x - 1, 1, 10 if x % 4 == 3 else 1] = True
+    a[9, 0, 1] = True  # The only support, at the zigzag's far end, so that sweeps have to follow it back
+    model = Model('X.mdl', matrix=VoxelMatrix.from_array(a))
+    planner = LayerPlanner(model)
+    info = planner.analyze()[1]
+    stops = planner.fill_order(info)
+    filled = [(c + dx, z) for c, z, dxs, _ in stops for dx in dxs]
+    assert sorted(filled) == sorted(zip(*np.nonzero(a[:, 1, :])))
+    assert planner.ungrounded == 0 and not any(loose for *_, loose in stops)
+    done = set()
+    for x, z in filled:
+        assert (x, z) == (9, 1) or done & {(x - 1, z), (x + 1, z), (x, z - 1), (x, z + 1)}
+        done.add((x, z))
@@ -0,0 +1,65 @@
+import io
+
+
+import pytest
+
+
+from cmdop import CmdOp
+from nbt import asm, disasm, main, parse_cmd
+from util import NanoException
+
+
+def test_parse_cmd():
+    assert parse_cmd('@1 SMove <0, 0, -15>') == (CmdOp.SMove, 0, (3, 0, 0, 0))
+    assert parse_cmd('LMove <5, 0, 0> <0, -5, 0>') == (CmdOp.LMove, 0, (1, 10, 2, 0))
+    assert parse_cmd('Fission <1, 0, 1> | 255') == (CmdOp.Fission, 23, (255, 0, 0, 0))
+    assert parse_cmd('GVoid <0, -1, 0> <-30, 0, 30>') == (CmdOp.GVoid, 10, (0, 30, 60, 0))
+
+
+@pytest.mark.parametrize('text', [
+    'SMove <0, 0, 0>',
+    'SMove <0, 0, 16>',
+    'SMove <1, 1, 0>',
+    'LMove <6, 0, 0> <0, 1, 0>',
+    'LMove <1, 0, 0> <0, 0, 0>',
+    'LMove <1, 0, 0> <0, 1, -1>',
+    'Fill <0, 0, 0>',
+    'Fill <1, 1, 1>',
+    'Void <0, 2, 0>',
+    'Fission <1, 0, 0> | 256',
+    'Fission <1, 0, 0> | -1',
+    'GFill <0, -1, 0> <31, 0, 0>',
+    'GFill <0, -1, 0> <0, 0, -31>',
+])
+def test_parse_cmd_rejects_operands_out_of_range(text):
+    with pytest.raises(NanoException):
+        parse_cmd(text)
+
+
+def test_asm_reports_line_number(tmp_path):
+    text = '0: @1 Flip\n# Comment\n1: @1 SMove <0, 0, 20>\n'
+    with pytest.raises(NanoException, match='^Line 3: '):
+        asm(io.StringIO(text), str(tmp_path / 'trace.nbt'))
+
+
+def test_asm_disasm_round_trip(tmp_path):
+    text = ('0: @1 Fission <1, 0, 0> | 2\n'
+            '1: @1 SMove <0, 0, 3>; @2 Fill <0, -1, 0>\n'
+            '2: @1 LMove <0, 0, -3> <0, 1, 0>; @2 Wait\n'
+            '3: @1 SMove <0, -1, 0>; @2 Wait\n'
+            '4: @1 FusionP <1, 0, 0>; @2 FusionS <-1, 0, 0>\n'
+            '5: @1 Halt\n')
+    filename = str(tmp_path / 'trace.nbt')
+    asm(io.StringIO(text), filename)
+    out = io.StringIO()
+    disasm(filename, out)
+    assert out.getvalue().split('\n', 1)[1] == text
+
+
+def test_disasm_rejects_fission_without_seeds(tmp_path, capsys):
+    text = ('0: @1 Fission <1, 0, 0> | 38\n'  # Hands bot 2 every seed left
+            '1: @1 Fission <0, 1, 0> | 0; @2 Wait\n')
+    filename = str(tmp_path / 'trace.nbt')
+    asm(io.StringIO(text), filename)
+    assert main(['disasm', filename]) == 2
+    assert capsys.readouterr().err == 'nbt: Fission without seeds by bot 1 at step 1\n'
@@ -0,0 +1,142 @@
+import heapq
+import time
+
+
+import numpy as np
+
+
+from botplan import BotPlan
+from cmdop import CmdOp
+from pathfinder import GUIDED_WEIGHT, Occupancy, PathFinder
+from voxelmatrix import VoxelMatrix
+
+
+def walk(blocked, src, legs):
+    pos = list(src)
+    for axis, dist in legs:
+        k = 'xyz'.index(axis)
+        for _ in range(abs(dist)):
+            pos[k] += 1 if dist > 0 else -1
+            assert not blocked[tuple(pos)], f'Path goes through blocked voxel {pos}'
+    return tuple(pos)
+
+
+# The energy of moving along legs, as BotPlan turns them into moves: 2 per voxel, 4 per LMove and 20 per move
+def move_energy(src, legs):
+    plan = BotPlan(1, src)
+    plan.move_legs(legs)
+    lmoves = sum(op == CmdOp.LMove for op in plan.ops)
+    return 2 * sum(abs(d) for _, d in legs) + 4 * lmoves + 20 * len(plan.ops)
+
+
+# The cheapest energy of moving from src to dst, by Dijkstra's algorithm over every SMove and LMove
+def cheapest_energy(blocked, src, dst):
+    R = blocked.shape[0]
+
+    def legs_from(pos, axis, limit):
+        for sign in (1, -1):
+            p = list(pos)
+            for n in range(1, limit + 1):
+                p[axis] += sign
+                if not 0 <= p[axis] < R or blocked[tuple(p)]:
+                    break
+                yield tuple(p), n
+
+    energies = {src: 0}
+    heap = [(0, src)]
+    while heap:
+        energy, pos = heapq.heappop(heap)
+        if pos == dst:
+            return energy
+        if energy > energies[pos]:
+            continue
+        moves = []
+        for axis in range(3):
+            for mid, n in legs_from(pos, axis, 15):
+                moves.append((mid, 2 * n + 20))
+                if n <= 5:
+                    for axis2 in set(range(3)) - {axis}:
+                        moves.extend((end, 2 * (n + n2) + 24) for end, n2 in legs_from(mid, axis2, 5))
+        for nxt, cost in moves:
+            if energy + cost < energies.get(nxt, energy + cost + 1):
+                energies[nxt] = energy + cost
+                heapq.heappush(heap, (energy + cost, nxt))
+    return None
+
+
+def wall_with_opening(R, opening, seed=0):
+    blocked = np.random.default_rng(seed).random((R, R, R)) < 0.02
+    blocked[R // 2] = True
+    if opening:
+        blocked[R // 2][opening] = False
+    return blocked
+
+
+def test_direct_path():
+    blocked = np.zeros((20, 20, 20), dtype=np.bool_)
+    legs = PathFinder(Occupancy(VoxelMatrix.from_array(blocked))).find((0, 0, 0), (19, 7, 3))
+    assert walk(blocked, (0, 0, 0), legs) == (19, 7, 3)
+    assert sum(abs(d) for _, d in legs) == 29
+
+
+def test_shortest_path_around_obstacle():
+    blocked = np.zeros((10, 10, 10), dtype=np.bool_)
+    blocked[5, :9, :] = True  # A wall, open at the top
+    legs = PathFinder(Occupancy(VoxelMatrix.from_array(blocked))).find((0, 0, 0), (9, 0, 0))
+    assert walk(blocked, (0, 0, 0), legs) == (9, 0, 0)
+    assert sum(abs(d) for _, d in legs) == 9 + 2 * 9
+
+
+def test_search_finds_the_cheapest_path():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        blocked = rng.random((8, 8, 8)) < 0.3
+        src, dst = (0, 0, 0), (7, 7, 7)
+        blocked[src] = blocked[dst] = False
+        finder = PathFinder(Occupancy(VoxelMatrix.from_array(blocked)))
+        cheapest = cheapest_energy(blocked, src, dst)
+        legs = finder.search(src, dst, 1_000_000)
+        if cheapest is None:
+            assert legs is None
+            continue
+        assert walk(blocked, src, legs) == dst
+        assert move_energy(src, legs) == cheapest
+
+        # Guided by the coarse grid, the heuristic is weighted, which bounds how much more the path costs
+        legs = finder.search(src, dst, 1_000_000, finder.block_distances(dst), weight=GUIDED_WEIGHT)
+        assert walk(blocked, src, legs) == dst
+        assert move_energy(src, legs) <= GUIDED_WEIGHT * cheapest
+
+
+def test_wall_with_one_opening_at_r250():
+    src, dst = (10, 10, 10), (240, 5, 5)
+    blocked = wall_with_opening(250, (200, 200))
+    blocked[src] = blocked[dst] = False
+    finder = PathFinder(Occupancy(VoxelMatrix.from_array(blocked)))
+    start = time.perf_counter()
+    legs = finder.find(src, dst)
+    seconds = time.perf_counter() - start
+    assert legs is not None
+    assert walk(blocked, src, legs) == dst
+    shortest = (240 - 10) + (200 - 10) + (200 - 5) + (200 - 10) + (200 - 5)
+    assert sum(abs(d) for _, d in legs) <= 1.05 * shortest
+    assert move_energy(src, legs) <= 1.05 * (2 * shortest + 20 * -(-shortest // 15))
+    assert seconds < 1.5
+
+
+def test_wall_without_opening_at_r250():
+    src, dst = (10, 10, 10), (240, 5, 5)
+    blocked = wall_with_opening(250, None)
+    blocked[src] = blocked[dst] = False
+    occupancy = Occupancy(VoxelMatrix.from_array(blocked))
+    finder = PathFinder(occupancy)
+    start = time.perf_counter()
+    assert finder.find(src, dst) is None
+    assert time.perf_counter() - start < 1.5
+
+    # The coarse grid follows changes to the occupancy
+    occupancy.unblock(125, 100, 100)
+    legs = finder.find(src, dst)
+    assert legs is not None and walk(occupancy.blocked.to_array(), src, legs) == dst
+    occupancy.block(125, 100, 100)
+    assert finder.find(src, dst) is None
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+
+import benchmark
+from energyestimator import EnergyEstimator
+from harmonicsscheduler import HarmonicsScheduler
+from model import Model
+from portfolio import PLANNERS
+from system import System
+from traceoptimizer import TraceOptimizer
+from voxelmatrix import VoxelMatrix
+
+
+# Returns a random grounded model: columns of Full voxels rising from the ground, within the region that
+# target models may fill
+def random_model(R, seed):
+    rng = np.random.default_rng(seed)
+    a = np.zeros((R, R, R), dtype=np.bool_)
+    a[1:R - 1, 0:R - 1, 1:R - 1] = rng.random((R - 2, R - 1, R - 2)) < rng.random()
+    return Model('X.mdl', matrix=VoxelMatrix.from_array(np.cumprod(a, axis=1).astype(np.bool_)))
+
+
+def empty_model(R):
+    return Model('X.mdl', matrix=VoxelMatrix(R))
+
+
+MODELS = [(R, seed) for R in (3, 4, 5, 8) for seed in range(3)]
+
+
+def problems():
+    for R, seed in MODELS:
+        model = random_model(R, seed)
+        yield f'assembly-{R}-{seed}', model, None
+        yield f'disassembly-{R}-{seed}', empty_model(R), model
+        yield f'reassembly-{R}-{seed}', random_model(R, seed + 100), model
+    model = Model('X.mdl', data=benchmark.synthetic_model(12, 1))
+    yield 'assembly-synthetic', model, None
+    yield 'disassembly-synthetic', empty_model(12), model
+
+
+CASES = [pytest.param(name, model, source, planner, id=f'{planner}-{name}')
+         for name, model, source in problems() for planner, (_, applies) in PLANNERS.items()
+         if applies(model, source)]
+
+
+@pytest.mark.parametrize('name, model, source, planner', CASES)
+def test_planner(name, model, source, planner):
+    plan, _ = PLANNERS[planner]
+    trace = plan(model, source)
+    system = System(model, source)
+    energy, valid = system.run(trace)
+    assert valid, system.error
+    estimator = EnergyEstimator(model, source)
+    assert estimator.estimate(trace) == energy
+    assert estimator.lower_bound() <= energy
+
+    # Post-processing, as Portfolio does, keeps the trace valid and never makes it worse
+    trace, optimized = TraceOptimizer(model, source).optimize(trace)
+    trace, scheduled = HarmonicsScheduler(model, source).schedule(trace)
+    system = System(model, source)
+    assert system.run(trace) == (scheduled, True), system.error
+    assert scheduled <= optimized <= energy
+    assert estimator.estimate(trace) == scheduled
@@ -0,0 +1,80 @@
+import multiprocessing
+import time
+
+
+import numpy as np
+
+
+from botplan import BotPlan, merge
+from energyestimator import EnergyEstimator
+from model import Model
+import portfolio
+from portfolio import PLANNERS, run_planner
+from system import System
+from traceoptimizer import TraceOptimizer
+from voxelmatrix import VoxelMatrix
+
+
+def one_voxel_model():
+    a = np.zeros((8, 8, 8), dtype=np.bool_)
+    a[1, 0, 1] = True
+    return Model('X.mdl', matrix=VoxelMatrix.from_array(a))
+
+
+# Fills the model's voxel, then wanders back and forth a voxel at a time, which TraceOptimizer merges away
+def wandering_plan(model, source):
+    bot = BotPlan(1, (0, 0, 0))
+    bot.move_to(1, 1, 1)
+    bot.fill(0, -1, 0)
+    for d in [1] * 6 + [-1] * 6:
+        bot.smove('x', d)
+    bot.move_to(0, 1, 0, order='xz')
+    bot.move_to(0, 0, 0)
+    bot.halt()
+    return merge([bot])
+
+
+def test_planner_that_wins_after_optimizing_is_not_pruned(monkeypatch):
+    model = one_voxel_model()
+    raw = wandering_plan(model, None)
+    _, optimized = TraceOptimizer(model).optimize(raw)
+    estimate = EnergyEstimator(model).estimate(raw)
+    assert System(model).run(raw)[0] == estimate > optimized
+    monkeypatch.setitem(PLANNERS, 'wandering', (wandering_plan, lambda model, source: True))
+    best_energy = multiprocessing.Value('d', (estimate + optimized) / 2)
+    monkeypatch.setattr(portfolio, '_best_energy', best_energy)
+
+    result = run_planner('wandering', model)
+    assert result['status'] == 'ok' and result['valid']
+    assert result['trace'] is not None
+    assert best_energy.value == result['energy'] <= optimized
+
+
+def test_planner_past_its_timeout_times_out(monkeypatch):
+    monkeypatch.setitem(PLANNERS, 'sleeping', (lambda model, source: time.sleep(5), lambda model, source: True))
+    result = run_planner('sleeping', one_voxel_model(), timeout=0.05)
+    assert result['status'] == 'timeout' and result['trace'] is None
+    assert result['seconds'] < 1
+    time.sleep(0.1)  # The timer was cancelled, so no alarm goes off later
+
+
+def test_planner_that_cant_win_is_pruned(monkeypatch):
+    model = one_voxel_model()
+    estimator = EnergyEstimator(model)
+    _, optimized = TraceOptimizer(model).optimize(wandering_plan(model, None))
+
+    # Before planning, if even the lower bound can't beat the best energy
+    def plan(model, source):
+        raise AssertionError('Planned, though the lower bound was beaten')
+    monkeypatch.setitem(PLANNERS, 'hopeless', (plan, lambda model, source: True))
+    best_energy = multiprocessing.Value('d', estimator.lower_bound() - 1)
+    monkeypatch.setattr(portfolio, '_best_energy', best_energy)
+    result = run_planner('hopeless', model)
+    assert result['status'] == 'pruned' and result['energy'] == estimator.lower_bound()
+
+    # After optimizing, if the trace's estimate can't
+    monkeypatch.setitem(PLANNERS, 'wandering', (wandering_plan, lambda model, source: True))
+    best_energy.value = optimized - 1
+    result = run_planner('wandering', model)
+    assert result['status'] == 'pruned' and result['energy'] == optimized
+    assert result['trace'] is None and best_energy.value == optimized - 1
@@ -0,0 +1,36 @@
+from os.path import join
+
+
+from botplan import BotPlan, merge
+from solutionstore import SolutionStore
+
+
+def halting_plan(waits):
+    bot = BotPlan(1, (0, 0, 0))
+    bot.wait(waits)
+    bot.halt()
+    return merge([bot])
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as ifile:
+        return ifile.read()
+
+
+def test_worse_trace_leaves_the_best_unchanged(tmp_path):
+    store = SolutionStore(str(tmp_path))
+    nbt = join(str(tmp_path), 'X.nbt')
+    assert store.submit('X', halting_plan(1), 100, 'better', 'hash', 50)
+    stored = read_bytes(nbt)
+    record = store.best('X', 'hash')
+
+    for energy in 200, 100:  # Worse, and no better
+        assert not store.submit('X', halting_plan(5), energy, 'worse', 'hash', 50)
+        assert store.best('X', 'hash') == record
+        assert read_bytes(nbt) == stored
+    assert record['energy'] == 100 and record['planner'] == 'better'
+
+    # Unless the problem's files have changed
+    assert store.submit('X', halting_plan(5), 200, 'worse', 'new hash', 50)
+    assert store.best('X', 'new hash')['energy'] == 200
+    assert read_bytes(nbt) != stored
@@ -0,0 +1,58 @@
+import pytest
+
+
+from botplan import BotPlan, merge
+from cmdop import CmdOp
+from columnartrace import INITIAL_SEEDS
+from model import Model
+from stepscheduler import StepScheduler
+from system import System
+from util import NanoException, Vec
+from voxelmatrix import VoxelMatrix
+
+
+def empty_model(R):
+    return Model('X.mdl', matrix=VoxelMatrix(R))
+
+
+def test_crossing_bots_are_serialized():
+    root = BotPlan(1, (0, 0, 0), seeds=list(INITIAL_SEEDS))
+    child = root.fission(0, 1, 0, 0)
+    root.smove('x', 3)
+    child.lmove('x', 2, 'y', -1)  # Through (2, 0, 0), which root passes in the same step
+    root.fuse(child)
+    root.smove('x', -3)
+    root.halt()
+    model = empty_model(6)
+
+    naive = System(model)
+    assert not naive.run(merge([root, child]))[1]
+    assert naive.error.startswith('Interference')
+
+    trace, plans = StepScheduler(model).schedule([root, child])
+    system = System(model)
+    assert system.run(trace)[1], system.error
+    assert sorted(p.bid for p in plans) == [1, 2]
+
+
+def test_invalid_queued_move_is_reported_on_reroute():
+    root = BotPlan(1, (0, 0, 0), seeds=list(INITIAL_SEEDS))
+    child = root.fission(0, 0, 1, 0)
+    root.smove('x', 2)
+    root.wait(10)  # Stays where the child is headed, so that it's re-routed
+    child.lmove('x', 2, 'z', -1)
+    child.add(CmdOp.SMove, 0, (1, 15, 0, 0))  # A move of length 0
+    with pytest.raises(NanoException, match='Invalid move for bot 2'):
+        StepScheduler(empty_model(6)).schedule([root, child])
+
+
+def test_group_whose_region_holds_one_of_its_bots_never_runs():
+    root = BotPlan(1, (0, 0, 0), seeds=list(INITIAL_SEEDS))
+    child = root.fission(1, 0, 0, 0)
+    child.smove('x', 4)
+    root.smove('x', 2)
+    root.gfill(Vec(-1, 0, 0), Vec(3, 0, 0))  # Fills x = 1 to 4, through root's own position
+    child.gfill(Vec(-1, 0, 0), Vec(-3, 0, 0))
+    scheduler = StepScheduler(empty_model(8))
+    with pytest.raises(NanoException, match='Deadlock'):
+        scheduler.schedule([root, child])
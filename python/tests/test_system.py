@@ -0,0 +1,110 @@
+import numpy as np
+
+
+from cmdop import CmdOp
+from model import Model
+from system import System
+from util import Util, Vec
+
+
+def model_of(R, cells=()):
+    a = np.zeros((R, R, R), dtype=np.bool_)
+    for cell in cells:
+        a[cell] = True
+    return Model('X.mdl', Model.encode_matrix(a))
+
+
+# Commands in columnar form, as (op, nd, args). Axes are 1 for x, 2 for y and 3 for z, as encoded.
+def smove(axis, d):
+    return CmdOp.SMove, 0, (axis, d + 15, 0, 0)
+
+
+def lmove(axis1, d1, axis2, d2):
+    return CmdOp.LMove, 0, (axis1, d1 + 5, axis2, d2 + 5)
+
+
+def near(op, dx, dy, dz, m=0):
+    return op, Util.encode_ncd(Vec(dx, dy, dz)), (m, 0, 0, 0)
+
+
+def group(op, nd, fd):
+    return op, Util.encode_ncd(Vec(*nd)), tuple(d + 30 for d in fd) + (0,)
+
+
+HALT = CmdOp.Halt, 0, (0, 0, 0, 0)
+WAIT = CmdOp.Wait, 0, (0, 0, 0, 0)
+FLIP = CmdOp.Flip, 0, (0, 0, 0, 0)
+
+
+# Returns the columnar form of a trace, given the commands of each step, in order of bid
+def trace_of(*steps):
+    ops, nds, args = zip(*[cmd for step in steps for cmd in step])
+    return np.array(ops, dtype=np.uint8), np.array(nds, dtype=np.uint8), np.array(args, dtype=np.uint8)
+
+
+# Returns the energy of steps charged in Low and High harmonics, and of bot-steps, at resolution R
+def step_energy(R, low=0, high=0, bot_steps=0):
+    return 3 * R**3 * low + 30 * R**3 * high + 20 * bot_steps
+
+
+def test_fill_and_moves():
+    trace = trace_of([lmove(1, 1, 2, 1)],  # 2 * 2 + 4
+                     [smove(3, 1)],  # 2
+                     [near(CmdOp.Fill, 0, -1, 0)],  # 12
+                     [smove(3, -1)],
+                     [lmove(1, -1, 2, -1)],
+                     [HALT])
+    system = System(model_of(3, [(1, 0, 1)]))
+    assert system.run(trace) == (step_energy(3, low=6, bot_steps=6) + 8 + 2 + 12 + 2 + 8, True)
+
+
+def test_flip_charges_high_harmonics_from_the_next_step():
+    system = System(model_of(3))
+    assert system.run(trace_of([FLIP], [WAIT], [FLIP], [HALT])) == (step_energy(3, low=2, high=2, bot_steps=4), True)
+
+
+def test_ungrounded_fill_in_low_harmonics_is_invalid():
+    steps = [[lmove(1, 1, 2, 2)], [smove(3, 1)], [near(CmdOp.Fill, 0, -1, 0)], [HALT]]  # Fills (1, 1, 1)
+    system = System(model_of(4, [(1, 1, 1)]))
+    assert not system.run(trace_of(*steps))[1]
+    assert system.error.startswith('Ungrounded')
+
+    system = System(model_of(4, [(1, 1, 1)]))
+    assert not system.run(trace_of([FLIP], *steps))[1]  # Halts in High harmonics
+
+
+def test_fission_and_fusion():
+    trace = trace_of([near(CmdOp.Fission, 1, 0, 0, m=3)],  # 24
+                     [near(CmdOp.FusionP, 1, 0, 0), near(CmdOp.FusionS, -1, 0, 0)],  # -24
+                     [HALT])
+    system = System(model_of(3))
+    assert system.run(trace) == (step_energy(3, low=3, bot_steps=4), True)
+
+
+def test_interference_is_invalid():
+    trace = trace_of([near(CmdOp.Fission, 1, 0, 0)],
+                     [smove(3, 2), lmove(1, -1, 3, 1)],  # Both through (0, 0, 1)
+                     [near(CmdOp.FusionP, 1, 0, 0), near(CmdOp.FusionS, -1, 0, 0)],
+                     [HALT])
+    system = System(model_of(4))
+    assert not system.run(trace)[1]
+    assert system.error.startswith('Interference')
+
+
+def test_unfinished_model_is_invalid():
+    system = System(model_of(3, [(1, 0, 1)]))
+    assert not system.run(trace_of([HALT]))[1]
+
+
+def test_group_fill_and_void():
+    trace = trace_of([near(CmdOp.Fission, 0, 1, 0)],
+                     [smove(3, 1), lmove(1, 2, 3, 1)],  # 2, and 2 * 3 + 4
+                     [group(CmdOp.GFill, (1, 0, 0), (1, 0, 0)),  # 2 * 12, for (1, 0, 1) and (2, 0, 1)
+                      group(CmdOp.GFill, (0, -1, 0), (-1, 0, 0))],
+                     [group(CmdOp.GVoid, (1, 0, 0), (1, 0, 0)),  # 2 * -12
+                      group(CmdOp.GVoid, (0, -1, 0), (-1, 0, 0))],
+                     [smove(3, -1), lmove(3, -1, 1, -2)],
+                     [near(CmdOp.FusionP, 0, 1, 0), near(CmdOp.FusionS, 0, -1, 0)],
+                     [HALT])
+    system = System(model_of(4))
+    assert system.run(trace) == (step_energy(4, low=7, bot_steps=12) + 2 * (2 + 10), True)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+
+from cmdop import CmdOp
+from columnartrace import Trace
+from tracecodec import TraceCodec
+from util import NanoException
+
+
+# The encodings given as examples in the task specification, with their columnar forms
+SPEC_EXAMPLES = [
+    ('Halt', (CmdOp.Halt, 0, (0, 0, 0, 0)), [0b11111111]),
+    ('Wait', (CmdOp.Wait, 0, (0, 0, 0, 0)), [0b11111110]),
+    ('Flip', (CmdOp.Flip, 0, (0, 0, 0, 0)), [0b11111101]),
+    ('SMove <12, 0, 0>', (CmdOp.SMove, 0, (1, 27, 0, 0)), [0b00010100, 0b00011011]),
+    ('SMove <0, 0, -4>', (CmdOp.SMove, 0, (3, 11, 0, 0)), [0b00110100, 0b00001011]),
+    ('LMove <3, 0, 0> <0, -5, 0>', (CmdOp.LMove, 0, (1, 8, 2, 0)), [0b10011100, 0b00001000]),
+    ('LMove <0, -2, 0> <0, 0, 2>', (CmdOp.LMove, 0, (2, 3, 3, 7)), [0b11101100, 0b01110011]),
+    ('FusionP <-1, 1, 0>', (CmdOp.FusionP, 7, (0, 0, 0, 0)), [0b00111111]),
+    ('FusionS <1, -1, 0>', (CmdOp.FusionS, 19, (0, 0, 0, 0)), [0b10011110]),
+    ('Fission <0, 0, 1> | 5', (CmdOp.Fission, 14, (5, 0, 0, 0)), [0b01110101, 0b00000101]),
+    ('Fill <0, -1, 0>', (CmdOp.Fill, 10, (0, 0, 0, 0)), [0b01010011]),
+    ('Void <1, 0, 1>', (CmdOp.Void, 23, (0, 0, 0, 0)), [0b10111010]),
+    ('GFill <0, -1, 0> <10, -15, 20>', (CmdOp.GFill, 10, (40, 15, 50, 0)),
+     [0b01010001, 0b00101000, 0b00001111, 0b00110010]),
+    ('GVoid <1, 0, 0> <5, 5, -5>', (CmdOp.GVoid, 22, (35, 35, 25, 0)),
+     [0b10110000, 0b00100011, 0b00100011, 0b00011001]),
+]
+SPEC_BYTES = bytes(byte for _, _, encoded in SPEC_EXAMPLES for byte in encoded)
+
+
+def spec_arrays(copies=1):
+    ops, nds, args = zip(*[cmd for _, cmd, _ in SPEC_EXAMPLES])
+    return (np.tile(np.array(ops, dtype=np.uint8), copies), np.tile(np.array(nds, dtype=np.uint8), copies),
+            np.tile(np.array(args, dtype=np.uint8), (copies, 1)))
+
+
+def assert_same(a, b):
+    for x, y in zip(a, b):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_encode_matches_spec_examples():
+    assert bytes(TraceCodec.encode_arrays(*spec_arrays())) == SPEC_BYTES
+
+
+def test_round_trip():
+    assert_same(TraceCodec.decode_arrays(SPEC_BYTES), spec_arrays())
+    assert TraceCodec.encode(list(TraceCodec.iter_decode(SPEC_BYTES))) == SPEC_BYTES
+
+
+def test_file_round_trip(tmp_path):
+    filename = str(tmp_path / 'trace.nbt')
+    TraceCodec.write_trace(filename, spec_arrays(1000))
+    assert_same(TraceCodec.read_arrays(filename), spec_arrays(1000))
+
+
+def test_trace_round_trip(tmp_path):
+    trace = Trace(*spec_arrays(1000))
+    assert_same(Trace.from_cmds(trace.cmds()), trace)
+    filename = str(tmp_path / 'trace.nbt')
+    trace.write(filename)
+    assert_same(Trace.read(filename), trace)
+
+
+def test_chunked_reads(tmp_path):
+    filename = str(tmp_path / 'trace.nbt')
+    TraceCodec.write_trace(filename, spec_arrays(1000))
+    chunks = list(TraceCodec.iter_arrays(filename, chunk_bytes=100))
+    assert len(chunks) > 1
+    assert_same([np.concatenate([chunk[k] for chunk in chunks]) for k in range(3)], spec_arrays(1000))
+
+
+def test_cmd_text_matches_spec_examples():
+    assert [str(cmd) for cmd in TraceCodec.iter_decode(SPEC_BYTES)] == [text for text, _, _ in SPEC_EXAMPLES]
+
+
+def test_truncated_trace_is_rejected(tmp_path):
+    filename = str(tmp_path / 'trace.nbt')
+    with open(filename, 'wb') as ofile:
+        ofile.write(SPEC_BYTES[:-1])  # Cuts the last GVoid short
+    with pytest.raises(NanoException):
+        TraceCodec.read_arrays(filename)
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+from botplan import BotPlan, merge
+from boxplanner import INITIAL_SEEDS
+from cmdop import CmdOp
+from model import Model
+from system import System
+from traceoptimizer import TraceOptimizer
+from voxelmatrix import VoxelMatrix
+
+
+def test_merge_across_a_voxel_voided_in_its_steps_is_rejected_alone():
+    R = 6
+    a = np.zeros((R, R, R), dtype=np.bool_)
+    a[3, 0, 0] = True
+    model = Model('X.mdl', matrix=VoxelMatrix(R))
+    source = Model('X.mdl', matrix=VoxelMatrix.from_array(a))
+
+    bot = BotPlan(1, (0, 0, 0), seeds=INITIAL_SEEDS)
+    child = bot.fission(0, 1, 0, 0)
+    bot.wait()
+    child.smove('x', 3)
+    bot.smove('x', 1)  # Merged with the next move
+    child.wait()
+    bot.smove('x', 1)
+    child.void(0, -1, 0)  # (3, 0, 0), which merging the next move too would cross a step early
+    bot.smove('x', 3)
+    child.wait()
+    bot.smove('x', -2)  # Merged with the one before
+    child.wait()
+    bot.fuse(child)
+    bot.smove('x', -3)
+    bot.halt()
+    trace = merge([bot, child])
+    energy, valid = System(model, source).run(trace)
+    assert valid
+
+    optimizer = TraceOptimizer(model, source)
+    result, optimized = optimizer.optimize(trace)
+    assert System(model, source).run(result) == (optimized, True)
+    assert optimized < energy
+    assert [(first, last) for first, last, _ in optimizer.merges] == [(2, 3), (4, 5)]
+    assert (result[0] == CmdOp.SMove).sum() == 4
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+
+from util import Vec
+from voxelmatrix import VoxelMatrix
+
+
+def random_array(R, seed=0):
+    return np.random.default_rng(seed).random((R, R, R)) < 0.3
+
+
+@pytest.mark.parametrize('R', [1, 5, 9, 13, 20])
+def test_array_round_trip_when_rows_are_padded(R):
+    a = random_array(R)
+    matrix = VoxelMatrix.from_array(a)
+    assert np.array_equal(matrix.to_array(), a)
+    assert matrix.count_full() == np.count_nonzero(a)  # No stray bits in the padding of each row
+    x, y, z = np.argwhere(a)[0] if a.any() else (0, 0, 0)
+    assert matrix.is_full(x, y, z) == a[x, y, z]
+    assert VoxelMatrix(R, bytes(matrix._buf)) == matrix
+
+
+def test_writes_to_the_parent_leave_a_snapshot_unchanged():
+    a = random_array(13)
+    parent = VoxelMatrix.from_array(a)
+    snapshot = parent.snapshot()
+    second = parent.snapshot()
+    x, y, z = np.argwhere(a)[0]
+    parent.void(x, y, z)
+    parent.fill(*np.argwhere(~a)[0])
+    parent.set_region(Vec(0, 0, 0), Vec(12, 0, 12), True)
+    parent.set_many(np.array([1, 2]), np.array([3, 4]), np.array([5, 6]), np.array([True, False]))
+    assert np.array_equal(snapshot.to_array(), a)
+    assert np.array_equal(second.to_array(), a)
+
+    # And the other way round, between the snapshots left sharing a buffer
+    second.void(x, y, z)
+    assert snapshot.is_full(x, y, z) and not second.is_full(x, y, z)
+    assert np.array_equal(snapshot.to_array(), a)